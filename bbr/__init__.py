@@ -1 +1,9 @@
-from .bbr import BBR, CongestionController, CongestionDecision
+from .bbr import MSS, BBR, CongestionController, CongestionDecision
+from .bbr2 import BBRv2
+from .cubic import Cubic
+from .delivery_rate import DeliveryRateSampler, MaxFilter, RateSample, SentPacket
+from .newreno import NewReno
+from .path_cache import PathCache, PathMetrics
+from .qlog import QlogWriter
+from .registry import create, register
+from .rtt_window import RTTWindow
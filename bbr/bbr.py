@@ -1,5 +1,12 @@
+import math
 from dataclasses import dataclass
 
+from .delivery_rate import DeliveryRateSampler, MaxFilter, SentPacket, RateSample
+from .path_cache import PathMetrics
+from .rtt_window import RTTWindow
+
+MSS = 1200
+
 
 @dataclass
 class CongestionDecision:
@@ -9,109 +16,305 @@ class CongestionDecision:
     avg_rtt: float = 0.0
     rtprop: float = 0.0
     rtprop_reset: bool = False
+    pacing_rate: float = 0.0
+    btlbw: float = 0.0
 
 
 class CongestionController:
-    def on_ack(self, rtt: float):
-        raise NotImplementedError
+    """
+    The sender reports every packet it sends and every ACK; update()
+    answers with the window and pacing rate. on_packet_sent() returns a
+    SentPacket the sender keeps until the packet is acknowledged and then
+    hands back to on_ack(), so each ACK carries the delivery-rate state
+    of the moment its packet left.
+
+    Subclasses implement decide(). With a tracer (a qlog.QlogWriter)
+    attached, update() also records every change of window, pacing, RTT
+    or state.
+    """
+
+    def __init__(self):
+        self.sampler = DeliveryRateSampler()
+        self.bytes_in_flight = 0
+        self.tracer = None
+        self._traced_metrics = {}
+        self._traced_state = None
+
+    def on_packet_sent(self, size: int, now: float, bytes_in_flight: int,
+                       retransmission: bool = False) -> SentPacket:
+        """bytes_in_flight: what the sender had outstanding before this packet."""
+        self.bytes_in_flight = bytes_in_flight + size
+        return self.sampler.on_packet_sent(size, now, bytes_in_flight, retransmission)
+
+    def on_app_limited(self, bytes_in_flight: int):
+        self.sampler.on_app_limited(bytes_in_flight)
+
+    def on_ack(self, packet: SentPacket, now: float) -> RateSample:
+        self.bytes_in_flight = max(0, self.bytes_in_flight - packet.size)
+        return self.sampler.on_ack(packet, now)
+
+    def on_loss(self, packet: SentPacket, now: float):
+        """The sender gave packet up for lost (it may resend the data as a new packet)."""
+        self.bytes_in_flight = max(0, self.bytes_in_flight - packet.size)
+        self.sampler.on_packet_lost(packet)
+
+    def on_ecn_ce(self, count: int, now: float):
+        """The peer reported count more packets arriving with the ECN-CE mark."""
+
+    def warm_start(self, metrics: PathMetrics, now: float):
+        """Start from what an earlier connection on the same path measured (path_cache)."""
+
+    def path_metrics(self, now: float):
+        """What this connection measured, for the next one on the path, or None."""
+        return None
 
     def update(self, now: float) -> CongestionDecision:
+        decision = self.decide(now)
+        if self.tracer:
+            self._trace(decision, now)
+        return decision
+
+    def decide(self, now: float) -> CongestionDecision:
         raise NotImplementedError
 
+    def _trace(self, decision: CongestionDecision, now: float):
+        metrics = {
+            'congestion_window': decision.cwnd * MSS,
+            'bytes_in_flight': self.bytes_in_flight,
+            'smoothed_rtt': round(decision.avg_rtt * 1000, 3),
+            'min_rtt': round(decision.rtprop * 1000, 3),
+            'pacing_rate': int(decision.pacing_rate * 8),
+        }
+        # qlog: only the fields that changed
+        changed = {name: value for name, value in metrics.items() if self._traced_metrics.get(name) != value}
+        if changed:
+            self.tracer.metrics_updated(now, changed)
+            self._traced_metrics = metrics
+        if decision.state != self._traced_state:
+            self.tracer.congestion_state_updated(now, self._traced_state, decision.state)
+            self._traced_state = decision.state
+
 
 class BBR(CongestionController):
-    RTT_THRESHOLD = 1.25
-    DRAIN_EXIT = 1.10
-    CRUISE_DURATION = 5.0
+    """
+    Model-based congestion control: BtlBw is the highest delivery rate of
+    the last BTLBW_ROUNDS round trips, RTprop the lowest RTT of the last
+    PROBE_RTT_INTERVAL seconds, and their product the BDP. Each state only
+    picks two gains:
+
+        pacing_rate = pacing_gain × BtlBw
+        cwnd        = cwnd_gain × BtlBw × RTprop
+
+    The state machine runs on every ACK and counts time in round trips, so
+    it reacts as fast on a 1 ms path as on a 300 ms one. STARTUP paces at
+    2/ln 2 to double the delivery rate every round, and ends once BtlBw
+    has grown less than FULL_BW_THRESH× in FULL_BW_ROUNDS rounds: the pipe
+    is full, after about log2(BDP) rounds. DRAIN paces below BtlBw until no
+    more than a BDP is in flight, emptying the queue STARTUP built.
+    PROBE_BW cycles through PROBE_BW_GAINS, one phase per RTprop: 1.25× to
+    find more bandwidth, 0.75× to drain what that queued, then cruise at
+    the estimate. When RTprop has not been seen for PROBE_RTT_INTERVAL,
+    PROBE_RTT drops to PROBE_RTT_CWND packets for PROBE_RTT_DURATION and
+    at least a round to measure it again.
+
+    warm_start() seeds BtlBw and RTprop from a path_cache entry. One younger
+    than WARM_START_MAX_AGE skips STARTUP and starts probing up in PROBE_BW.
+    """
+
+    FULL_BW_THRESH = 1.25
+    FULL_BW_ROUNDS = 3
+    PROBE_BW_GAINS = (1.25, 0.75, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0)
+    PROBE_BW_CWND_GAIN = 2.0
     PROBE_RTT_INTERVAL = 10.0
     PROBE_RTT_DURATION = 0.2
     PROBE_RTT_CWND = 4
-    DRAIN_TIMEOUT = 5.0
-    UPDATE_INTERVAL = 0.5
-    MIN_SAMPLES = 20
+    WARM_START_MAX_AGE = 60.0
+    RTT_WINDOW = 50
+    INITIAL_CWND = 10
+    MIN_CWND = 4
+
+    HIGH_GAIN = 2 / math.log(2)
+    # (pacing_gain, cwnd_gain) per state; PROBE_BW's pacing gain cycles
+    GAINS = {
+        'STARTUP': (HIGH_GAIN, HIGH_GAIN),
+        'DRAIN': (1 / HIGH_GAIN, HIGH_GAIN),
+        'PROBE_RTT': (1.0, 1.0),
+    }
 
     def __init__(self):
-        self.rtt_samples = []
+        super().__init__()
+        self.rtt = RTTWindow(self.RTT_WINDOW)
+        self.btlbw = MaxFilter()
         self.rtprop = None
         self.rtprop_updated_time = 0
-        self.cwnd = 1
+        self.cwnd = self.INITIAL_CWND
         self.state = 'STARTUP'
         self.state_start_time = 0
-        self.last_update = 0
-        self.pre_probe_rtt_cwnd = None
+        self.cycle_index = 0
+        self.cycle_start_time = 0
+        self.full_bw = 0.0
+        self.full_bw_rounds = 0
+        self.filled_pipe = False
+        self.probe_rtt_done_time = None
+        self.probe_rtt_round = 0
+        self._rtprop_expired = False
+        self._rtprop_reset = False
+        self._rtprop_cached = False
+        self._lost = False
 
-    def on_ack(self, rtt: float):
-        self.rtt_samples.append(rtt)
+    def on_ack(self, packet: SentPacket, now: float) -> RateSample:
+        prior_in_flight = self.bytes_in_flight
+        sample = super().on_ack(packet, now)
+        if sample.rtt is not None:
+            self.rtt.add(sample.rtt)
+            self._update_rtprop(sample.rtt, now)
 
-    def update(self, now: float) -> CongestionDecision:
-        self._rtprop_reset = False
+        # An app-limited sample only says the path carries at least this much
+        if sample.delivery_rate and (not sample.is_app_limited or sample.delivery_rate > self.btlbw.best):
+            self.btlbw.update(sample.delivery_rate, self.sampler.round_count)
+        else:
+            self.btlbw.expire(self.sampler.round_count)
 
-        if len(self.rtt_samples) >= self.MIN_SAMPLES:
-            if now - self.last_update >= self.UPDATE_INTERVAL:
-                self._run_state_machine(now)
-                self.last_update = now
+        if self.state == 'PROBE_BW' and self._phase_done(prior_in_flight, now):
+            self._start_phase((self.cycle_index + 1) % len(self.PROBE_BW_GAINS), now)
+        if sample.round_start and not sample.is_app_limited:
+            self._check_full_pipe()
+        if self.state == 'STARTUP' and self.filled_pipe:
+            self._enter('DRAIN', now)
+        if self.state == 'DRAIN' and self.bytes_in_flight <= self._inflight(1.0):
+            self._enter_probe_bw(now)
+        self._check_probe_rtt(now)
+        self._lost = False
+        return sample
 
-        pacing = self.rtprop / self.cwnd if self.rtprop and self.cwnd > 0 else 0
-        avg_rtt = sum(self.rtt_samples[-50:]) / len(self.rtt_samples[-50:]) if self.rtt_samples else 0
+    def on_loss(self, packet: SentPacket, now: float):
+        super().on_loss(packet, now)
+        self._lost = True
 
+    def warm_start(self, metrics: PathMetrics, now: float):
+        # Both only until the path says otherwise: the first RTT sample
+        # replaces RTprop, and the cached rate leaves the max filter after
+        # BTLBW_ROUNDS rounds like any other sample
+        if metrics.rtprop:
+            self.rtprop = metrics.rtprop
+            self.rtprop_updated_time = now
+            self._rtprop_cached = True
+        if not metrics.btlbw:
+            return
+        self.btlbw.update(metrics.btlbw, self.sampler.round_count)
+        self.full_bw = metrics.btlbw
+        if now - metrics.updated_at <= self.WARM_START_MAX_AGE:
+            # A recent rate needs no STARTUP: its 2/ln 2 gain on top of the
+            # full rate would only fill the buffer. Probe up first in case
+            # the path got faster
+            self.filled_pipe = True
+            self._enter_probe_bw(now)
+            self._start_phase(0, now)
+
+    def path_metrics(self, now: float):
+        if not self.btlbw.best or self.rtprop is None or self._rtprop_cached:
+            return None
+        return PathMetrics(self.rtprop, self.btlbw.best, self.cwnd, now)
+
+    def decide(self, now: float) -> CongestionDecision:
+        if self.state == 'PROBE_BW':
+            pacing_gain, cwnd_gain = self.PROBE_BW_GAINS[self.cycle_index], self.PROBE_BW_CWND_GAIN
+        else:
+            pacing_gain, cwnd_gain = self.GAINS[self.state]
+        btlbw = self.btlbw.best
+        rtprop = self.rtprop or self.rtt.min
+        if btlbw and rtprop:
+            pacing_rate = pacing_gain * btlbw
+            self.cwnd = max(self.MIN_CWND, math.ceil(cwnd_gain * btlbw * rtprop / MSS))
+        elif self.rtt.count:
+            # No bandwidth sample yet: spread the initial window over one RTT
+            pacing_rate = pacing_gain * self.INITIAL_CWND * MSS / self.rtt.min
+            self.cwnd = self.INITIAL_CWND
+        else:
+            pacing_rate = 0.0
+            self.cwnd = self.INITIAL_CWND
+        if self.state == 'PROBE_RTT':
+            self.cwnd = self.PROBE_RTT_CWND
+
+        rtprop_reset, self._rtprop_reset = self._rtprop_reset, False
         return CongestionDecision(
             cwnd=self.cwnd,
-            pacing_interval=pacing,
+            pacing_interval=MSS / pacing_rate if pacing_rate else 0,
             state=self.state,
-            avg_rtt=avg_rtt,
+            avg_rtt=self.rtt.avg,
             rtprop=self.rtprop or 0,
-            rtprop_reset=self._rtprop_reset
+            rtprop_reset=rtprop_reset,
+            pacing_rate=pacing_rate,
+            btlbw=btlbw,
         )
 
-    def _run_state_machine(self, now: float):
-        recent = self.rtt_samples[-50:]
-        avg_rtt = sum(recent) / len(recent)
-        min_rtt = min(recent)
+    def _enter(self, state: str, now: float):
+        self.state = state
+        self.state_start_time = now
 
-        if self.rtprop is None or min_rtt < self.rtprop:
-            self.rtprop = min_rtt
-            self.rtprop_updated_time = now
+    def _enter_probe_bw(self, now: float):
+        self._enter('PROBE_BW', now)
+        # Start cruising: the queue DRAIN or PROBE_RTT just emptied would
+        # make an immediate probe look like it found nothing
+        self._start_phase(self.PROBE_BW_GAINS.index(1.0), now)
 
-        ratio = avg_rtt / self.rtprop
+    def _start_phase(self, index: int, now: float):
+        self.cycle_index = index
+        self.cycle_start_time = now
 
-        if self.state == 'STARTUP':
-            if ratio < self.RTT_THRESHOLD:
-                self.cwnd = self.cwnd + 1 if self.cwnd < 10 else int(self.cwnd * 1.25)
-            else:
-                self.state = 'DRAIN'
-                self.state_start_time = now
-
-        elif self.state == 'CRUISE':
-            if now - self.rtprop_updated_time > self.PROBE_RTT_INTERVAL:
-                self.pre_probe_rtt_cwnd = self.cwnd
-                self.cwnd = self.PROBE_RTT_CWND
-                self.state = 'PROBE_RTT'
-                self.state_start_time = now
-            elif now - self.state_start_time > self.CRUISE_DURATION:
-                self.state = 'PROBE'
-                self.state_start_time = now
-
-        elif self.state == 'PROBE':
-            if ratio < self.RTT_THRESHOLD:
-                self.cwnd = self.cwnd + 1 if self.cwnd < 10 else int(self.cwnd * 1.25)
-            else:
-                self.state = 'DRAIN'
-                self.state_start_time = now
-
-        elif self.state == 'DRAIN':
-            if ratio < self.DRAIN_EXIT:
-                self.state = 'CRUISE'
-                self.state_start_time = now
-            elif now - self.state_start_time > self.DRAIN_TIMEOUT:
-                self.rtprop = min_rtt
-                self.rtprop_updated_time = now
+    def _inflight(self, gain: float) -> float:
+        return gain * self.btlbw.best * (self.rtprop or 0)
+
+    def _phase_done(self, prior_in_flight: int, now: float) -> bool:
+        gain = self.PROBE_BW_GAINS[self.cycle_index]
+        full_length = now - self.cycle_start_time > self.rtprop
+        if gain > 1:
+            # Probe until the extra data is actually in flight, or lost
+            return full_length and (self._lost or prior_in_flight >= self._inflight(gain))
+        if gain < 1:
+            # Drain ends early once the probe's queue is gone
+            return full_length or prior_in_flight <= self._inflight(1.0)
+        return full_length
+
+    def _check_full_pipe(self):
+        if self.filled_pipe:
+            return
+        if self.btlbw.best >= self.full_bw * self.FULL_BW_THRESH:
+            self.full_bw = self.btlbw.best
+            self.full_bw_rounds = 0
+            return
+        self.full_bw_rounds += 1
+        if self.full_bw_rounds >= self.FULL_BW_ROUNDS:
+            self.filled_pipe = True
+
+    def _update_rtprop(self, rtt: float, now: float):
+        self._rtprop_expired = self.rtprop is not None and \
+            now - self.rtprop_updated_time > self.PROBE_RTT_INTERVAL
+        if self.rtprop is None or rtt <= self.rtprop or self._rtprop_expired or self._rtprop_cached:
+            self._rtprop_cached = False
+            # An expired RTprop gives way even to a higher sample: the
+            # route may have changed
+            if self._rtprop_expired and rtt > self.rtprop:
                 self._rtprop_reset = True
+            self.rtprop = rtt
+            self.rtprop_updated_time = now
+
+    def _check_probe_rtt(self, now: float):
+        if self.state != 'PROBE_RTT' and self._rtprop_expired:
+            self._enter('PROBE_RTT', now)
+            self.probe_rtt_done_time = None
+
+        if self.state != 'PROBE_RTT':
+            return
+        if self.probe_rtt_done_time is None:
+            if self.bytes_in_flight <= self.PROBE_RTT_CWND * MSS:
+                # The queue is gone: hold for PROBE_RTT_DURATION and a full round
+                self.probe_rtt_done_time = now + self.PROBE_RTT_DURATION
+                self.sampler.start_round()
+                self.probe_rtt_round = self.sampler.round_count
+        elif self.sampler.round_count > self.probe_rtt_round and now >= self.probe_rtt_done_time:
+            self.rtprop_updated_time = now
+            if self.filled_pipe:
+                self._enter_probe_bw(now)
             else:
-                self.cwnd = max(1, self.cwnd - 1)
-
-        elif self.state == 'PROBE_RTT':
-            if now - self.state_start_time > self.PROBE_RTT_DURATION:
-                self.cwnd = self.pre_probe_rtt_cwnd
-                self.rtprop_updated_time = now
-                self.state = 'CRUISE'
-                self.state_start_time = now
+                self._enter('STARTUP', now)
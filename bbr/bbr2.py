@@ -0,0 +1,161 @@
+"""
+BBRv2: BBR's bandwidth model, bounded by what loss and ECN say.
+
+BBR (bbr.py) ignores loss, so on a shallow buffer that drops packets
+before BtlBw stops growing it keeps sending into the losses. BBRv2 keeps
+the same states, probes less often (PROBE_BW cycles up 1.25×, down 0.9×,
+then cruises for CRUISE_DURATION) and adds two bounds on the data in
+flight:
+
+    inflight_hi  long-term ceiling. Set when the loss rate of a flight
+                 passes LOSS_THRESH (the path could not carry that much),
+                 raised again, 1, 2, 4 … packets a round, while the
+                 probe-up phase finds room.
+    inflight_lo  short-term bound. Cut by BETA at the end of every round
+                 whose loss rate passed LOSS_THRESH, and by the smoothed
+                 CE fraction in rounds with ECN marks. Probing leaves it
+                 alone; starting to cruise or probe forgets it.
+
+cwnd is the model's window clamped to both. inflight_hi only moves while
+probing (STARTUP and probe-up); excess loss ends probe-up at once and
+STARTUP after STARTUP_LOSS_EVENTS losses in a round, in addition to the
+full-bandwidth test.
+"""
+
+import math
+
+from .bbr import BBR, MSS, CongestionDecision
+from .delivery_rate import SentPacket, RateSample
+
+
+class BBRv2(BBR):
+
+    LOSS_THRESH = 0.02     # tolerated fraction of a flight lost
+    LOSS_EVENTS = 3        # ... once at least this many packets of it were lost
+    STARTUP_LOSS_EVENTS = 8  # lost packets in one round that end STARTUP
+    ECN_THRESH = 0.5       # tolerated fraction of a round CE-marked
+    BETA = 0.7             # multiplicative cut of inflight_lo per lossy round
+    ECN_ALPHA_GAIN = 1 / 16
+    ECN_FACTOR = 1 / 3
+    MAX_PROBE_UP_ROUNDS = 30
+    PROBE_BW_GAINS = (1.25, 0.9, 1.0)
+    # Probe every couple of seconds: inflight_hi only grows while probing
+    CRUISE_DURATION = 2.0
+
+    def __init__(self):
+        super().__init__()
+        self.inflight_hi = math.inf
+        self.inflight_lo = math.inf
+        # Start by assuming every round is marked, so the first CE counts fully
+        self.ecn_alpha = 1.0
+        self.probe_up_rounds = 0
+        # Per-round counters, reset each time a round trip ends
+        self.round_delivered = 0
+        self.round_lost = 0
+        self.round_ce = 0
+        self.round_packets = 0
+        self.round_loss_events = 0
+        self.loss_too_high = False
+
+    def on_loss(self, packet: SentPacket, now: float):
+        super().on_loss(packet, now)
+        self.round_lost += packet.size
+        self.round_loss_events += 1
+
+        # The initial window leaves before there is a rate to pace it at:
+        # losing some of that burst says the buffer is shallow, not how
+        # much the path holds
+        if packet.delivered == 0 or not self._probing():
+            return
+
+        # Loss rate of the flight this packet was part of: bytes lost since
+        # it was sent, against what was in flight when it left
+        if self._loss_too_high(self.sampler.lost - packet.lost, packet.tx_in_flight):
+            self._inflight_too_high(packet.tx_in_flight, now)
+
+    def on_ecn_ce(self, count: int, now: float):
+        self.round_ce += count
+
+    def on_ack(self, packet: SentPacket, now: float) -> RateSample:
+        sample = super().on_ack(packet, now)
+        if sample.round_start:
+            self._end_round(now)
+        self.round_delivered += packet.size
+        self.round_packets += 1
+        return sample
+
+    def decide(self, now: float) -> CongestionDecision:
+        decision = super().decide(now)
+        bound = min(self.inflight_hi, self.inflight_lo)
+        if bound < math.inf:
+            self.cwnd = decision.cwnd = max(self.MIN_CWND, min(decision.cwnd, int(bound // MSS)))
+        return decision
+
+    def _start_phase(self, index: int, now: float):
+        super()._start_phase(index, now)
+        if self.PROBE_BW_GAINS[index] >= 1:
+            # Cruising or probing starts from a clean short-term bound: losses
+            # from draining STARTUP's or the last probe's queue say nothing
+            # about it
+            self.inflight_lo = math.inf
+            self.probe_up_rounds = 0
+
+    def _phase_done(self, prior_in_flight: int, now: float) -> bool:
+        if self.PROBE_BW_GAINS[self.cycle_index] == 1:
+            return now - self.cycle_start_time > self.CRUISE_DURATION
+        return super()._phase_done(prior_in_flight, now)
+
+    def _probing(self) -> bool:
+        return self.state == 'STARTUP' or self._probing_up()
+
+    def _probing_up(self) -> bool:
+        return self.state == 'PROBE_BW' and self.PROBE_BW_GAINS[self.cycle_index] > 1
+
+    def _loss_too_high(self, lost: int, flight: int) -> bool:
+        # In a small flight one random loss is already several percent
+        return lost > max(self.LOSS_THRESH * flight, (self.LOSS_EVENTS - 1) * MSS)
+
+    def _inflight_too_high(self, inflight: int, now: float):
+        """The path dropped or marked too much of a flight of `inflight` bytes."""
+        if self.loss_too_high:
+            return  # once a round is enough
+        self.loss_too_high = True
+        bdp = self.btlbw.best * (self.rtprop or self.rtt.min or 0)
+        self.inflight_hi = max(inflight, self.BETA * bdp, self.MIN_CWND * MSS)
+        if self._probing_up():
+            self._start_phase((self.cycle_index + 1) % len(self.PROBE_BW_GAINS), now)
+
+    def _end_round(self, now: float):
+        delivered, lost = self.round_delivered, self.round_lost
+        in_flight = self.cwnd * MSS
+
+        if self.state == 'STARTUP' and self.round_loss_events >= self.STARTUP_LOSS_EVENTS and \
+           self._loss_too_high(lost, delivered + lost):
+            self.filled_pipe = True
+            self._enter('DRAIN', now)
+
+        probing = self._probing()
+        if not probing and self._loss_too_high(lost, delivered + lost):
+            # Too much loss this round: the short-term bound backs off by
+            # BETA, but not below what the round actually delivered
+            if self.inflight_lo == math.inf:
+                self.inflight_lo = in_flight
+            self.inflight_lo = max(delivered, self.BETA * self.inflight_lo)
+
+        if self.round_packets:
+            ce_ratio = min(1.0, self.round_ce / self.round_packets)
+            self.ecn_alpha += self.ECN_ALPHA_GAIN * (ce_ratio - self.ecn_alpha)
+            if self.round_ce and not probing:
+                self.inflight_lo = min(self.inflight_lo, in_flight * (1 - self.ecn_alpha * self.ECN_FACTOR))
+            if ce_ratio > self.ECN_THRESH:
+                self._inflight_too_high(in_flight, now)
+
+        if self._probing_up() and not lost and self.inflight_hi < math.inf and \
+           self.bytes_in_flight >= self.inflight_hi - MSS:
+            # Up against the ceiling with no loss: raise it, faster each round
+            self.inflight_hi += MSS << self.probe_up_rounds
+            self.probe_up_rounds = min(self.probe_up_rounds + 1, self.MAX_PROBE_UP_ROUNDS)
+
+        self.round_delivered = self.round_lost = self.round_ce = self.round_packets = 0
+        self.round_loss_events = 0
+        self.loss_too_high = False
@@ -0,0 +1,125 @@
+"""
+CUBIC (RFC 9438) with HyStart++ slow start (RFC 9406).
+
+After a congestion event the window follows a cubic curve in the time
+since the event:
+
+    W(t) = C × (t - K)³ + W_max        K = ∛((W_max - cwnd_epoch) / C)
+
+cwnd_epoch is the window just after the reduction, β × the window at
+loss. The window climbs quickly back towards W_max, where loss last
+struck, flattens out around it, and only then probes beyond it. Growth depends
+on time, not on the ACK rate, so flows with long RTTs are not starved by
+flows with short ones. Where classic Reno would be faster (short RTTs,
+small windows), CUBIC follows Reno's estimate instead.
+
+HyStart++ leaves slow start before it overshoots. When the minimum RTT
+of a round rises by more than max(4 ms, min(16 ms, last round's min / 8)),
+growth slows to a quarter (Conservative Slow Start). That ends after
+CSS_ROUNDS rounds, and then congestion avoidance takes over. If the RTT
+drops back instead, the rise was noise and slow start resumes.
+"""
+
+import math
+
+from .delivery_rate import RateSample
+from .newreno import NewReno
+
+
+class Cubic(NewReno):
+
+    C = 0.4
+    BETA = 0.7
+    # Reno-friendly growth per RTT that matches Reno's average rate at BETA
+    ALPHA = 3 * (1 - BETA) / (1 + BETA)
+
+    # HyStart++
+    MIN_RTT_THRESH = 0.004
+    MAX_RTT_THRESH = 0.016
+    MIN_RTT_DIVISOR = 8
+    N_RTT_SAMPLE = 8
+    CSS_GROWTH_DIVISOR = 4
+    CSS_ROUNDS = 5
+
+    def __init__(self):
+        super().__init__()
+        self.w_max = 0.0
+        self.k = 0.0
+        self.w_est = 0.0
+        self.epoch_start = None
+
+        self.last_round_min_rtt = math.inf
+        self.current_round_min_rtt = math.inf
+        self.rtt_sample_count = 0
+        self.css_baseline_min_rtt = math.inf
+        self.css_rounds = 0
+
+    # HyStart++
+
+    def on_rtt(self, rtt: float, sample: RateSample):
+        super().on_rtt(rtt, sample)
+        if sample.round_start:
+            self.last_round_min_rtt = self.current_round_min_rtt
+            self.current_round_min_rtt = math.inf
+            self.rtt_sample_count = 0
+            if self.state == 'CSS':
+                self.css_rounds += 1
+        self.current_round_min_rtt = min(self.current_round_min_rtt, rtt)
+        self.rtt_sample_count += 1
+
+    def slow_start(self, acked: float, sample: RateSample):
+        if self.state == 'CSS':
+            self.cwnd += acked / self.CSS_GROWTH_DIVISOR
+            if self.current_round_min_rtt < self.css_baseline_min_rtt:
+                # RTT fell back: the increase was spurious, resume slow start
+                self.state = 'SLOW_START'
+                self.css_baseline_min_rtt = math.inf
+            elif self.css_rounds >= self.CSS_ROUNDS:
+                self.ssthresh = self.cwnd
+                self.state = 'CONGESTION_AVOIDANCE'
+            return
+
+        self.cwnd += acked
+        if self.rtt_sample_count >= self.N_RTT_SAMPLE and \
+           self.current_round_min_rtt < math.inf and self.last_round_min_rtt < math.inf:
+            threshold = min(self.MAX_RTT_THRESH,
+                            max(self.MIN_RTT_THRESH, self.last_round_min_rtt / self.MIN_RTT_DIVISOR))
+            if self.current_round_min_rtt >= self.last_round_min_rtt + threshold:
+                self.css_baseline_min_rtt = self.current_round_min_rtt
+                self.css_rounds = 0
+                self.state = 'CSS'
+
+    # CUBIC
+
+    def congestion_avoidance(self, acked: float, now: float):
+        if self.epoch_start is None:
+            # First congestion avoidance ACK without a prior loss: the
+            # curve starts here, on its plateau
+            self.epoch_start = now
+            self.w_max = max(self.w_max, self.cwnd)
+            self.k = 0.0 if self.w_max <= self.cwnd else \
+                math.cbrt((self.w_max - self.cwnd) / self.C)
+            self.w_est = self.cwnd
+
+        self.w_est += self.ALPHA * acked / self.cwnd
+        t = now - self.epoch_start
+        target = self.C * (t + self.srtt - self.k) ** 3 + self.w_max
+        target = min(max(target, self.cwnd), 1.5 * self.cwnd)
+
+        if self.C * (t - self.k) ** 3 + self.w_max < self.w_est:
+            self.cwnd = self.w_est  # Reno-friendly region
+        else:
+            self.cwnd += (target - self.cwnd) / self.cwnd * acked
+
+    def on_congestion_event(self, now: float):
+        # Fast convergence: a flow losing below its last W_max gives up more,
+        # making room for newer flows
+        if self.cwnd < self.w_max:
+            self.w_max = self.cwnd * (1 + self.BETA) / 2
+        else:
+            self.w_max = self.cwnd
+        self.ssthresh = self.cwnd = max(self.MIN_CWND, self.cwnd * self.BETA)
+        self.k = math.cbrt(max(0.0, self.w_max - self.cwnd) / self.C)
+        self.w_est = self.cwnd
+        self.epoch_start = now
+        self.css_baseline_min_rtt = math.inf
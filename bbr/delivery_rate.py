@@ -0,0 +1,134 @@
+"""
+Delivery-rate sampling and the bottleneck bandwidth filter.
+
+Every packet remembers, when it is sent, how much data had been delivered
+so far and when. When its ACK arrives, the data delivered since then over
+the time it took is one delivery-rate sample (draft-cheng-iccrg-delivery-
+rate-estimation). The interval is the longer of the send and the ACK
+intervals, so neither a burst of sends nor a compressed burst of ACKs can
+inflate the rate.
+
+Samples taken while the sender had nothing to send are marked app-limited:
+they show what the application offered, not what the path can carry, so
+they may raise the estimate but never lower it.
+
+Round trips are counted here too. A round ends when a packet sent after
+the previous round ended is acknowledged, which is what the BtlBw window
+(BTLBW_ROUNDS round trips) is measured in.
+"""
+
+from collections import deque
+from dataclasses import dataclass
+
+BTLBW_ROUNDS = 10
+
+
+@dataclass
+class SentPacket:
+    """What the controller needs back when a packet is acknowledged."""
+    size: int
+    sent_time: float
+    delivered: int
+    delivered_time: float
+    first_sent_time: float
+    is_app_limited: bool
+    retransmission: bool = False
+    # Bytes in flight once this packet was sent, and bytes lost before it
+    tx_in_flight: int = 0
+    lost: int = 0
+
+
+@dataclass
+class RateSample:
+    delivery_rate: float
+    rtt: float
+    interval: float
+    delivered: int
+    is_app_limited: bool
+    round_start: bool
+
+
+class DeliveryRateSampler:
+    """Connection-wide delivery counters, stamped onto each packet sent."""
+
+    def __init__(self):
+        self.delivered = 0
+        self.lost = 0
+        self.delivered_time = 0.0
+        self.first_sent_time = 0.0
+        self.app_limited_until = 0
+        self.round_count = 0
+        self.next_round_delivered = 0
+
+    def on_packet_sent(self, size: int, now: float, bytes_in_flight: int,
+                       retransmission: bool = False) -> SentPacket:
+        if bytes_in_flight == 0:
+            # Restarting from idle: measure from now, not from the last ACK
+            self.first_sent_time = self.delivered_time = now
+        return SentPacket(size, now, self.delivered, self.delivered_time, self.first_sent_time,
+                          self.app_limited_until > 0, retransmission,
+                          bytes_in_flight + size, self.lost)
+
+    def on_app_limited(self, bytes_in_flight: int):
+        """The sender ran out of data with room left in the window."""
+        self.app_limited_until = max(self.delivered + bytes_in_flight, 1)
+
+    def on_packet_lost(self, packet: SentPacket):
+        self.lost += packet.size
+
+    def start_round(self):
+        """End the current round at the ACK of the next packet sent from now on."""
+        self.next_round_delivered = self.delivered
+
+    def on_ack(self, packet: SentPacket, now: float) -> RateSample:
+        self.delivered += packet.size
+        self.delivered_time = now
+        if self.app_limited_until and self.delivered > self.app_limited_until:
+            self.app_limited_until = 0
+
+        round_start = packet.delivered >= self.next_round_delivered
+        if round_start:
+            self.round_count += 1
+            self.next_round_delivered = self.delivered
+
+        # The packets after this one were sent from here on
+        self.first_sent_time = packet.sent_time
+        send_elapsed = packet.sent_time - packet.first_sent_time
+        ack_elapsed = now - packet.delivered_time
+        interval = max(send_elapsed, ack_elapsed)
+        delivered = self.delivered - packet.delivered
+        rate = delivered / interval if interval > 0 else 0.0
+
+        # Which copy of a retransmitted packet was acknowledged is unknown
+        rtt = None if packet.retransmission else now - packet.sent_time
+        return RateSample(rate, rtt, interval, delivered, packet.is_app_limited, round_start)
+
+
+class MaxFilter:
+    """
+    Maximum over the last `window` rounds: a monotonic deque of
+    (round, value) with values decreasing from front to back, so the front
+    is the maximum and each update is O(1) amortized.
+    """
+
+    def __init__(self, window: int = BTLBW_ROUNDS):
+        self.window = window
+        self.entries = deque()
+
+    def update(self, value: float, round_count: int):
+        entries = self.entries
+        while entries and entries[-1][1] <= value:
+            entries.pop()
+        entries.append((round_count, value))
+        while entries[0][0] <= round_count - self.window:
+            entries.popleft()
+
+    def expire(self, round_count: int):
+        """Drop values older than the window even when no new sample arrives."""
+        entries = self.entries
+        while len(entries) > 1 and entries[0][0] <= round_count - self.window:
+            entries.popleft()
+
+    @property
+    def best(self) -> float:
+        return self.entries[0][1] if self.entries else 0.0
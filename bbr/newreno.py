@@ -0,0 +1,117 @@
+"""
+NewReno: loss-based congestion control (RFC 9002 §7, RFC 5681).
+
+The window doubles every round trip in slow start, grows by one packet per
+round trip in congestion avoidance, and halves on loss. One halving per
+round trip: losses among packets sent before the current recovery period
+began belong to the same congestion event.
+
+Sends are paced at 1.25 × cwnd / srtt (RFC 9002 §7.7), so a window is
+spread over slightly less than one round trip instead of leaving in a
+burst.
+
+warm_start() resumes at BETA × a cached window (path_cache), where a
+congestion event would have left it.
+"""
+
+import math
+
+from .bbr import MSS, CongestionController, CongestionDecision
+from .delivery_rate import SentPacket, RateSample
+from .path_cache import PathMetrics
+
+
+class NewReno(CongestionController):
+
+    INITIAL_CWND = 10
+    MIN_CWND = 2
+    BETA = 0.5
+    PACING_GAIN = 1.25
+    RTT_GAIN = 1 / 8
+    WARM_START_MAX_AGE = 60.0
+
+    def __init__(self):
+        super().__init__()
+        self.cwnd = self.INITIAL_CWND  # packets; fractional between ACKs
+        self.ssthresh = math.inf
+        self.recovery_start_time = -math.inf
+        self.srtt = 0.0
+        self.rtprop = None
+        self.state = 'SLOW_START'
+
+    def on_ack(self, packet: SentPacket, now: float) -> RateSample:
+        sample = super().on_ack(packet, now)
+        if sample.rtt is not None:
+            self.on_rtt(sample.rtt, sample)
+
+        if packet.sent_time <= self.recovery_start_time:
+            return sample  # sent before the last reduction: no growth
+        if self.state == 'RECOVERY':
+            self.state = 'SLOW_START' if self.cwnd < self.ssthresh else 'CONGESTION_AVOIDANCE'
+
+        acked = packet.size / MSS
+        if self.cwnd < self.ssthresh:
+            self.slow_start(acked, sample)
+        else:
+            self.state = 'CONGESTION_AVOIDANCE'
+            self.congestion_avoidance(acked, now)
+        return sample
+
+    def on_loss(self, packet: SentPacket, now: float):
+        super().on_loss(packet, now)
+        if packet.sent_time > self.recovery_start_time:
+            self.recovery_start_time = now
+            self.on_congestion_event(now)
+            self.state = 'RECOVERY'
+
+    def on_ecn_ce(self, count: int, now: float):
+        # A CE mark is a congestion event without the loss (RFC 9002 §7.1)
+        if count and now > self.recovery_start_time:
+            self.recovery_start_time = now
+            self.on_congestion_event(now)
+            self.state = 'RECOVERY'
+
+    def warm_start(self, metrics: PathMetrics, now: float):
+        # Where a congestion event would have left the old window: it may
+        # have included a queue
+        window = metrics.cwnd * self.BETA
+        if window <= self.INITIAL_CWND:
+            return
+        self.cwnd = window
+        self.srtt = metrics.rtprop  # pace over the old RTT until a sample arrives
+        if now - metrics.updated_at <= self.WARM_START_MAX_AGE:
+            # Recent enough to trust as a ceiling: no slow start past it
+            self.ssthresh = window
+            self.state = 'CONGESTION_AVOIDANCE'
+
+    def path_metrics(self, now: float):
+        if not self.srtt or self.rtprop is None:
+            return None
+        return PathMetrics(self.rtprop, self.cwnd * MSS / self.srtt, int(self.cwnd), now)
+
+    def on_rtt(self, rtt: float, sample: RateSample):
+        # The first sample replaces a cached srtt too (warm_start)
+        self.srtt = rtt if self.rtprop is None else self.srtt + self.RTT_GAIN * (rtt - self.srtt)
+        if self.rtprop is None or rtt < self.rtprop:
+            self.rtprop = rtt
+
+    def slow_start(self, acked: float, sample: RateSample):
+        self.cwnd += acked
+
+    def congestion_avoidance(self, acked: float, now: float):
+        self.cwnd += acked / self.cwnd
+
+    def on_congestion_event(self, now: float):
+        self.ssthresh = self.cwnd = max(self.MIN_CWND, self.cwnd * self.BETA)
+
+    def decide(self, now: float) -> CongestionDecision:
+        cwnd = max(self.MIN_CWND, int(self.cwnd))
+        pacing_rate = self.PACING_GAIN * cwnd * MSS / self.srtt if self.srtt else 0.0
+        return CongestionDecision(
+            cwnd=cwnd,
+            pacing_interval=MSS / pacing_rate if pacing_rate else 0,
+            state=self.state,
+            avg_rtt=self.srtt,
+            rtprop=self.rtprop or 0,
+            pacing_rate=pacing_rate,
+        )
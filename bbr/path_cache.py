@@ -0,0 +1,80 @@
+"""
+Path metrics cache: a new connection starts from what the last one to
+the same destination measured, instead of from nothing (the temporal
+sharing of RFC 9040).
+
+A controller hands over its RTprop, BtlBw and cwnd when a connection
+ends (path_metrics()), and the next controller for that destination
+starts from them (warm_start()). BBR paces its first flight at the
+cached bandwidth, so STARTUP begins near the old rate instead of
+doubling up to it from INITIAL_CWND, which is most of a short
+transfer's life.
+
+A path may have changed since, so entries age. Bandwidth and window are
+halved every HALF_LIFE seconds and dropped after LIFETIME. RTprop is
+kept as is, and controllers replace it with their first real sample.
+Least recently used destinations are evicted beyond `capacity`, and
+with a path the cache persists as JSON, like tickets.TicketCache.
+"""
+
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+
+HALF_LIFE = 120.0
+LIFETIME = 600.0
+CAPACITY = 64
+
+
+@dataclass
+class PathMetrics:
+    rtprop: float   # seconds
+    btlbw: float    # bytes/second, 0 if unknown
+    cwnd: int       # packets
+    updated_at: float
+
+
+class PathCache:
+
+    def __init__(self, path: str = None, capacity: int = CAPACITY,
+                 half_life: float = HALF_LIFE, lifetime: float = LIFETIME):
+        self.path = path
+        self.capacity = capacity
+        self.half_life = half_life
+        self.lifetime = lifetime
+        self.entries = OrderedDict()
+        if path and os.path.exists(path):
+            self.load()
+
+    def put(self, destination: str, metrics: PathMetrics):
+        self.entries[destination] = metrics
+        self.entries.move_to_end(destination)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def get(self, destination: str, now: float = None):
+        """The destination's metrics aged to now, or None if unknown or expired."""
+        entry = self.entries.get(destination)
+        if entry is None:
+            return None
+        now = time.time() if now is None else now
+        age = max(0.0, now - entry.updated_at)
+        if age > self.lifetime:
+            del self.entries[destination]
+            return None
+        self.entries.move_to_end(destination)
+        trust = 0.5 ** (age / self.half_life)
+        return PathMetrics(entry.rtprop, entry.btlbw * trust, int(entry.cwnd * trust), entry.updated_at)
+
+    def load(self):
+        with open(self.path) as f:
+            for destination, entry in json.load(f).items():
+                self.entries[destination] = PathMetrics(**entry)
+
+    def save(self):
+        if not self.path:
+            return
+        with open(self.path, 'w') as f:
+            json.dump({destination: asdict(entry) for destination, entry in self.entries.items()}, f)
@@ -0,0 +1,102 @@
+"""
+qlog tracing (draft-ietf-quic-qlog-main-schema, JSON-SEQ serialization).
+
+A .sqlog file is a header record followed by one record per event, each
+starting with the RS character (0x1E) and ending with a newline (RFC
+7464), so it can be written incrementally and read back even if the
+writer died halfway:
+
+    {"qlog_version": "0.3", "qlog_format": "JSON-SEQ", "trace": {...}}
+    {"time": 12.345, "name": "recovery:metrics_updated", "data": {...}}
+
+event() only appends to a list. Records are encoded and written
+BUFFER_EVENTS at a time, and on flush() and close(), so tracing adds no
+JSON encoding or I/O to the send loop itself. Times are milliseconds
+since the writer was created.
+
+packet_acked is not part of the qlog QUIC event schema (ACKs here
+acknowledge stream offsets, not packet numbers). qvis and other readers
+skip event names they do not know.
+"""
+
+import json
+import time
+
+RECORD_SEPARATOR = '\x1e'
+BUFFER_EVENTS = 4096
+
+
+class QlogWriter:
+
+    def __init__(self, path: str, title: str = '', vantage_point: str = 'client',
+                 reference_time: float = None):
+        self.file = open(path, 'w')
+        self.reference_time = time.time() if reference_time is None else reference_time
+        self.events = []
+        self._write([{
+            'qlog_version': '0.3',
+            'qlog_format': 'JSON-SEQ',
+            'title': title,
+            'trace': {
+                'vantage_point': {'type': vantage_point},
+                'common_fields': {'reference_time': self.reference_time * 1000, 'time_format': 'relative'},
+            },
+        }])
+
+    def event(self, now: float, name: str, data: dict):
+        self.events.append((now, name, data))
+        if len(self.events) >= BUFFER_EVENTS:
+            self.flush()
+
+    # Events (draft-ietf-quic-qlog-quic-events)
+
+    def packet_sent(self, now: float, packet_type: str, packet_number: int, length: int, frames: list):
+        self.event(now, 'transport:packet_sent', {
+            'header': {'packet_type': packet_type, 'packet_number': packet_number},
+            'raw': {'length': length},
+            'frames': frames,
+        })
+
+    def packet_acked(self, now: float, packet_number: int):
+        self.event(now, 'recovery:packet_acked', {'header': {'packet_number': packet_number}})
+
+    def packet_lost(self, now: float, packet_type: str, packet_number: int, trigger: str):
+        self.event(now, 'recovery:packet_lost', {
+            'header': {'packet_type': packet_type, 'packet_number': packet_number},
+            'trigger': trigger,
+        })
+
+    def metrics_updated(self, now: float, metrics: dict):
+        self.event(now, 'recovery:metrics_updated', metrics)
+
+    def congestion_state_updated(self, now: float, old: str, new: str):
+        data = {'new': new} if old is None else {'old': old, 'new': new}
+        self.event(now, 'recovery:congestion_state_updated', data)
+
+    # Output
+
+    def flush(self):
+        reference = self.reference_time
+        self._write({'time': round((now - reference) * 1000, 3), 'name': name, 'data': data}
+                    for now, name, data in self.events)
+        self.events.clear()
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write(self, records):
+        encode = json.JSONEncoder(separators=(',', ':')).encode
+        self.file.write(''.join(f"{RECORD_SEPARATOR}{encode(record)}\n" for record in records))
+
+
+def stream_frame(stream_id: int, offset: int, length: int, fin: bool) -> dict:
+    return {'frame_type': 'stream', 'stream_id': stream_id, 'offset': offset, 'length': length, 'fin': fin}
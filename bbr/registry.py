@@ -0,0 +1,37 @@
+"""
+Congestion controllers by name.
+
+    controller = registry.create('cubic')
+
+Every entry implements CongestionController (on_packet_sent, on_ack,
+on_loss, on_ecn_ce, update), so a sender picks one by name from its
+configuration and the rest of the code does not change. register() adds
+another under a new name.
+"""
+
+from .bbr import BBR, CongestionController
+from .bbr2 import BBRv2
+from .cubic import Cubic
+from .newreno import NewReno
+
+DEFAULT = 'bbr'
+
+CONTROLLERS = {
+    'newreno': NewReno,
+    'cubic': Cubic,
+    'bbr': BBR,
+    'bbr2': BBRv2,
+}
+
+
+def register(name: str, cls: type):
+    CONTROLLERS[name] = cls
+
+
+def create(name: str = DEFAULT) -> CongestionController:
+    try:
+        cls = CONTROLLERS[name.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown congestion controller: {name} "
+                         f"(expected one of {', '.join(CONTROLLERS)})") from None
+    return cls()
@@ -0,0 +1,61 @@
+"""
+RTT statistics over the last N samples in constant time and memory.
+
+Samples go into a fixed array('d') ring. The average comes from a running
+sum: add the new sample, subtract the one it overwrites. Floating-point
+error would creep into that sum over millions of samples, so it is
+recomputed from the ring once per wrap, which is still O(1) amortized.
+
+The minimum comes from a monotonic deque of (sequence, rtt) whose RTTs
+increase from front to back. A new sample evicts every larger one from
+the back (they can never be the minimum again while it is in the window),
+and samples that have left the window drop off the front, so the front is
+always the window's minimum.
+"""
+
+from array import array
+from collections import deque
+
+
+class RTTWindow:
+    """Average and minimum of the last `capacity` RTT samples, O(1) each."""
+
+    def __init__(self, capacity: int = 50):
+        self.capacity = capacity
+        self.ring = array('d', bytes(8 * capacity))
+        self.next = 0
+        self.count = 0
+        self.total = 0.0
+        self.minima = deque()
+
+    def __len__(self):
+        """Samples currently in the window."""
+        return min(self.count, self.capacity)
+
+    def add(self, rtt: float):
+        index = self.next
+        if self.count >= self.capacity:
+            self.total -= self.ring[index]
+        self.ring[index] = rtt
+        self.total += rtt
+        self.next = (index + 1) % self.capacity
+        if self.next == 0:
+            self.total = sum(self.ring)
+
+        seq = self.count
+        minima = self.minima
+        while minima and minima[-1][1] >= rtt:
+            minima.pop()
+        minima.append((seq, rtt))
+        if minima[0][0] <= seq - self.capacity:
+            minima.popleft()
+        self.count += 1
+
+    @property
+    def avg(self) -> float:
+        n = len(self)
+        return self.total / n if n else 0.0
+
+    @property
+    def min(self) -> float:
+        return self.minima[0][1] if self.minima else 0.0
@@ -0,0 +1,142 @@
+"""
+Parameter sweep: BBR's tuning constants against link profiles, in the
+simulator.
+
+    python -m bbr.sweep FULL_BW_THRESH=1.1,1.25,1.5 FULL_BW_ROUNDS=2,3,4
+    python -m bbr.sweep cc=bbr2 LOSS_THRESH=0.01,0.02,0.05 scenario=shallow,lossy out=sweep.csv
+
+Every NAME=v1,v2,... argument is one axis of the grid; NAME is a class
+attribute of the controller (FULL_BW_THRESH, FULL_BW_ROUNDS,
+PROBE_BW_CWND_GAIN, PROBE_RTT_INTERVAL, PROBE_RTT_DURATION, …). Each
+point of the grid runs as a subclass with those attributes overridden,
+once per scenario, on a process pool (workers=, one per CPU by default).
+
+Results go to out= (stdout by default) as CSV, grouped by scenario and
+ranked within it. The default rank is power, goodput / p99 RTT. That is
+Kleinrock's measure, and it peaks where a flow fills the pipe without
+queueing. rank=goodput and rank=delay sort on one of the two alone.
+"""
+
+import csv
+import itertools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from .bbr import MSS
+from .registry import CONTROLLERS
+from .simulator import Bottleneck, Flow, Simulator, percentile
+
+DURATION = 30.0
+
+# name: (rate Mbit/s, RTT ms, buffer ms, loss %)
+SCENARIOS = {
+    'broadband': (20, 40, 40, 0),
+    'shallow': (20, 40, 5, 0),
+    'bufferbloat': (10, 40, 400, 0),
+    'lossy': (10, 60, 60, 1),
+    'long': (5, 300, 300, 0),
+}
+
+RANKINGS = {
+    'power': lambda row: -row['power'],
+    'goodput': lambda row: (-row['goodput_mbps'], row['rtt_p99_ms']),
+    'delay': lambda row: (row['rtt_p99_ms'], -row['goodput_mbps']),
+}
+
+
+def grid(axes: dict):
+    """{'A': [1, 2], 'B': [3]} -> [{'A': 1, 'B': 3}, {'A': 2, 'B': 3}]"""
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+
+def run_one(cc: str, params: dict, scenario: str, duration: float = DURATION, seed: int = 1) -> dict:
+    """One grid point on one scenario. Runs in a pool worker."""
+    rate, rtt, buffer_ms, loss = SCENARIOS[scenario]
+    base = CONTROLLERS[cc]
+    controller = type(base.__name__, (base,), params)()
+
+    bottleneck = Bottleneck(rate * 1e6 / 8, rtt / 2000, buffer=max(MSS, rate * 1e6 / 8 * buffer_ms / 1000),
+                            loss=loss / 100, seed=seed)
+    result = Simulator(bottleneck, [Flow(controller)]).run(duration)
+    flow = result.flows[0]
+
+    goodput = result.throughput(flow) * 8 / 1e6
+    rtt_p99 = percentile(flow.rtts, 0.99) * 1000
+    return {
+        'scenario': scenario,
+        **params,
+        'goodput_mbps': round(goodput, 3),
+        'utilization': round(goodput / rate, 3),
+        'rtt_p50_ms': round(percentile(flow.rtts, 0.5) * 1000, 2),
+        'rtt_p99_ms': round(rtt_p99, 2),
+        'queue_p99_ms': round(result.queue_delay(0.99) * 1000, 2),
+        'retransmitted_pct': round(100 * flow.retransmitted / max(flow.packets_sent, 1), 2),
+        'power': round(goodput / rtt_p99, 4) if rtt_p99 else 0.0,
+    }
+
+
+def sweep(cc: str, axes: dict, scenarios, duration: float = DURATION, workers: int = None,
+          rank: str = 'power'):
+    """Every grid point on every scenario, ranked within each scenario."""
+    base = CONTROLLERS[cc]
+    for name in axes:
+        if not name.isupper() or not hasattr(base, name):
+            raise ValueError(f"{base.__name__} has no tuning constant {name}")
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            raise ValueError(f"Unknown scenario: {scenario} (expected one of {', '.join(SCENARIOS)})")
+
+    points = grid(axes)
+    jobs = [(cc, params, scenario, duration) for scenario in scenarios for params in points]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        rows = list(executor.map(run_one, *zip(*jobs)))
+
+    ranked = []
+    for scenario in scenarios:
+        group = sorted((row for row in rows if row['scenario'] == scenario), key=RANKINGS[rank])
+        for position, row in enumerate(group, 1):
+            ranked.append({'rank': position, **row})
+    return ranked
+
+
+def parse_value(text: str):
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return text
+
+
+def main():
+    options, axes = {}, {}
+    for arg in sys.argv[1:]:
+        name, value = arg.split('=', 1)
+        if name.isupper():
+            axes[name] = [parse_value(v) for v in value.split(',')]
+        else:
+            options[name] = value
+
+    scenarios = options['scenario'].split(',') if 'scenario' in options else list(SCENARIOS)
+    workers = int(options['workers']) if 'workers' in options else os.cpu_count()
+    rows = sweep(options.get('cc', 'bbr'), axes, scenarios, float(options.get('duration', DURATION)),
+                 workers, options.get('rank', 'power'))
+
+    out = open(options['out'], 'w', newline='') if 'out' in options else sys.stdout
+    writer = csv.DictWriter(out, fieldnames=list(rows[0]), lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(rows)
+    if out is not sys.stdout:
+        out.close()
+
+    for row in rows:
+        if row['rank'] == 1:
+            settings = " ".join(f"{name}={row[name]}" for name in axes) or "defaults"
+            print(f"best on {row['scenario']:12} {settings}  ({row['goodput_mbps']} Mbit/s, "
+                  f"p99 RTT {row['rtt_p99_ms']} ms)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark: HTTP/3 GET requests/sec as the server's worker count grows.
+
+    python bench_server.py [max_workers]
+
+Runs server.run() with 1, 2, 4, ... workers. Each time, client processes
+hammer it over loopback for DURATION seconds. Every client connection does
+a full handshake followed by REQUESTS_PER_CONNECTION GETs of /hello, so
+both key agreement and the per-packet AEAD path are exercised.
+
+The server normally sits on a utun device; LoopbackTun stands in for it,
+turning UDP datagrams into IP packets and back, so the server code is the
+same code that runs on a real tun. Clients compete with the server for
+cores, so scaling flattens once CLIENT_PROCESSES + workers exceed them.
+"""
+
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+sys.path.insert(0, '../tcp_ip_stack')
+sys.path.insert(0, '../quic')
+
+import crypto
+import server
+from endpoint import QUICEndpoint
+from http3 import build_request, parse_response
+from loopback import LoopbackTun
+
+DURATION = 5.0
+CLIENT_PROCESSES = 2
+CONNECTIONS_PER_CLIENT = 16
+REQUESTS_PER_CONNECTION = 10
+
+
+def run_server(sock, workers):
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        server_keys = {}
+        for group in server.SERVER_KEY_FILES:
+            private, public = crypto.generate_keypair(group)
+            server_keys[group] = (private, public)
+        server.run(LoopbackTun(sock, server.UDP_PORT), server_keys, workers)
+
+
+async def connection_loop(endpoint, port, deadline, counts):
+    while time.monotonic() < deadline:
+        conn = await endpoint.connect('127.0.0.1', port)
+        try:
+            for _ in range(REQUESTS_PER_CONNECTION):
+                stream_id = await conn.open_stream()
+                await conn.write(stream_id, build_request('GET', '/hello'), fin=True)
+                status, _ = parse_response(await conn.read(stream_id))
+                counts[status == 200] += 1
+        finally:
+            conn.close()
+
+
+def run_client(port, results):
+    async def main():
+        endpoint = await QUICEndpoint.create()
+        counts = {True: 0, False: 0}
+        deadline = time.monotonic() + DURATION
+        outcomes = await asyncio.gather(
+            *(connection_loop(endpoint, port, deadline, counts) for _ in range(CONNECTIONS_PER_CLIENT)),
+            return_exceptions=True)
+        endpoint.close()
+        errors = sum(isinstance(outcome, Exception) for outcome in outcomes)
+        return counts[True], counts[False] + errors
+
+    results.put(asyncio.run(main()))
+
+
+def measure(workers):
+    context = multiprocessing.get_context('fork')
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+
+    server_process = context.Process(target=run_server, args=(sock, workers))
+    server_process.start()
+    sock.close()
+    time.sleep(0.5)
+
+    results = context.Queue()
+    clients = [context.Process(target=run_client, args=(port, results)) for _ in range(CLIENT_PROCESSES)]
+    start = time.perf_counter()
+    for client in clients:
+        client.start()
+    outcomes = [results.get() for _ in clients]
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        client.join()
+
+    server_process.terminate()
+    server_process.join()
+
+    ok = sum(good for good, _ in outcomes)
+    failed = sum(bad for _, bad in outcomes)
+    return ok / elapsed, failed
+
+
+def main():
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    print(f"{CLIENT_PROCESSES} client processes x {CONNECTIONS_PER_CLIENT} connections, "
+          f"{REQUESTS_PER_CONNECTION} GETs per connection, {DURATION:.0f} s per run "
+          f"({os.cpu_count()} CPUs)\n")
+
+    workers = 1
+    while workers <= max_workers:
+        rate, failed = measure(workers)
+        print(f"{workers:3} worker{'s' if workers > 1 else ' '}  {rate:10,.0f} requests/s"
+              f"{f'  ({failed} failed)' if failed else ''}")
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main()
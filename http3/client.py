@@ -2,25 +2,34 @@
 HTTP/3 Client - sends requests over QUIC.
 """
 
+import asyncio
 import sys
 sys.path.insert(0, '../quic')
 
 from http3 import build_request, parse_response
-from quic_client import QUICClient
+from endpoint import QUICEndpoint
 
 
-def request(host, port, method, path):
-    client = QUICClient(host, port)
-    client.connect()
-
-    req = build_request(method, path)
-    client.send(stream_id=0, data=req)
-
-    response = None
-    while response is None:
-        response = client.receive()
-
-    client.close()
+async def request_async(endpoint, host, port, method, path):
+    """Send one request on a new connection from a shared endpoint."""
+    conn = await endpoint.connect(host, port)
+    try:
+        stream_id = await conn.open_stream()
+        await conn.write(stream_id, build_request(method, path), fin=True)
+        response = await conn.read(stream_id)
+    finally:
+        conn.close()
 
     status, body = parse_response(response)
     return status, body
+
+
+def request(host, port, method, path):
+    async def run():
+        endpoint = await QUICEndpoint.create()
+        try:
+            return await request_async(endpoint, host, port, method, path)
+        finally:
+            endpoint.close()
+
+    return asyncio.run(run())
@@ -3,7 +3,9 @@ HTTP/3 Server - receives requests over QUIC, sends responses.
 """
 
 import os
+import select
 import sys
+import time
 sys.path.insert(0, '../tcp_ip_stack')
 sys.path.insert(0, '../quic')
 
@@ -12,29 +14,44 @@ from packet_headers import IPHeader, UDPHeader
 import protocols
 import crypto
 import frames
+import pacer
+import streams
+from connection_ids import ConnectionIDManager
+from handshake_pool import HandshakePool
+from workers import Dispatcher, peek_connection_id
 from http3 import parse_request, build_response
 
 UDP_PORT = 9000
-SERVER_KEY_FILE = 'server_key.bin'
+SERVER_KEY_FILES = {
+    crypto.KEX_MODP2048: 'server_key.bin',
+    crypto.KEX_X25519: 'server_x25519_key.bin',
+}
 
 PACKET_DATA = 0x01
 PACKET_INIT = 0x03
 PACKET_ACCEPT = 0x04
 
-connections = {}
+MAX_STREAM_PAYLOAD = 1200
+PTO_FACTOR = 3
+MAX_PTO_COUNT = 8
+PACING_GAIN = 2
 
+connections = None
+timers = None   # TimerWheel of (conn_id, deadline_ns); entries no longer in conn['timer'] are stale
 
-def load_or_generate_server_key():
-    if os.path.exists(SERVER_KEY_FILE):
-        with open(SERVER_KEY_FILE, 'rb') as f:
-            private = int.from_bytes(f.read(), 'big')
-            print(f"[Server] Loaded existing keypair from {SERVER_KEY_FILE}")
+
+def load_or_generate_server_key(group):
+    path = SERVER_KEY_FILES[group]
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            private = crypto.private_key_from_bytes(group, f.read())
+            print(f"[Server] Loaded existing keypair from {path}")
             return private
     else:
-        private = crypto.generate_private_key()
-        with open(SERVER_KEY_FILE, 'wb') as f:
-            f.write(private.to_bytes(32, 'big'))
-        print(f"[Server] Generated new keypair, saved to {SERVER_KEY_FILE}")
+        private, _ = crypto.generate_keypair(group)
+        with open(path, 'wb') as f:
+            f.write(crypto.private_key_to_bytes(group, private))
+        print(f"[Server] Generated new keypair, saved to {path}")
         return private
 
 
@@ -65,85 +82,355 @@ def send_udp(tun, src_ip, src_port, dest_ip, dest_port, payload):
     tun.write(ip_bytes + udp_bytes)
 
 
-def main():
-    server_private = load_or_generate_server_key()
-    server_public = crypto.compute_public_key(server_private)
+def send_frames(tun, server_ip, conn_id, conn, payload, addr=None):
+    packet = conn['send_keys'].seal(bytes([PACKET_DATA]) + conn_id, payload)
+    send_udp(tun, server_ip, UDP_PORT, *(addr or conn['last_addr']), packet)
 
-    tun = TunDevice()
-
-    print("\nHTTP/3 Server listening on port 9000...")
-    print("Configure: sudo ifconfig utun<X> 192.168.100.1 192.168.100.2 netmask 255.255.255.0 up")
-    input("\nPress Enter after configuring interface...")
 
+def flush_streams(tun, server_ip, conn_id, conn):
+    """
+    Send lost and queued response bytes on every stream, by priority, until
+    empty, out of credit or out of pacing budget. Out of credit, tell the
+    client so, again every BLOCKED interval. Sent ranges stay in
+    conn['send'] until acknowledged.
+    """
+    now = time.time()
+    bucket = conn['pacer']
+    bucket.set_rate(pacing_rate(conn))
+    release = None
     while True:
-        packet_bytes = tun.read()
-        if not packet_bytes:
-            continue
+        if not bucket.take(MAX_STREAM_PAYLOAD):
+            # Wake again once the next small burst is due
+            release = pacer.now_ns() + bucket.wake_delay_ns(MAX_STREAM_PAYLOAD)
+            break
+        chunks = conn['send'].next_packet(MAX_STREAM_PAYLOAD, now)
+        if not chunks:
+            bucket.refund(MAX_STREAM_PAYLOAD)
+            break
+        payload = b''.join(frames.encode_stream(stream_id, offset, data, fin)
+                           for stream_id, offset, data, fin in chunks)
+        send_frames(tun, server_ip, conn_id, conn, payload)
+
+    blocked_frames = conn['send'].blocked_frames()
+    if not blocked_frames:
+        conn['blocked_at'] = None
+    elif conn['blocked_at'] is None or now >= conn['blocked_at'] + blocked_interval(conn):
+        send_frames(tun, server_ip, conn_id, conn, blocked_frames)
+        conn['blocked_at'] = now
+    arm_timer(conn_id, conn, release)
+
+
+def pacing_rate(conn) -> float:
+    """
+    Bytes/sec to release. There is no congestion controller here: the
+    client's flow-control window is what limits us, so it is spread over
+    one RTT (with headroom, PACING_GAIN) instead of going out in one burst.
+    """
+    send = conn['send']
+    window = send.max_data - send.sent + send.in_flight
+    return PACING_GAIN * window / conn['recv'].rtt
+
+
+def pto(conn) -> float:
+    """Probe timeout: PTO_FACTOR RTTs, doubled for every probe since the last ACK."""
+    return PTO_FACTOR * conn['recv'].rtt * 2 ** conn['pto_count']
+
+
+def blocked_interval(conn) -> float:
+    """Window updates aren't acknowledged: BLOCKED goes out again every two RTTs."""
+    return 2 * conn['recv'].rtt
+
+
+def wheel_time(t: float) -> int:
+    """A time.time() value on the timer wheel's clock, pacer.now_ns()."""
+    return pacer.now_ns() + int((t - time.time()) * 1e9)
+
+
+def arm_timer(conn_id, conn, release=None):
+    """Make sure the connection wakes up by its next pacing release, probe or BLOCKED deadline."""
+    deadlines = [] if release is None else [release]
+    oldest = conn['send'].oldest_unacked()
+    if oldest is not None:
+        deadlines.append(wheel_time(oldest + pto(conn)))
+    if conn['blocked_at'] is not None:
+        deadlines.append(wheel_time(conn['blocked_at'] + blocked_interval(conn)))
+    if not deadlines:
+        return
+    deadline = min(deadlines)
+    # An earlier entry already armed fires first and re-arms from there
+    if conn['timer'] is None or deadline < conn['timer']:
+        conn['timer'] = deadline
+        timers.schedule(deadline, (conn_id, deadline))
+
+
+def next_timeout(limit=1.0):
+    """Seconds until the earliest timer, at most `limit` so idle eviction still runs."""
+    deadline = timers.next_deadline_ns()
+    if deadline is None:
+        return limit
+    return max(0.0, min(limit, (deadline - pacer.now_ns()) / 1e9))
+
+
+def on_timers(tun):
+    """Release paced data, resend data unacknowledged for a PTO, repeat BLOCKED."""
+    for conn_id, deadline in timers.advance(pacer.now_ns()):
+        conn = connections.lookup(conn_id)
+        if conn is None or conn['timer'] != deadline:
+            continue   # evicted, or re-armed since
+        conn['timer'] = None
+        if conn['send'].detect_lost(time.time(), pto(conn)):
+            conn['pto_count'] += 1
+            if conn['pto_count'] > MAX_PTO_COUNT:
+                connections.remove(conn)
+                print(f"[{conn_id.hex()[:8]}] Client stopped acknowledging, dropped")
+                continue
+        flush_streams(tun, conn['server_ip'], conn_id, conn)
 
-        ip_header = IPHeader.from_bytes(packet_bytes)
-        if ip_header.protocol != protocols.PROTO_UDP:
-            continue
 
-        udp_bytes = packet_bytes[ip_header.ihl * 4:]
-        udp_header = UDPHeader.from_bytes(udp_bytes)
+def handle_request(tun, server_ip, conn_id, conn, stream_id, request_bytes):
+    method, path = parse_request(request_bytes)
+    print(f"[{conn_id.hex()[:8]}] Request: {method} {path}")
 
-        if udp_header.dest_port != UDP_PORT:
-            continue
+    if path == "/hello":
+        status, response_bytes = 200, build_response(200, b"Hello World")
+    else:
+        status, response_bytes = 404, build_response(404, b"Not Found")
+
+    conn['send'].write(stream_id, response_bytes, fin=True)
+    flush_streams(tun, server_ip, conn_id, conn)
+    print(f"[{conn_id.hex()[:8]}] Response: {status}\n")
+
+
+def handle_packet(tun, pool, server_ip, client_addr, payload):
+    if len(payload) < 1:
+        return
+
+    packet_type = payload[0]
+
+    if packet_type == PACKET_INIT:
+        conn_id = payload[1:9]
+        try:
+            group, their_public, _ = crypto.decode_key_share(payload[9:])
+        except ValueError:
+            return
+        print(f"[{conn_id.hex()[:8]}] INIT received")
+
+        conn = connections.lookup(conn_id)
+        if conn is not None:
+            # Our ACCEPT was lost: repeat it, keys and packet numbers stay
+            send_udp(tun, server_ip, UDP_PORT, *client_addr, conn['accept'])
+            print(f"[{conn_id.hex()[:8]}] Duplicate INIT, ACCEPT resent")
+            return
+
+        state = {'client_addr': client_addr, 'server_ip': server_ip}
+        if pool.start(conn_id, group, their_public, state):
+            print(f"[{conn_id.hex()[:8]}] Key agreement queued")
+
+    elif packet_type == PACKET_DATA:
+        conn_id = payload[1:9]
+        conn = connections.lookup(conn_id)
+        if conn is None:
+            if not pool.buffer(conn_id, (server_ip, client_addr, payload)):
+                print(f"[{conn_id.hex()[:8]}] Unknown connection, dropping")
+            return
+
+        try:
+            decrypted = conn['recv_keys'].open(payload, 9)
+        except Exception:
+            return
+        connections.touch(conn)
+
+        # A new address only becomes the connection's path once it answers
+        challenge = connections.challenge_path(conn, client_addr)
+        if challenge:
+            send_frames(tun, server_ip, conn_id, conn, challenge, client_addr)
+            conn['challenge_sent'] = time.time()
+            print(f"[{conn_id.hex()[:8]}] Packet from new address {client_addr}, challenging")
+
+        # The client's first packet answers our ACCEPT
+        accept_time = conn.pop('accept_time', None)
+        if accept_time is not None:
+            conn['recv'].on_rtt(time.time() - accept_time)
+
+        acks = b''
+        acked = False
+        pos = 0
+        while pos < len(decrypted):
+            frame_type, frame_data, consumed = frames.decode_frame(decrypted[pos:])
+            if frame_type is None:
+                break
+            pos += consumed
+
+            if frame_type == frames.FRAME_STREAM:
+                stream_id, offset, data, fin = frame_data
+                try:
+                    stream = conn['recv'].on_stream_frame(stream_id, offset, data, fin)
+                except streams.FlowControlError as e:
+                    print(f"[{conn_id.hex()[:8]}] Flow control error: {e}")
+                    break
+                if stream is None:
+                    continue  # no room to buffer it, unacknowledged the client resends
+                acks += frames.encode_ack(stream_id, offset)
+                if stream.complete and stream.readable:
+                    request_bytes = conn['recv'].read(stream_id)
+                    handle_request(tun, server_ip, conn_id, conn, stream_id, request_bytes)
+
+            elif frame_type == frames.FRAME_ACK:
+                now = time.time()
+                sent_time = conn['send'].on_ack(*frame_data, now, conn['recv'].rtt)
+                if sent_time is not None:
+                    conn['recv'].on_rtt(now - sent_time)
+                    conn['pto_count'] = 0
+                    acked = True
+
+            elif frame_type in (frames.FRAME_DATA_BLOCKED, frames.FRAME_STREAM_DATA_BLOCKED):
+                # A window update of ours was lost: repeat the current limits
+                acks += conn['recv'].on_blocked(frame_type, frame_data)
+
+            elif frame_type == frames.FRAME_PATH_CHALLENGE:
+                send_frames(tun, server_ip, conn_id, conn, frames.encode_path_response(frame_data), client_addr)
+
+            elif frame_type == frames.FRAME_PATH_RESPONSE:
+                if connections.on_path_response(conn, frame_data, client_addr):
+                    challenge_sent = conn.pop('challenge_sent', None)
+                    if challenge_sent is not None:
+                        conn['recv'].on_rtt(time.time() - challenge_sent, reset=True)
+                    print(f"[{conn_id.hex()[:8]}] Path validated, migrated to {client_addr}")
+
+            elif conn['send'].on_frame(frame_type, frame_data):
+                flush_streams(tun, server_ip, conn_id, conn)
+
+        updates = acks + conn['recv'].pending_updates(time.time())
+        if updates:
+            send_frames(tun, server_ip, conn_id, conn, updates)
+        if acked:
+            # Resends whatever the ACKs showed lost
+            flush_streams(tun, server_ip, conn_id, conn)
+
+
+def on_handshake_complete(tun, pool, server_keys, handshake, shared_secret):
+    conn_id = handshake.conn_id
+    state = handshake.state
+    if shared_secret is None:
+        print(f"[{conn_id.hex()[:8]}] Key agreement failed, dropping")
+        return
+
+    _, server_public = server_keys[handshake.group]
+    server_random = os.urandom(crypto.SERVER_RANDOM_LENGTH)
+    accept_payload = bytes([PACKET_ACCEPT]) + conn_id + \
+        crypto.encode_server_share(handshake.group, server_public, server_random)
+
+    shared_secret = crypto.handshake_secret(shared_secret, server_random)
+    send_keys, recv_keys = crypto.derive_packet_protection(shared_secret, is_client=False)
+    conn = {
+        'send_keys': send_keys,
+        'recv_keys': recv_keys,
+        'last_addr': state['client_addr'],
+        'server_ip': state['server_ip'],
+        'recv': streams.ReceiveStreams(),
+        'send': streams.SendStreams(),
+        'pto_count': 0,
+        'blocked_at': None,
+        'timer': None,
+        'pacer': pacer.TokenBucket(),
+        'accept': accept_payload,
+    }
+    connections.add(conn_id, conn)
+    print(f"[{conn_id.hex()[:8]}] Connection established")
+
+    send_udp(tun, state['server_ip'], UDP_PORT, *state['client_addr'], accept_payload)
+    conn['accept_time'] = time.time()
+    print(f"[{conn_id.hex()[:8]}] ACCEPT sent\n")
+
+    for server_ip, client_addr, payload in handshake.early_packets:
+        handle_packet(tun, pool, server_ip, client_addr, payload)
+
+
+def handle_ip_packet(tun, pool, packet_bytes):
+    ip_header = IPHeader.from_bytes(packet_bytes)
+    if ip_header.protocol != protocols.PROTO_UDP:
+        return
+
+    udp_bytes = packet_bytes[ip_header.ihl * 4:]
+    udp_header = UDPHeader.from_bytes(udp_bytes)
+
+    if udp_header.dest_port != UDP_PORT:
+        return
+
+    client_addr = (ip_header.src_ip, udp_header.src_port)
+    handle_packet(tun, pool, ip_header.dest_ip, client_addr, udp_header.payload)
+
+
+def serve(tun, server_keys, inbox=None):
+    """Packet loop. Reads the tun device, or a worker's inbox in multi-worker mode."""
+    global connections, timers
+
+    # Only the client's CID is used and no stateless resets are sent, so
+    # the reset key never leaves this process
+    connections = ConnectionIDManager(os.urandom(32))
+    timers = pacer.TimerWheel()
+
+    # Key agreement runs in worker processes, never in the packet loop
+    pool = HandshakePool({group: private for group, (private, _) in server_keys.items()})
+    source = inbox if inbox is not None else tun.sock
 
-        payload = udp_header.payload
-        if len(payload) < 1:
-            continue
+    try:
+        while True:
+            readable, _, _ = select.select([source, pool], [], [], next_timeout())
+            on_timers(tun)
 
-        packet_type = payload[0]
+            # Their timer entries go stale: on_timers skips IDs that no longer resolve
+            for conn in connections.evict_idle():
+                print(f"[{conn['conn_id'].hex()[:8]}] Idle, evicted ({len(connections)} connections left)")
 
-        if packet_type == PACKET_INIT:
-            conn_id = payload[1:9]
-            their_public = int.from_bytes(payload[9:265], 'big')
-            print(f"[{conn_id.hex()[:8]}] INIT received")
+            for handshake, shared_secret in pool.completed():
+                on_handshake_complete(tun, pool, server_keys, handshake, shared_secret)
 
-            shared_secret = crypto.compute_shared_secret(their_public, server_private)
-            aes_key = crypto.derive_aes_key(shared_secret)
+            if source not in readable:
+                continue
 
-            connections[conn_id] = {
-                'aes_key': aes_key,
-                'client_ip': ip_header.src_ip,
-                'client_port': udp_header.src_port
-            }
-            print(f"[{conn_id.hex()[:8]}] Connection established")
+            packets = inbox.get() if inbox is not None else [tun.read()]
+            for packet_bytes in packets:
+                if packet_bytes:
+                    handle_ip_packet(tun, pool, packet_bytes)
+    finally:
+        pool.close()
 
-            accept_payload = bytes([PACKET_ACCEPT]) + conn_id + server_public.to_bytes(256, 'big')
-            send_udp(tun, ip_header.dest_ip, UDP_PORT, ip_header.src_ip, udp_header.src_port, accept_payload)
-            print(f"[{conn_id.hex()[:8]}] ACCEPT sent\n")
 
-        elif packet_type == PACKET_DATA:
-            conn_id = payload[1:9]
-            if conn_id not in connections:
-                print(f"[{conn_id.hex()[:8]}] Unknown connection, dropping")
+def run(tun, server_keys, workers=1):
+    if workers <= 1:
+        serve(tun, server_keys)
+        return
+
+    # Front-end: route each packet to the worker that owns its connection ID
+    dispatcher = Dispatcher(workers, serve, (tun, server_keys))
+    try:
+        while True:
+            packet_bytes = tun.read()
+            if not packet_bytes:
                 continue
+            cid = peek_connection_id(packet_bytes, UDP_PORT)
+            if cid is not None:
+                dispatcher.dispatch(cid, packet_bytes)
+    finally:
+        dispatcher.close()
 
-            conn = connections[conn_id]
-            encrypted = payload[9:]
-            decrypted = crypto.decrypt(conn['aes_key'], encrypted)
 
-            frame_type, frame_data, _ = frames.decode_frame(decrypted)
-            if frame_type != frames.FRAME_STREAM:
-                continue
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 1
 
-            stream_id, offset, request_bytes = frame_data
-            method, path = parse_request(request_bytes)
-            print(f"[{conn_id.hex()[:8]}] Request: {method} {path}")
+    server_keys = {}
+    for group in SERVER_KEY_FILES:
+        private = load_or_generate_server_key(group)
+        server_keys[group] = (private, crypto.public_key_bytes(group, private))
 
-            if path == "/hello":
-                response_bytes = build_response(200, b"Hello World")
-            else:
-                response_bytes = build_response(404, b"Not Found")
+    tun = TunDevice()
 
-            response_frame = frames.encode_stream(stream_id, 0, response_bytes)
-            response_encrypted = crypto.encrypt(conn['aes_key'], response_frame)
-            response_packet = bytes([PACKET_DATA]) + conn_id + response_encrypted
+    print(f"\nHTTP/3 Server listening on port 9000 ({workers} worker{'s' if workers > 1 else ''})...")
+    print("Configure: sudo ifconfig utun<X> 192.168.100.1 192.168.100.2 netmask 255.255.255.0 up")
+    input("\nPress Enter after configuring interface...")
 
-            send_udp(tun, ip_header.dest_ip, UDP_PORT, ip_header.src_ip, udp_header.src_port, response_packet)
-            print(f"[{conn_id.hex()[:8]}] Response: 200 OK\n")
+    run(tun, server_keys, workers)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,232 @@
+"""
+Benchmark: QUIC end to end over loopback, through an emulated path.
+
+    python bench_e2e.py                          # the preset paths below
+    python bench_e2e.py delay=20 loss=1 rate=20  # one custom path
+    python bench_e2e.py delay=20 ack_loss=5      # loss toward the sender
+    python bench_e2e.py cc=cubic                 # presets, another controller
+
+Three processes, no tun device: udp_multiplexer.serve() behind a
+LoopbackTun, an ImpairmentProxy (impairment.py) and sender.send()
+pushing SIZE_MB of random data. Custom paths take delay and jitter in ms
+(one way), loss, ack_loss and reorder in percent, rate in Mbit/s, the
+bottleneck queue in ms and size in MB; cc names the congestion
+controller (bbr.registry: newreno, cubic, bbr, bbr2; BBR by default).
+
+Loss, reordering and the bottleneck rate apply to the data direction.
+The ACK direction gets the same delay and jitter, and ack_loss: lost
+ACKs, window updates and handshake replies, which the sender recovers
+from by retransmitting and by reporting itself blocked.
+
+Reported per path: goodput (acknowledged bytes over wall time), the RTT
+distribution the controller saw, retransmissions, CPU per byte for
+client and server, and the controller's state changes over time.
+"""
+
+import contextlib
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+
+import crypto
+import sender
+import tickets
+import udp_multiplexer
+from bbr import registry, PathCache
+from impairment import ImpairmentProxy, Link
+from loopback import LoopbackTun
+
+SIZE_MB = 2
+TIMEOUT = 60.0
+
+SCENARIOS = [
+    ('loopback', {}, {}),
+    ('20 ms RTT, 20 Mbit/s', dict(delay=0.010, rate=2.5e6), dict(delay=0.010)),
+    ('20 ms RTT, 20 Mbit/s, 1% loss', dict(delay=0.010, rate=2.5e6, loss=0.01), dict(delay=0.010)),
+    ('20 ms RTT, 20 Mbit/s, jitter, 2% reorder',
+     dict(delay=0.010, jitter=0.002, reorder=0.02, rate=2.5e6), dict(delay=0.010, jitter=0.002)),
+    ('20 ms RTT, 20 Mbit/s, 1% loss both ways',
+     dict(delay=0.010, rate=2.5e6, loss=0.01), dict(delay=0.010, loss=0.01)),
+]
+
+
+class Recording:
+    """Mixed into a controller: keeps every RTT sample and the time of each state change."""
+
+    def __init__(self):
+        super().__init__()
+        self.samples = []
+        self.timeline = []
+        self.start = time.time()
+
+    def on_ack(self, packet, now: float):
+        sample = super().on_ack(packet, now)
+        if sample.rtt is not None:
+            self.samples.append(sample.rtt)
+        return sample
+
+    def update(self, now: float):
+        decision = super().update(now)
+        if not self.timeline or self.timeline[-1][1] != decision.state:
+            self.timeline.append((now - self.start, decision.state, decision.cwnd))
+        return decision
+
+
+def recording(cc):
+    return type(f'Recording{cc.__name__}', (Recording, cc), {})
+
+
+def report_on_exit(conn, report):
+    """Exit on SIGTERM, sending report() down conn on the way out."""
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    stack = contextlib.ExitStack()
+    stack.callback(lambda: conn.send(report()))
+    return stack
+
+
+def run_server(sock, conn):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), \
+         report_on_exit(conn, time.process_time):
+        server_keys = {group: crypto.generate_keypair(group) for group in udp_multiplexer.SERVER_KEY_FILES}
+        udp_multiplexer.ticket_issuer = tickets.TicketIssuer(os.urandom(32))
+        udp_multiplexer.serve(LoopbackTun(sock, udp_multiplexer.UDP_PORT), server_keys, os.urandom(32))
+
+
+def run_proxy(sock, server_addr, upstream, downstream, conn):
+    proxy = ImpairmentProxy(sock, server_addr, Link(**upstream), Link(**downstream))
+    with report_on_exit(conn, lambda: (proxy.upstream.stats, proxy.downstream.stats)):
+        proxy.run()
+
+
+def run_client(proxy_addr, size, cc, conn):
+    sender.DEST_IP, sender.UDP_PORT = proxy_addr
+    sender.SERVER = f'{sender.DEST_IP}:{sender.UDP_PORT}'
+    sender.ticket_cache = tickets.TicketCache()
+    # Every run starts cold: a path cached from the last preset would skew this one
+    sender.path_cache = PathCache()
+    sender.controller = controller = recording(registry.CONTROLLERS[cc])()
+
+    def on_timeout(signum, frame):
+        raise TimeoutError
+
+    signal.signal(signal.SIGALRM, on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, TIMEOUT)
+    wall, cpu = time.perf_counter(), time.process_time()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            sender.send(os.urandom(size))
+            stalled = False
+        except TimeoutError:
+            stalled = True
+    signal.setitimer(signal.ITIMER_REAL, 0)
+
+    conn.send({
+        'wall': time.perf_counter() - wall,
+        'cpu': time.process_time() - cpu,
+        'acked': sender.transfer.acked,
+        'stalled': stalled,
+        'sent': sender.packets_sent,
+        'retransmitted': sender.packets_retransmitted,
+        'rtts': controller.samples,
+        'timeline': controller.timeline,
+    })
+
+
+def bound_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.bind(('127.0.0.1', 0))
+    return sock
+
+
+def run(upstream, downstream, size, cc='bbr'):
+    server_sock, proxy_sock = bound_socket(), bound_socket()
+    pipes = [multiprocessing.Pipe(duplex=False) for _ in range(3)]
+    server = multiprocessing.Process(target=run_server, args=(server_sock, pipes[0][1]))
+    proxy = multiprocessing.Process(target=run_proxy, args=(proxy_sock, server_sock.getsockname(),
+                                                            upstream, downstream, pipes[1][1]))
+    client = multiprocessing.Process(target=run_client, args=(proxy_sock.getsockname(), size, cc,
+                                                               pipes[2][1]))
+    for process in (server, proxy, client):
+        process.start()
+
+    result = pipes[2][0].recv()
+    client.join()
+    for process in (proxy, server):
+        process.terminate()
+    result['server_cpu'] = pipes[0][0].recv()
+    result['path_up'], result['path_down'] = pipes[1][0].recv()
+    for process in (proxy, server):
+        process.join()
+    return result
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def show(name, result):
+    print(f"\n== {name} ==")
+    acked, wall = result['acked'], result['wall']
+    status = "  STALLED" if result['stalled'] else ""
+    print(f"goodput  {acked * 8 / wall / 1e6:6.1f} Mbit/s  ({acked / 1e6:.1f} MB in {wall:.1f} s){status}")
+
+    rtts = sorted(result['rtts'])
+    if rtts:
+        ms = [percentile(rtts, p) * 1000 for p in (0, 0.5, 0.9, 0.99)] + [rtts[-1] * 1000]
+        print(f"rtt      min {ms[0]:.1f}  p50 {ms[1]:.1f}  p90 {ms[2]:.1f}  p99 {ms[3]:.1f}  "
+              f"max {ms[4]:.1f} ms  ({len(rtts)} samples)")
+
+    sent, resent = result['sent'], result['retransmitted']
+    up, down = result['path_up'], result['path_down']
+    print(f"packets  {sent} sent, {resent} retransmitted ({resent / max(sent, 1):.1%}); "
+          f"path lost {up['lost']}, queue-dropped {up['queue_drops']}, reordered {up['reordered']}, "
+          f"acks lost {down['lost']}")
+
+    per_byte = 1e9 / max(acked, 1)
+    print(f"cpu      client {result['cpu'] * per_byte:.0f} ns/B, server {result['server_cpu'] * per_byte:.0f} ns/B")
+
+    states = "  ".join(f"{t:.2f}s {state}({cwnd})" for t, state, cwnd in result['timeline'])
+    print(f"states   {states}")
+
+
+def parse_path(options):
+    """delay=20 loss=1 ... into (upstream, downstream, size) Link arguments."""
+    common = {}
+    if 'delay' in options:
+        common['delay'] = float(options['delay']) / 1000
+    if 'jitter' in options:
+        common['jitter'] = float(options['jitter']) / 1000
+    upstream, downstream = dict(common), dict(common)
+    if 'loss' in options:
+        upstream['loss'] = float(options['loss']) / 100
+    if 'ack_loss' in options:
+        downstream['loss'] = float(options['ack_loss']) / 100
+    if 'reorder' in options:
+        upstream['reorder'] = float(options['reorder']) / 100
+    if 'rate' in options:
+        upstream['rate'] = float(options['rate']) * 1e6 / 8
+    if 'queue' in options:
+        upstream['queue'] = float(options['queue']) / 1000
+    size = int(float(options.get('size', SIZE_MB)) * 1_000_000)
+    return upstream, downstream, size
+
+
+def main():
+    options = dict(arg.split('=', 1) for arg in sys.argv[1:])
+    cc = options.pop('cc', 'bbr')
+    if options:
+        upstream, downstream, size = parse_path(options)
+        show(" ".join(sys.argv[1:]), run(upstream, downstream, size, cc))
+        return
+
+    print(f"{SIZE_MB} MB per path, {cc}")
+    for name, upstream, downstream in SCENARIOS:
+        show(name, run(upstream, downstream, SIZE_MB * 1_000_000, cc))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark: data packets vs handshakes in one server loop.
+
+    python bench_handshake_offload.py [modp|x25519]
+
+Replays a stream of established-connection DATA packets with an INIT
+mixed in every HANDSHAKE_EVERY packets, the way a reconnect storm looks
+to the server. Inline mode does key agreement in the loop (the old
+behaviour); offload mode hands it to HandshakePool. The "gap" columns are
+the time between consecutive DATA packets - how long established
+connections wait while the loop is busy with something else.
+
+Offloading pays for itself with MODP (milliseconds per agreement); an
+X25519 agreement is cheaper than the round trip to a worker, so there it
+mostly costs throughput. With spare cores the workers also run in parallel.
+"""
+
+import os
+import select
+import sys
+import time
+
+import crypto
+import frames
+from handshake_pool import HandshakePool
+
+DATA_PACKETS = 20_000
+HANDSHAKE_EVERY = 100
+PAYLOAD = bytes(1000)
+
+
+def build_traffic(group):
+    """Sealed DATA packets for one established connection, plus INIT key shares."""
+    secret = os.urandom(32)
+    client_send, _ = crypto.derive_packet_protection(secret, is_client=True)
+    conn_id = os.urandom(8)
+    prefix = bytes([0x01]) + conn_id
+    packets = [client_send.seal(prefix, frames.encode_stream(0, i * len(PAYLOAD), PAYLOAD))
+               for i in range(DATA_PACKETS)]
+    shares = [crypto.generate_keypair(group)[1] for _ in range(DATA_PACKETS // HANDSHAKE_EVERY)]
+    return secret, packets, shares
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(label, secret, packets, shares, on_init, poll, finish):
+    _, server_recv = crypto.derive_packet_protection(secret, is_client=False)
+    gaps = []
+
+    start = last = time.perf_counter()
+    for i, packet in enumerate(packets):
+        if i % HANDSHAKE_EVERY == 0:
+            on_init(os.urandom(8), shares[i // HANDSHAKE_EVERY])
+        poll()
+
+        frames.decode_frame(server_recv.open(packet, 9))
+        now = time.perf_counter()
+        gaps.append(now - last)
+        last = now
+    finish()
+    elapsed = time.perf_counter() - start
+
+    gaps.sort()
+    print(f"{label:8} {DATA_PACKETS / elapsed:10,.0f} data pkts/s  "
+          f"gap p50 {percentile(gaps, 0.5) * 1e6:7.1f} us  "
+          f"p99 {percentile(gaps, 0.99) * 1e6:8.1f} us  "
+          f"max {gaps[-1] * 1e6:8.1f} us  "
+          f"{len(shares) / elapsed:7,.0f} handshakes/s")
+
+
+def main():
+    group = crypto.KEX_X25519 if sys.argv[1:] == ['x25519'] else crypto.KEX_MODP2048
+    server_private, _ = crypto.generate_keypair(group)
+    secret, packets, shares = build_traffic(group)
+
+    print(f"{DATA_PACKETS:,} DATA packets, one INIT every {HANDSHAKE_EVERY} "
+          f"({len(shares)} handshakes, group 0x{group:02x})\n")
+
+    def inline_init(conn_id, their_public):
+        shared_secret = crypto.key_agreement(group, server_private, their_public)
+        crypto.derive_packet_protection(shared_secret, is_client=False)
+
+    run("inline", secret, packets, shares, inline_init, lambda: None, lambda: None)
+
+    pool = HandshakePool({group: server_private})
+    try:
+        # Spawn the workers before timing
+        pool.start(b'warmup', group, shares[0])
+        while pool.pending:
+            select.select([pool], [], [])
+            pool.completed()
+
+        def offload_init(conn_id, their_public):
+            pool.start(conn_id, group, their_public)
+
+        def poll():
+            readable, _, _ = select.select([pool], [], [], 0)
+            if readable:
+                pool.completed()
+
+        def finish():
+            while pool.pending:
+                select.select([pool], [], [])
+                pool.completed()
+
+        run("offload", secret, packets, shares, offload_init, poll, finish)
+    finally:
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
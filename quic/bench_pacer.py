@@ -0,0 +1,130 @@
+"""
+Benchmark: hitting a pacing rate, and what it costs in CPU.
+
+    python bench_pacer.py
+
+One flow: the old sender loop (spin on the clock, send when the interval
+has passed, at most one packet per pass) against TokenBucket + select(),
+which queues each burst and hands it to the kernel in one GSO send
+(udp_io.BatchSocket, as sender.py does).
+Many flows: FLOWS connections, each with its own bucket, all driven by
+one TimerWheel. Packets are real 1200-byte datagrams to a loopback socket
+nobody reads. "cpu" is process time over wall time.
+"""
+
+import select
+import socket
+import time
+
+import pacer
+import udp_io
+
+DURATION = 2.0
+SIZE = 1200
+RATES = (1_000, 10_000, 50_000)
+FLOWS = 1_000
+FLOW_RATE = 50
+
+
+def make_socket():
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    tx.setblocking(False)
+    return tx, sink.getsockname(), sink
+
+
+def timed(fn, *args):
+    wall, cpu = time.perf_counter(), time.process_time()
+    sent = fn(*args)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    return sent / wall, cpu / wall
+
+
+def send(tx, addr, packet):
+    try:
+        tx.sendto(packet, addr)
+    except BlockingIOError:
+        pass
+
+
+def spin(rate):
+    tx, addr, _ = make_socket()
+    packet = bytes(SIZE)
+    interval = 1 / rate
+    sent = 0
+    last = 0
+    end = time.time() + DURATION
+    while True:
+        now = time.time()
+        if now >= end:
+            return sent
+        if now - last >= interval:
+            send(tx, addr, packet)
+            sent += 1
+            last = now
+
+
+def bucket(rate):
+    tx, addr, _ = make_socket()
+    udp = udp_io.BatchSocket(tx)
+    packet = bytes(SIZE)
+    tokens = pacer.TokenBucket(rate * SIZE)
+    sent = 0
+    end = pacer.now_ns() + int(DURATION * 1e9)
+    while True:
+        now = pacer.now_ns()
+        if now >= end:
+            return sent
+        while tokens.take(SIZE, now):
+            udp.queue(packet, addr)
+            sent += 1
+        udp.flush()
+        select.select([], [], [], min(tokens.wake_delay_ns(SIZE), end - now) / 1e9)
+
+
+def wheel(flows, rate):
+    tx, addr, _ = make_socket()
+    udp = udp_io.BatchSocket(tx)
+    packet = bytes(SIZE)
+    timers = pacer.TimerWheel()
+    buckets = [pacer.TokenBucket(rate * SIZE, burst=SIZE) for _ in range(flows)]
+    start = pacer.now_ns()
+    for flow in range(flows):
+        # Spread the first sends over one interval
+        timers.schedule(start + flow * int(1e9 / rate) // flows, flow)
+
+    sent = 0
+    end = start + int(DURATION * 1e9)
+    while True:
+        now = pacer.now_ns()
+        if now >= end:
+            return sent
+        for flow in timers.advance(now):
+            tokens = buckets[flow]
+            while tokens.take(SIZE, now):
+                udp.queue(packet, addr)
+                sent += 1
+            timers.schedule(now + tokens.wake_delay_ns(SIZE), flow)
+        udp.flush()
+        deadline = timers.next_deadline_ns()
+        select.select([], [], [], max(0, min(deadline, end) - pacer.now_ns()) / 1e9)
+
+
+def main():
+    print(f"One flow, {SIZE}-byte packets, {DURATION:.0f} s per run\n")
+    print(f"{'target':>10}  {'spin loop':>22}  {'token bucket':>22}")
+    for rate in RATES:
+        spin_rate, spin_cpu = timed(spin, rate)
+        bucket_rate, bucket_cpu = timed(bucket, rate)
+        print(f"{rate:8,}/s  {spin_rate:9,.0f}/s  cpu {spin_cpu:4.0%}  "
+              f"{bucket_rate:9,.0f}/s  cpu {bucket_cpu:4.0%}")
+
+    target = FLOWS * FLOW_RATE
+    rate, cpu = timed(wheel, FLOWS, FLOW_RATE)
+    print(f"\n{FLOWS:,} flows x {FLOW_RATE}/s on one timer wheel: target {target:,}/s, "
+          f"sent {rate:,.0f}/s, cpu {cpu:.0%}")
+
+
+if __name__ == '__main__':
+    main()
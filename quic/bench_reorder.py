@@ -0,0 +1,85 @@
+"""
+Benchmark: in-order delivery cost as reordering gets deeper.
+
+    python bench_reorder.py
+
+Messages arrive with every block of DEPTH sequence numbers reversed, so
+up to DEPTH - 1 of them wait for the one that unblocks the block. "sorted
+list" is what multiplexer.py used to do (sort the pending list on every
+arrival, pop(0) on every delivery); "heap" is ReorderBuffer. The stream
+rows feed RecvStream STREAM frames in the same order, which is the QUIC
+receive path.
+"""
+
+import time
+
+import streams
+from reorder import ReorderBuffer
+
+MESSAGES = 20_000
+FRAME_SIZE = 1200
+DEPTHS = (16, 256, 4096)
+
+
+def arrival_order(count, depth):
+    order = []
+    for start in range(0, count, depth):
+        order.extend(reversed(range(start, min(start + depth, count))))
+    return order
+
+
+def sorted_list(order):
+    pending = []
+    next_to_deliver = 0
+    delivered = 0
+    for seq in order:
+        pending.append((seq, b'x'))
+        pending.sort(key=lambda x: x[0])
+        while pending and pending[0][0] == next_to_deliver:
+            pending.pop(0)
+            next_to_deliver += 1
+            delivered += 1
+    return delivered
+
+
+def heap(order):
+    buffer = ReorderBuffer(len(order))
+    delivered = 0
+    for seq in order:
+        buffer.push(seq, b'x')
+        delivered += len(buffer.pop())
+    return delivered
+
+
+def stream(order):
+    recv = streams.RecvStream(0)
+    # Flow control is not what's measured here
+    recv.flow.limit = len(order) * FRAME_SIZE
+    payload = bytes(FRAME_SIZE)
+    delivered = 0
+    for seq in order:
+        recv.on_data(seq * FRAME_SIZE, payload)
+        delivered += len(recv.read())
+    return delivered // FRAME_SIZE
+
+
+def measure(fn, order):
+    start = time.perf_counter()
+    delivered = fn(order)
+    elapsed = time.perf_counter() - start
+    assert delivered == len(order)
+    return elapsed / len(order) * 1e9
+
+
+def main():
+    print(f"{MESSAGES:,} messages, blocks of DEPTH reversed\n")
+    print(f"{'depth':>6}  {'sorted list':>14}  {'heap':>14}  {'stream frames':>14}")
+    for depth in DEPTHS:
+        order = arrival_order(MESSAGES, depth)
+        print(f"{depth:>6}  {measure(sorted_list, order):11,.0f} ns  "
+              f"{measure(heap, order):11,.0f} ns  {measure(stream, order):11,.0f} ns")
+    print("\n(per message)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Bulk transfer: feed a file or buffer into a QUIC stream without copying it.
+
+A source hands out the bytes at any offset as a memoryview:
+
+- BufferSource wraps bytes, bytearray, memoryview or an mmap. Slicing is
+  free, and a retransmission re-slices the same memory.
+- open_source() maps regular files (by path or open file) with mmap, so a
+  multi-GB file is never read into the heap. Pages behind the send offset
+  are dropped every RELEASE_STEP bytes; they are re-read from the page
+  cache if a retransmission needs them, so memory stays flat.
+- ReaderSource reads anything else with a readinto() (pipes, sockets,
+  compressed files) into one fresh buffer per chunk, kept only as long as
+  the packet is unacknowledged.
+- RepeatSource repeats a pattern forever, for load tests.
+
+Each chunk is copied once, into the sender's frame buffer, and encrypted
+from there straight into the packet (frames.encode_stream_into,
+PacketProtection.seal_into). Transfer counts bytes sent and acknowledged
+and reports progress and throughput through callbacks.
+"""
+
+import io
+import mmap
+import os
+import stat
+import time
+
+REPORT_INTERVAL = 1.0
+RELEASE_STEP = 64 * 1024 * 1024
+
+
+class BufferSource:
+    """Any buffer-protocol object (bytes, bytearray, memoryview, mmap)."""
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer).cast('B')
+        self.size = len(self.view)
+
+    def chunk(self, offset: int, n: int) -> memoryview:
+        return self.view[offset:offset + n]
+
+
+class MappedSource(BufferSource):
+    """A regular file, mapped read-only."""
+
+    def __init__(self, fileno: int):
+        self.released = 0
+        if os.fstat(fileno).st_size == 0:
+            # mmap refuses empty files
+            self.map = None
+            super().__init__(b'')
+            return
+        self.map = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+            self.map.madvise(mmap.MADV_SEQUENTIAL)
+        super().__init__(self.map)
+
+    def chunk(self, offset: int, n: int) -> memoryview:
+        if hasattr(mmap, 'MADV_DONTNEED') and offset - self.released >= 2 * RELEASE_STEP:
+            # Keep one step behind the send offset resident for retransmissions
+            end = (offset - RELEASE_STEP) // mmap.PAGESIZE * mmap.PAGESIZE
+            self.map.madvise(mmap.MADV_DONTNEED, self.released, end - self.released)
+            self.released = end
+        return super().chunk(offset, n)
+
+
+class ReaderSource:
+    """A file-like object read front to back with readinto()."""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.size = None
+        self.offset = 0
+
+    def chunk(self, offset: int, n: int) -> memoryview:
+        if offset != self.offset:
+            raise ValueError(f"reader sources are sequential: asked for {offset}, at {self.offset}")
+        # A fresh buffer per chunk: the packet that carries it may be resent
+        buf = bytearray(n)
+        got = self.reader.readinto(buf)
+        if got is None:
+            return memoryview(b'')  # non-blocking reader with nothing ready
+        if got == 0:
+            self.size = offset
+            return memoryview(b'')
+        self.offset += got
+        return memoryview(buf)[:got]
+
+
+class RepeatSource:
+    """The same pattern over and over, with no end."""
+
+    def __init__(self, pattern: bytes, block: int = 64 * 1024):
+        self.pattern = len(pattern)
+        self.view = memoryview(pattern * (block // len(pattern) + 2))
+        self.size = None
+
+    def chunk(self, offset: int, n: int) -> memoryview:
+        start = offset % self.pattern
+        n = min(n, len(self.view) - start)
+        return self.view[start:start + n]
+
+
+def open_source(source):
+    """
+    Wrap whatever we are given as a source: a path, an open file, a
+    file-like object, or a buffer.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            # The mapping keeps its own reference to the file
+            return MappedSource(f.fileno())
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        return BufferSource(source)
+    if hasattr(source, 'chunk'):
+        return source
+    try:
+        fileno = source.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        fileno = None
+    if fileno is not None and stat.S_ISREG(os.fstat(fileno).st_mode):
+        # The whole file, whatever the current position
+        return MappedSource(fileno)
+    return ReaderSource(source)
+
+
+class Transfer:
+    """
+    Progress of one bulk transfer. The sender takes chunks with
+    next_chunk() and calls on_acked() as ACKs come back; on_progress(acked, total)
+    and on_throughput(bytes_per_sec) fire at most once per interval (and
+    once more when the transfer completes). Throughput counts
+    acknowledged bytes, so it is goodput as the receiver saw it.
+    """
+
+    def __init__(self, source, on_progress=None, on_throughput=None, interval: float = REPORT_INTERVAL):
+        self.source = source
+        self.on_progress = on_progress
+        self.on_throughput = on_throughput
+        self.interval = interval
+        self.offset = 0
+        self.acked = 0
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.last_acked = 0
+
+    @property
+    def total(self):
+        """Size in bytes, or None while it is not known yet."""
+        return self.source.size
+
+    @property
+    def exhausted(self) -> bool:
+        """Every byte has been handed out."""
+        return self.total is not None and self.offset >= self.total
+
+    @property
+    def done(self) -> bool:
+        """Every byte has been acknowledged."""
+        return self.total is not None and self.acked >= self.total
+
+    def next_chunk(self, n: int):
+        """Up to n bytes at the send offset: (offset, data, fin)."""
+        offset = self.offset
+        data = self.source.chunk(offset, n)
+        self.offset += len(data)
+        return offset, data, self.exhausted
+
+    def on_acked(self, n: int):
+        self.acked += n
+        if self.done:
+            self.report()
+        else:
+            self.poll()
+
+    def poll(self, now: float = None):
+        if now is None:
+            now = time.monotonic()
+        if now - self.last_report >= self.interval:
+            self.report(now)
+
+    def report(self, now: float = None):
+        if now is None:
+            now = time.monotonic()
+        elapsed = now - self.last_report
+        if self.on_progress:
+            self.on_progress(self.acked, self.total)
+        if self.on_throughput and elapsed > 0:
+            self.on_throughput((self.acked - self.last_acked) / elapsed)
+        self.last_report = now
+        self.last_acked = self.acked
+
+    def average_throughput(self, now: float = None) -> float:
+        elapsed = (now if now is not None else time.monotonic()) - self.started
+        return self.acked / elapsed if elapsed > 0 else 0.0
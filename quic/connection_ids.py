@@ -0,0 +1,165 @@
+"""
+Connection ID management (RFC 9000, Sections 5.1, 8.2, 9 and 10.3).
+
+The server routes every packet by the 8-byte connection ID after the
+type byte. ConnectionIDManager keeps:
+
+- routes: every active CID -> its connection, so lookup is one dict get
+  whichever CID the client uses.
+- an LRU of connections by last activity, so idle ones are evicted from
+  the front in O(1) each and memory stays bounded.
+
+Each connection starts with the client's CID (sequence 0). The server
+then hands out more with NEW_CONNECTION_ID frames; a client that moves to
+a new network switches to a fresh CID so observers can't link its old and
+new paths. When the client retires a CID (RETIRE_CONNECTION_ID), the
+server issues a replacement.
+
+Path validation: a packet from a new address doesn't move the connection
+there. The server sends a PATH_CHALLENGE to the new address and only
+switches once the matching PATH_RESPONSE comes back, so a spoofed source
+address can't redirect traffic at a victim.
+
+Stateless reset: every issued CID comes with a reset token,
+HMAC(reset_key, cid). If a packet arrives for a CID the server has
+forgotten (evicted, restarted), it answers with a packet that ends in
+that token. The client recognises the token and drops the connection
+instead of waiting for a timeout.
+"""
+
+import hashlib
+import hmac
+import os
+import time
+from collections import OrderedDict
+
+import frames
+
+PACKET_DATA = 0x01
+
+CONNECTION_ID_LENGTH = 8
+ACTIVE_CID_LIMIT = 4
+IDLE_TIMEOUT = 30.0
+MIN_STATELESS_RESET = 1 + CONNECTION_ID_LENGTH + 4 + 1 + frames.RESET_TOKEN_LENGTH
+MAX_STATELESS_RESET = 64
+
+
+class ConnectionIDManager:
+    """CID -> connection routing, CID issuance, idle eviction, path validation."""
+
+    def __init__(self, reset_key: bytes, idle_timeout: float = IDLE_TIMEOUT,
+                 active_limit: int = ACTIVE_CID_LIMIT, worker_index: int = 0, workers: int = 1):
+        self.reset_key = reset_key
+        self.idle_timeout = idle_timeout
+        self.active_limit = active_limit
+        # Issued CIDs satisfy cid[0] % workers == worker_index (see workers.py)
+        self.worker_index = worker_index
+        self.workers = workers
+        self.routes = {}
+        self.connections = OrderedDict()
+
+    def __len__(self):
+        return len(self.connections)
+
+    def lookup(self, cid: bytes):
+        return self.routes.get(cid)
+
+    def add(self, conn_id: bytes, conn: dict):
+        """Register a new connection under the client's CID (sequence 0)."""
+        old = self.connections.get(conn_id)
+        if old is not None:
+            self.remove(old)
+
+        conn['conn_id'] = conn_id
+        conn['cids'] = {0: conn_id}
+        conn['next_cid_sequence'] = 1
+        conn['path_challenges'] = {}
+        conn['last_active'] = time.monotonic()
+        self.routes[conn_id] = conn
+        self.connections[conn_id] = conn
+
+    def remove(self, conn: dict):
+        for cid in conn['cids'].values():
+            self.routes.pop(cid, None)
+        self.connections.pop(conn['conn_id'], None)
+
+    def touch(self, conn: dict):
+        conn['last_active'] = time.monotonic()
+        self.connections.move_to_end(conn['conn_id'])
+
+    def evict_idle(self, now: float = None):
+        """Drop connections idle longer than idle_timeout, return them."""
+        if now is None:
+            now = time.monotonic()
+        evicted = []
+        while self.connections:
+            conn = next(iter(self.connections.values()))
+            if now - conn['last_active'] < self.idle_timeout:
+                break
+            self.remove(conn)
+            evicted.append(conn)
+        return evicted
+
+    # --- Issuing and retiring CIDs ------------------------------------------
+
+    def reset_token(self, cid: bytes) -> bytes:
+        return hmac.new(self.reset_key, cid, hashlib.sha256).digest()[:frames.RESET_TOKEN_LENGTH]
+
+    def issue(self, conn: dict) -> bytes:
+        """NEW_CONNECTION_ID frames topping the connection up to active_limit CIDs."""
+        new_frames = b''
+        while len(conn['cids']) < self.active_limit:
+            cid = os.urandom(CONNECTION_ID_LENGTH)
+            first = cid[0] - cid[0] % self.workers + self.worker_index
+            if first > 0xFF:
+                continue
+            cid = bytes([first]) + cid[1:]
+            if cid in self.routes:
+                continue
+            sequence = conn['next_cid_sequence']
+            conn['next_cid_sequence'] += 1
+            conn['cids'][sequence] = cid
+            self.routes[cid] = conn
+            new_frames += frames.encode_new_connection_id(sequence, 0, cid, self.reset_token(cid))
+        return new_frames
+
+    def retire(self, conn: dict, sequence: int) -> bytes:
+        """Handle RETIRE_CONNECTION_ID, return frames issuing a replacement."""
+        cid = conn['cids'].pop(sequence, None)
+        if cid is None:
+            return b''
+        self.routes.pop(cid, None)
+        return self.issue(conn)
+
+    # --- Path validation ----------------------------------------------------
+
+    def challenge_path(self, conn: dict, addr):
+        """PATH_CHALLENGE frame for a new address, or None if already validated or pending."""
+        if addr == conn['last_addr'] or addr in conn['path_challenges'].values():
+            return None
+        data = os.urandom(frames.PATH_DATA_LENGTH)
+        conn['path_challenges'][data] = addr
+        return frames.encode_path_challenge(data)
+
+    def on_path_response(self, conn: dict, data: bytes, addr) -> bool:
+        """Switch to addr if it answered our challenge. True if the path changed."""
+        if conn['path_challenges'].get(data) != addr:
+            return False
+        conn['path_challenges'].clear()
+        conn['last_addr'] = addr
+        return True
+
+    # --- Stateless reset ----------------------------------------------------
+
+    def stateless_reset(self, cid: bytes, trigger_length: int):
+        """
+        Reset packet for an unknown CID, or None if the trigger is too small.
+        Always shorter than the packet that triggered it, so two endpoints
+        that have both lost state can't reset each other forever.
+        """
+        length = min(trigger_length - 1, MAX_STATELESS_RESET)
+        if length < MIN_STATELESS_RESET:
+            return None
+        # Looks like any other DATA packet until the last 16 bytes
+        filler = os.urandom(length - 1 - frames.RESET_TOKEN_LENGTH)
+        return bytes([PACKET_DATA]) + filler + self.reset_token(cid)
@@ -1,6 +1,11 @@
 import os
-from hashlib import sha256
+import struct
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF, HKDFExpand
 
 # Diffie-Hellman parameters (2048-bit MODP group from RFC 3526)
 P = 0xFFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F14374FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7EDEE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF0598DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3BE39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF6955817183995497CEA956AE515D2261898FA051015728E5A8AACAA68FFFFFFFFFFFFFFFF
@@ -19,20 +24,312 @@ def compute_shared_secret(their_public, my_private):
     return pow(their_public, my_private, P)
 
 
-def derive_aes_key(shared_secret):
-    secret_bytes = shared_secret.to_bytes(256, 'big')
-    return sha256(secret_bytes).digest()
+# =============================================================================
+# KEY EXCHANGE GROUPS
+# =============================================================================
+#
+# INIT, ACCEPT and 0-RTT packets carry a key share: [group 1B][public key].
+# The client picks the group, the server answers in the same one.
+#
+#   MODP 2048: pow() on 2048-bit integers, ~ms per operation, 256-byte keys
+#   X25519:    elliptic curve, ~50x cheaper, 32-byte keys
 
+KEX_MODP2048 = 0x00
+KEX_X25519 = 0x1d
 
-def encrypt(key, plaintext):
-    nonce = os.urandom(12)
-    aesgcm = AESGCM(key)
-    ciphertext = aesgcm.encrypt(nonce, plaintext, None)
-    return nonce + ciphertext
+PUBLIC_KEY_LENGTH = {KEX_MODP2048: 256, KEX_X25519: 32}
 
 
-def decrypt(key, nonce_and_ciphertext):
-    nonce = nonce_and_ciphertext[:12]
-    ciphertext = nonce_and_ciphertext[12:]
-    aesgcm = AESGCM(key)
-    return aesgcm.decrypt(nonce, ciphertext, None)
+def generate_keypair(group):
+    """Return (private, public_bytes) for a key exchange group."""
+    if group == KEX_X25519:
+        private = X25519PrivateKey.generate()
+        return private, private.public_key().public_bytes_raw()
+    private = generate_private_key()
+    return private, compute_public_key(private).to_bytes(256, 'big')
+
+
+def public_key_bytes(group, private):
+    if group == KEX_X25519:
+        return private.public_key().public_bytes_raw()
+    return compute_public_key(private).to_bytes(256, 'big')
+
+
+def key_agreement(group, my_private, their_public):
+    """Shared secret (bytes) from our private key and the peer's public key bytes."""
+    if group == KEX_X25519:
+        return my_private.exchange(X25519PublicKey.from_public_bytes(their_public))
+    shared = compute_shared_secret(int.from_bytes(their_public, 'big'), my_private)
+    return shared.to_bytes(256, 'big')
+
+
+def private_key_to_bytes(group, private):
+    if group == KEX_X25519:
+        return private.private_bytes_raw()
+    return private.to_bytes(32, 'big')
+
+
+def private_key_from_bytes(group, data):
+    if group == KEX_X25519:
+        return X25519PrivateKey.from_private_bytes(data)
+    return int.from_bytes(data, 'big')
+
+
+def encode_key_share(group, public):
+    return bytes([group]) + public
+
+
+def decode_key_share(data):
+    """Parse [group][public key], return (group, public, bytes_consumed)."""
+    if len(data) < 1 or data[0] not in PUBLIC_KEY_LENGTH:
+        raise ValueError("Unknown key exchange group")
+    group = data[0]
+    length = PUBLIC_KEY_LENGTH[group]
+    if len(data) < 1 + length:
+        raise ValueError("Truncated key share")
+    return group, bytes(data[1:1 + length]), 1 + length
+
+
+SERVER_RANDOM_LENGTH = 16
+
+
+def encode_server_share(group, public, server_random):
+    """ACCEPT body: the server's key share, then its per-handshake random."""
+    return encode_key_share(group, public) + server_random
+
+
+def decode_server_share(data):
+    """Parse an ACCEPT body, return (group, public, server_random)."""
+    group, public, consumed = decode_key_share(data)
+    if len(data) < consumed + SERVER_RANDOM_LENGTH:
+        raise ValueError("Truncated server random")
+    return group, public, bytes(data[consumed:consumed + SERVER_RANDOM_LENGTH])
+
+
+def handshake_secret(shared_secret, server_random):
+    """
+    The secret a connection's keys come from. The server's share is
+    static, so a replayed or retransmitted INIT with the same client
+    share yields the same key agreement output; the fresh server random
+    makes every handshake's keys, and so every (key, nonce) pair, new.
+    """
+    return shared_secret + server_random
+
+
+PN_LENGTH = 4
+TAG_LENGTH = 16
+HP_SAMPLE_LENGTH = 16
+
+# The top bit of the packet number field is the key phase, the other 31 the packet number
+KEY_PHASE_BIT = 1 << (PN_LENGTH * 8 - 1)
+PN_BITS = PN_LENGTH * 8 - 1
+
+# The packet number field, and the PN_LENGTH mask bytes after the first of an AES-ECB block
+PN_FIELD = struct.Struct('>I')
+HP_MASK = struct.Struct('>xI')
+
+# Well inside the AES-GCM confidentiality limit of 2^23 packets per key (RFC 9001, Section 6.6)
+KEY_UPDATE_PACKETS = 1 << 22
+
+
+def decode_packet_number(largest_pn, truncated_pn, pn_nbits=PN_BITS):
+    """Recover a full packet number from its low bits (RFC 9000, Appendix A.3)."""
+    expected_pn = largest_pn + 1
+    pn_win = 1 << pn_nbits
+    pn_hwin = pn_win // 2
+    pn_mask = pn_win - 1
+
+    candidate_pn = (expected_pn & ~pn_mask) | truncated_pn
+    if candidate_pn <= expected_pn - pn_hwin and candidate_pn < (1 << 62) - pn_win:
+        return candidate_pn + pn_win
+    if candidate_pn > expected_pn + pn_hwin and candidate_pn >= pn_win:
+        return candidate_pn - pn_win
+    return candidate_pn
+
+
+class KeyGeneration:
+    """AEAD key and IV for one key phase, and the secret the next phase comes from."""
+
+    def __init__(self, secret, generation=0):
+        self.secret = secret
+        self.generation = generation
+        self.aead = AESGCM(hkdf_expand(secret, b'quic key', 32))
+        self.iv = int.from_bytes(hkdf_expand(secret, b'quic iv', 12), 'big')
+
+    def next(self):
+        return KeyGeneration(hkdf_expand(self.secret, b'quic ku', 32), self.generation + 1)
+
+    def nonce(self, pn):
+        return (self.iv ^ pn).to_bytes(12, 'big')
+
+
+class PacketProtection:
+    """
+    AEAD and header protection for one direction of a connection (RFC 9001,
+    Sections 5 and 6).
+
+    Everything comes from one traffic secret. The AESGCM context is built
+    once per key phase. Each packet's nonce is the IV XORed with its packet
+    number, so nonces are never sent: the packet carries only the low
+    PN_BITS bits of the packet number, and the receiver reconstructs the
+    rest from the largest number it has seen.
+
+    Packet layout: [prefix][packet number][ciphertext + tag]. The prefix
+    (type, conn_id, ...) and packet number are authenticated as associated
+    data. Header protection then XORs the packet number field with AES-ECB
+    of the first HP_SAMPLE_LENGTH bytes of ciphertext, hiding the packet
+    number and key phase from observers.
+
+    Key update: after KEY_UPDATE_PACKETS packets the sender moves to the
+    next key phase (new key and IV from HKDF of the current secret; the
+    header protection key stays) and flips the key phase bit. The next
+    generation is always derived in advance, so a phase change only swaps
+    objects. The receiver notices the flipped bit, opens the packet with
+    the next keys and moves to that phase too, and its `partner` (our own
+    send direction) follows, one phase per packet it sends. The previous
+    generation is kept for packets that were reordered across the change.
+    """
+
+    def __init__(self, secret):
+        hp_key = hkdf_expand(secret, b'quic hp', 32)
+        self.hp = Cipher(algorithms.AES(hp_key), modes.ECB()).encryptor()
+        self.current = KeyGeneration(secret)
+        self.next = self.current.next()
+        self.previous = None
+        self.phase_start_pn = 0
+        self.next_pn = 0
+        self.largest_pn = -1
+        self.sent_in_phase = True
+        self.partner = None
+
+    @property
+    def generation(self):
+        return self.current.generation
+
+    def update_key(self, first_pn=None):
+        """
+        Move to the next key phase. first_pn is the first packet number of
+        the new phase (default: the next one we send). The generation after
+        it is derived here, once per update, never per packet.
+        """
+        self.previous, self.current = self.current, self.next
+        self.next = self.current.next()
+        self.phase_start_pn = self.next_pn if first_pn is None else first_pn
+        self.sent_in_phase = False
+
+    def _header_mask(self, sample):
+        # One ECB block through the encryptor made in __init__: no per-packet setup
+        return HP_MASK.unpack_from(self.hp.update(sample))[0]
+
+    def _next_packet(self):
+        if self.next_pn - self.phase_start_pn >= KEY_UPDATE_PACKETS:
+            self.update_key()
+        pn = self.next_pn
+        self.next_pn += 1
+        self.sent_in_phase = True
+        field = pn & (KEY_PHASE_BIT - 1)
+        if self.current.generation & 1:
+            field |= KEY_PHASE_BIT
+        return pn, field
+
+    def seal(self, prefix, plaintext):
+        """Build a protected packet: prefix + packet number + ciphertext."""
+        pn, field = self._next_packet()
+        keys = self.current
+        ciphertext = keys.aead.encrypt(keys.nonce(pn), plaintext, prefix + PN_FIELD.pack(field))
+        field ^= self._header_mask(ciphertext[:HP_SAMPLE_LENGTH])
+        return prefix + PN_FIELD.pack(field) + ciphertext
+
+    def seal_into(self, buf, prefix, plaintext):
+        """
+        Like seal, but write the packet into buf and return its length.
+        Pass a memoryview of a reusable buffer to avoid allocating anything.
+        """
+        if not isinstance(buf, memoryview):
+            buf = memoryview(buf)
+        pn, field = self._next_packet()
+        keys = self.current
+        header = prefix + PN_FIELD.pack(field)
+        header_len = len(header)
+        total = header_len + len(plaintext) + TAG_LENGTH
+
+        buf[:header_len] = header
+        keys.aead.encrypt_into(keys.nonce(pn), plaintext, header, buf[header_len:total])
+        # Mask the packet number in place: no header copy to rebuild
+        field ^= self._header_mask(buf[header_len:header_len + HP_SAMPLE_LENGTH])
+        PN_FIELD.pack_into(buf, len(prefix), field)
+        return total
+
+    def open(self, packet, prefix_length):
+        """Verify and decrypt a packet. Raises InvalidTag if it was tampered with."""
+        header_len = prefix_length + PN_LENGTH
+        if len(packet) < header_len + HP_SAMPLE_LENGTH:
+            raise InvalidTag()
+        field = PN_FIELD.unpack_from(packet, prefix_length)[0]
+        field ^= self._header_mask(packet[header_len:header_len + HP_SAMPLE_LENGTH])
+        pn = decode_packet_number(self.largest_pn, field & (KEY_PHASE_BIT - 1))
+
+        phase = 1 if field & KEY_PHASE_BIT else 0
+        if phase == self.current.generation & 1:
+            keys = self.current
+        elif pn < self.phase_start_pn:
+            keys = self.previous  # sent before the last update, arrived after it
+        else:
+            keys = self.next  # the peer has moved to the next phase
+        if keys is None:
+            raise InvalidTag()
+
+        header = bytes(packet[:prefix_length]) + PN_FIELD.pack(field)
+        plaintext = keys.aead.decrypt(keys.nonce(pn), packet[header_len:], header)
+
+        # Only an authenticated packet may move us to a new phase
+        if keys is self.next:
+            self.update_key(pn)
+        # Our send side follows the peer's updates. The peer can only follow
+        # one phase at a time, so it never moves twice without sending
+        partner = self.partner
+        if partner is not None and partner.generation < self.generation and partner.sent_in_phase:
+            partner.update_key()
+        if pn > self.largest_pn:
+            self.largest_pn = pn
+        return plaintext
+
+
+HKDF_SALT = b'quic-from-scratch v1'
+
+
+def hkdf_extract(input_key_material):
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=HKDF_SALT, info=b'').derive(input_key_material)
+
+
+def hkdf_expand(secret, label, length):
+    return HKDFExpand(algorithm=hashes.SHA256(), length=length, info=label).derive(secret)
+
+
+def derive_packet_protection(shared_secret, is_client):
+    """
+    Return (send, receive) PacketProtection for one side of a connection.
+
+    HKDF-Extract turns the raw key agreement output into a uniform secret,
+    then HKDF-Expand derives a client and a server traffic secret. Each
+    direction's key, IV and header protection key come from its own
+    traffic secret, so packet number 0 from the client and packet number
+    0 from the server never share a nonce, and each direction can move
+    through key updates without another key agreement.
+    """
+    secret = hkdf_extract(shared_secret)
+    client = PacketProtection(hkdf_expand(secret, b'client traffic', 32))
+    server = PacketProtection(hkdf_expand(secret, b'server traffic', 32))
+    send, receive = (client, server) if is_client else (server, client)
+    # A key update from the peer is answered by updating our own send keys
+    receive.partner = send
+    return send, receive
+
+
+def derive_resumption_secret(shared_secret):
+    """
+    Secret a session ticket carries. A resumed connection uses
+    resumption_secret + client_random as its shared secret, so it needs
+    no key agreement, and it derives a new resumption secret the same way.
+    """
+    return hkdf_expand(hkdf_extract(shared_secret), b'resumption', 32)
@@ -0,0 +1,402 @@
+"""
+Asyncio QUIC endpoint - many client connections on one UDP socket.
+
+QUICClient polls a non-blocking socket, so callers spin waiting for data.
+Here the event loop wakes us only when a datagram arrives or a timer
+fires, so idle connections cost nothing:
+
+- ACK timer: acknowledgements are delayed up to MAX_ACK_DELAY and
+  coalesced (one packet acks everything received in the meantime).
+- PTO timer: unacknowledged STREAM frames are resent after a probe
+  timeout (RFC 9002), backing off exponentially.
+- Idle timer: connections that hear nothing for IDLE_TIMEOUT are closed.
+
+Usage:
+    endpoint = await QUICEndpoint.create()
+    conn = await endpoint.connect('192.168.100.2', 9000)
+    stream_id = await conn.open_stream()
+    conn.set_priority(stream_id, urgency=1)       # optional, RFC 9218
+    await conn.write(stream_id, request, fin=True)
+    response = await conn.read(stream_id)
+"""
+
+import asyncio
+import os
+import socket
+import time
+
+import crypto
+import frames
+import streams
+
+# Packet types
+PACKET_DATA = 0x01
+PACKET_INIT = 0x03
+PACKET_ACCEPT = 0x04
+
+MAX_STREAM_PAYLOAD = 1200
+MAX_ACK_DELAY = 0.025
+ACK_ELICITING_THRESHOLD = 2
+IDLE_TIMEOUT = 30.0
+MAX_PTO_COUNT = 8
+GRANULARITY = 0.001
+SOCKET_BUFFER = 4 * 1024 * 1024
+
+
+class QUICConnection:
+    """One client connection, driven entirely by the endpoint's event loop."""
+
+    def __init__(self, endpoint, addr, conn_id: bytes, group: int = crypto.KEX_X25519):
+        self.endpoint = endpoint
+        self.loop = endpoint.loop
+        self.addr = addr
+        self.conn_id = conn_id
+        self.group = group
+        self.send_keys = None
+        self.recv_keys = None
+        self.error = None
+        self._private_key = None
+        self._init_packet = None
+
+        self.recv_streams = streams.ReceiveStreams()
+        self.send_streams = streams.SendStreams()
+        self.next_stream_id = 0
+
+        self.established = self.loop.create_future()
+        self.readable = {}
+        self.credit_available = asyncio.Event()
+
+        # Loss recovery: (stream_id, offset) -> (send_time, frame)
+        self.sent_frames = {}
+        self.smoothed_rtt = streams.INITIAL_RTT
+        self.rttvar = streams.INITIAL_RTT / 2
+        self.min_rtt = None
+        self.pto_count = 0
+        self.pto_timer = None
+
+        self.pending_acks = []
+        self.ack_timer = None
+
+        self.last_activity = time.monotonic()
+        self.idle_timer = self.loop.call_later(IDLE_TIMEOUT, self._on_idle_timer)
+
+    # --- Handshake -----------------------------------------------------------
+
+    async def handshake(self):
+        self._private_key, public_key = crypto.generate_keypair(self.group)
+        self._init_packet = bytes([PACKET_INIT]) + self.conn_id + crypto.encode_key_share(self.group, public_key)
+
+        self._send_packet(self._init_packet)
+        self._arm_pto()
+        await self.established
+
+    def _on_accept(self, packet: bytes):
+        if self.established.done():
+            return
+        try:
+            group, server_public, server_random = crypto.decode_server_share(packet[9:])
+        except ValueError:
+            return
+        if group != self.group:
+            return
+        shared_secret = crypto.handshake_secret(
+            crypto.key_agreement(group, self._private_key, server_public), server_random)
+        self.send_keys, self.recv_keys = crypto.derive_packet_protection(shared_secret, is_client=True)
+        self._private_key = None
+        self._init_packet = None
+
+        self.pto_count = 0
+        self._arm_pto()
+        self.established.set_result(True)
+
+    # --- Application API -----------------------------------------------------
+
+    async def open_stream(self) -> int:
+        """Allocate the next client-initiated bidirectional stream (0, 4, 8, ...)."""
+        await self.established
+        stream_id = self.next_stream_id
+        self.next_stream_id += 4
+        return stream_id
+
+    async def write(self, stream_id: int, data: bytes, fin: bool = False):
+        """Queue data on a stream and wait until flow control lets it all out."""
+        await self.established
+        self.send_streams.write(stream_id, data, fin)
+        self._flush()
+
+        stream = self.send_streams.get(stream_id)
+        while stream.has_data:
+            self._check_error()
+            self.credit_available.clear()
+            await self.credit_available.wait()
+            self._flush()
+        self._check_error()
+
+    def set_priority(self, stream_id: int, urgency: int, incremental: bool = False, weight: int = 1):
+        """RFC 9218 priority for a stream's outgoing data (urgency 0-7, lower first)."""
+        self.send_streams.set_priority(stream_id, urgency, incremental, weight)
+
+    async def read(self, stream_id: int, n: int = -1) -> bytes:
+        """Like StreamReader.read: n=-1 reads to end of stream, else up to n bytes."""
+        if n < 0:
+            chunks = []
+            while True:
+                chunk = await self.read(stream_id, streams.MAX_STREAM_WINDOW)
+                if not chunk:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+
+        stream = self.recv_streams.get(stream_id)
+        event = self.readable.setdefault(stream_id, asyncio.Event())
+        while not stream.readable and not stream.at_eof:
+            self._check_error()
+            event.clear()
+            await event.wait()
+
+        data = self.recv_streams.read(stream_id, n)
+
+        # Reading frees buffer space: tell the peer right away if a window slid
+        updates = self.recv_streams.pending_updates(time.monotonic())
+        if updates:
+            self._send_frames(self._take_acks() + updates)
+        return data
+
+    def close(self, error: Exception = None):
+        if self.error is not None:
+            return
+        if error is None and self.send_keys and self.pending_acks:
+            # Or the peer keeps resending what we already have
+            self._send_frames(self._take_acks())
+        self.error = error or ConnectionError("connection closed")
+
+        for timer in (self.ack_timer, self.pto_timer, self.idle_timer):
+            if timer:
+                timer.cancel()
+        if not self.established.done():
+            self.established.set_exception(self.error)
+        for event in self.readable.values():
+            event.set()
+        self.credit_available.set()
+        self.endpoint.connections.pop(self.conn_id, None)
+
+    def _check_error(self):
+        if self.error is not None:
+            raise self.error
+
+    # --- Sending -------------------------------------------------------------
+
+    def _send_packet(self, packet: bytes):
+        self.endpoint.transport.sendto(packet, self.addr)
+
+    def _send_frames(self, payload: bytes):
+        self._send_packet(self.send_keys.seal(bytes([PACKET_DATA]) + self.conn_id, payload))
+
+    def _flush(self):
+        """Send queued data on every stream, packets filled in priority order."""
+        while True:
+            chunks = self.send_streams.next_packet(MAX_STREAM_PAYLOAD)
+            if not chunks:
+                break
+            now = time.monotonic()
+            payload = b''
+            for stream_id, offset, data, fin in chunks:
+                frame = frames.encode_stream(stream_id, offset, data, fin)
+                self.sent_frames[(stream_id, offset)] = (now, frame)
+                payload += frame
+            # Piggyback any pending ACKs on outgoing data
+            self._send_frames(self._take_acks() + payload)
+        self._arm_pto()
+
+    # --- Receiving -----------------------------------------------------------
+
+    def datagram_received(self, packet: bytes, addr):
+        self.last_activity = time.monotonic()
+        packet_type = packet[0]
+
+        if packet_type == PACKET_ACCEPT:
+            self._on_accept(packet)
+            return
+        if packet_type != PACKET_DATA or self.recv_keys is None:
+            return
+
+        try:
+            decrypted = self.recv_keys.open(packet, 9)
+        except Exception:
+            return
+
+        ack_eliciting = False
+        credit_changed = False
+        pos = 0
+        while pos < len(decrypted):
+            frame_type, frame_data, consumed = frames.decode_frame(decrypted[pos:])
+            if frame_type is None:
+                break
+            pos += consumed
+
+            if frame_type == frames.FRAME_STREAM:
+                stream_id, offset, data, fin = frame_data
+                try:
+                    stream = self.recv_streams.on_stream_frame(stream_id, offset, data, fin)
+                except streams.FlowControlError as e:
+                    self.close(e)
+                    return
+                if stream is None:
+                    continue
+                self.pending_acks.append(frames.encode_ack(stream_id, offset))
+                ack_eliciting = True
+                event = self.readable.get(stream_id)
+                if event:
+                    event.set()
+
+            elif frame_type == frames.FRAME_ACK:
+                self._on_ack(*frame_data)
+
+            elif frame_type == frames.FRAME_PATH_CHALLENGE:
+                self._send_frames(frames.encode_path_response(frame_data))
+
+            elif frame_type in (frames.FRAME_DATA_BLOCKED, frames.FRAME_STREAM_DATA_BLOCKED):
+                limits = self.recv_streams.on_blocked(frame_type, frame_data)
+                if limits:
+                    self._send_frames(limits)
+
+            elif self.send_streams.on_frame(frame_type, frame_data):
+                ack_eliciting = True
+                credit_changed = True
+
+        if credit_changed:
+            self.credit_available.set()
+        if ack_eliciting:
+            self._schedule_ack()
+
+    def _on_ack(self, stream_id: int, offset: int):
+        entry = self.sent_frames.pop((stream_id, offset), None)
+        if entry is None:
+            return
+
+        rtt = time.monotonic() - entry[0]
+        if self.min_rtt is None:
+            self.min_rtt = rtt
+            self.smoothed_rtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.min_rtt = min(self.min_rtt, rtt)
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.smoothed_rtt - rtt)
+            self.smoothed_rtt = 0.875 * self.smoothed_rtt + 0.125 * rtt
+        self.recv_streams.rtt = self.smoothed_rtt
+
+        self.pto_count = 0
+        self._arm_pto()
+
+    # --- Timers --------------------------------------------------------------
+
+    def _take_acks(self) -> bytes:
+        if self.ack_timer:
+            self.ack_timer.cancel()
+            self.ack_timer = None
+        acks = b''.join(self.pending_acks)
+        self.pending_acks.clear()
+        return acks + self.recv_streams.pending_updates(time.monotonic())
+
+    def _schedule_ack(self):
+        if len(self.pending_acks) >= ACK_ELICITING_THRESHOLD:
+            self._send_acks()
+        elif self.ack_timer is None:
+            self.ack_timer = self.loop.call_later(MAX_ACK_DELAY, self._send_acks)
+
+    def _send_acks(self):
+        self.ack_timer = None
+        payload = self._take_acks()
+        if payload and self.error is None:
+            self._send_frames(payload)
+
+    def _pto(self) -> float:
+        pto = self.smoothed_rtt + max(4 * self.rttvar, GRANULARITY) + MAX_ACK_DELAY
+        return pto * (2 ** self.pto_count)
+
+    def _arm_pto(self):
+        if self.pto_timer:
+            self.pto_timer.cancel()
+            self.pto_timer = None
+        if self.error is None and (self.sent_frames or self._init_packet or
+                                   self.send_streams.blocked_frames()):
+            self.pto_timer = self.loop.call_later(self._pto(), self._on_pto)
+
+    def _on_pto(self):
+        self.pto_timer = None
+        if not self.sent_frames and not self._init_packet:
+            # Only waiting on credit: the peer's window update may be lost,
+            # so say we're blocked. A slow reader is no reason to give up.
+            self._send_frames(self.send_streams.blocked_frames())
+            self._arm_pto()
+            return
+
+        self.pto_count += 1
+        if self.pto_count > MAX_PTO_COUNT:
+            self.close(TimeoutError("peer stopped acknowledging"))
+            return
+
+        if self._init_packet:
+            self._send_packet(self._init_packet)
+        else:
+            # Probe with the two oldest unacknowledged frames
+            for key in list(self.sent_frames)[:2]:
+                _, frame = self.sent_frames[key]
+                self._send_frames(frame)
+                self.sent_frames[key] = (time.monotonic(), frame)
+        self._arm_pto()
+
+    def _on_idle_timer(self):
+        remaining = self.last_activity + IDLE_TIMEOUT - time.monotonic()
+        if remaining > 0:
+            self.idle_timer = self.loop.call_later(remaining, self._on_idle_timer)
+        else:
+            self.idle_timer = None
+            self.close(TimeoutError("idle timeout"))
+
+
+class QUICEndpoint(asyncio.DatagramProtocol):
+    """One UDP socket shared by any number of QUIC client connections."""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.transport = None
+        self.connections = {}
+
+    @classmethod
+    async def create(cls, local_addr=('0.0.0.0', 0)):
+        loop = asyncio.get_running_loop()
+        _, endpoint = await loop.create_datagram_endpoint(cls, local_addr=local_addr)
+        return endpoint
+
+    def connection_made(self, transport):
+        self.transport = transport
+        # Room for a full receive window of datagrams between loop wakeups
+        sock = transport.get_extra_info('socket')
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+        except OSError:
+            pass
+
+    def datagram_received(self, data, addr):
+        if len(data) < 9:
+            return
+        conn = self.connections.get(data[1:9])
+        if conn:
+            conn.datagram_received(data, addr)
+
+    def error_received(self, exc):
+        # ICMP errors (e.g. port unreachable) - let PTO/idle timers decide
+        pass
+
+    async def connect(self, host: str, port: int, group: int = crypto.KEX_X25519) -> QUICConnection:
+        conn = QUICConnection(self, (host, port), os.urandom(8), group)
+        self.connections[conn.conn_id] = conn
+        await conn.handshake()
+        return conn
+
+    def close(self):
+        for conn in list(self.connections.values()):
+            conn.close()
+        if self.transport:
+            self.transport.close()
+            self.transport = None
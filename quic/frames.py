@@ -2,11 +2,26 @@ import varint
 
 FRAME_STREAM = 0x08
 FRAME_ACK = 0x02
+FRAME_MAX_DATA = 0x10
+FRAME_MAX_STREAM_DATA = 0x11
+FRAME_DATA_BLOCKED = 0x14
+FRAME_STREAM_DATA_BLOCKED = 0x15
+FRAME_NEW_SESSION_TICKET = 0x07
+FRAME_NEW_CONNECTION_ID = 0x18
+FRAME_RETIRE_CONNECTION_ID = 0x19
+FRAME_PATH_CHALLENGE = 0x1a
+FRAME_PATH_RESPONSE = 0x1b
 
+RESET_TOKEN_LENGTH = 16
+PATH_DATA_LENGTH = 8
 
-def encode_stream(stream_id, offset, data):
+# Low bit of the STREAM frame type marks the final frame of a stream
+STREAM_FIN = 0x01
+
+
+def encode_stream(stream_id, offset, data, fin=False):
     return (
-        varint.encode(FRAME_STREAM) +
+        varint.encode(FRAME_STREAM | (STREAM_FIN if fin else 0)) +
         varint.encode(stream_id) +
         varint.encode(offset) +
         varint.encode(len(data)) +
@@ -14,6 +29,20 @@ def encode_stream(stream_id, offset, data):
     )
 
 
+def encode_stream_into(buf, stream_id, offset, data, fin=False):
+    """Like encode_stream, but write the frame into buf and return its length."""
+    header = (
+        varint.encode(FRAME_STREAM | (STREAM_FIN if fin else 0)) +
+        varint.encode(stream_id) +
+        varint.encode(offset) +
+        varint.encode(len(data))
+    )
+    end = len(header) + len(data)
+    buf[:len(header)] = header
+    buf[len(header):end] = data
+    return end
+
+
 def decode_stream(data):
     pos = 0
 
@@ -52,6 +81,82 @@ def decode_ack(data):
     return stream_id, largest_acked, pos
 
 
+def encode_max_data(maximum):
+    return varint.encode(FRAME_MAX_DATA) + varint.encode(maximum)
+
+
+def encode_max_stream_data(stream_id, maximum):
+    return (
+        varint.encode(FRAME_MAX_STREAM_DATA) +
+        varint.encode(stream_id) +
+        varint.encode(maximum)
+    )
+
+
+def encode_data_blocked(limit):
+    return varint.encode(FRAME_DATA_BLOCKED) + varint.encode(limit)
+
+
+def encode_stream_data_blocked(stream_id, limit):
+    return (
+        varint.encode(FRAME_STREAM_DATA_BLOCKED) +
+        varint.encode(stream_id) +
+        varint.encode(limit)
+    )
+
+
+def encode_new_session_ticket(lifetime, ticket):
+    return (
+        varint.encode(FRAME_NEW_SESSION_TICKET) +
+        varint.encode(lifetime) +
+        varint.encode(len(ticket)) +
+        ticket
+    )
+
+
+def encode_new_connection_id(sequence, retire_prior_to, connection_id, reset_token):
+    return (
+        varint.encode(FRAME_NEW_CONNECTION_ID) +
+        varint.encode(sequence) +
+        varint.encode(retire_prior_to) +
+        bytes([len(connection_id)]) +
+        connection_id +
+        reset_token
+    )
+
+
+def decode_new_connection_id(data):
+    pos = 0
+
+    sequence, n = varint.decode(data[pos:])
+    pos += n
+
+    retire_prior_to, n = varint.decode(data[pos:])
+    pos += n
+
+    length = data[pos]
+    pos += 1
+    connection_id = bytes(data[pos:pos + length])
+    pos += length
+
+    reset_token = bytes(data[pos:pos + RESET_TOKEN_LENGTH])
+    pos += RESET_TOKEN_LENGTH
+
+    return sequence, retire_prior_to, connection_id, reset_token, pos
+
+
+def encode_retire_connection_id(sequence):
+    return varint.encode(FRAME_RETIRE_CONNECTION_ID) + varint.encode(sequence)
+
+
+def encode_path_challenge(data):
+    return varint.encode(FRAME_PATH_CHALLENGE) + data
+
+
+def encode_path_response(data):
+    return varint.encode(FRAME_PATH_RESPONSE) + data
+
+
 def decode_frame(data):
     if len(data) < 1:
         return None, None, 0
@@ -59,13 +164,52 @@ def decode_frame(data):
     frame_type, n = varint.decode(data)
     pos = n
 
-    if frame_type == FRAME_STREAM:
+    if frame_type & ~STREAM_FIN == FRAME_STREAM:
         stream_id, offset, payload, consumed = decode_stream(data[pos:])
-        return FRAME_STREAM, (stream_id, offset, payload), pos + consumed
+        fin = bool(frame_type & STREAM_FIN)
+        return FRAME_STREAM, (stream_id, offset, payload, fin), pos + consumed
 
     elif frame_type == FRAME_ACK:
         stream_id, largest_acked, consumed = decode_ack(data[pos:])
         return FRAME_ACK, (stream_id, largest_acked), pos + consumed
 
+    elif frame_type == FRAME_MAX_DATA:
+        maximum, n = varint.decode(data[pos:])
+        return FRAME_MAX_DATA, maximum, pos + n
+
+    elif frame_type == FRAME_MAX_STREAM_DATA:
+        stream_id, n = varint.decode(data[pos:])
+        pos += n
+        maximum, n = varint.decode(data[pos:])
+        return FRAME_MAX_STREAM_DATA, (stream_id, maximum), pos + n
+
+    elif frame_type == FRAME_DATA_BLOCKED:
+        limit, n = varint.decode(data[pos:])
+        return FRAME_DATA_BLOCKED, limit, pos + n
+
+    elif frame_type == FRAME_STREAM_DATA_BLOCKED:
+        stream_id, n = varint.decode(data[pos:])
+        pos += n
+        limit, n = varint.decode(data[pos:])
+        return FRAME_STREAM_DATA_BLOCKED, (stream_id, limit), pos + n
+
+    elif frame_type == FRAME_NEW_SESSION_TICKET:
+        lifetime, n = varint.decode(data[pos:])
+        pos += n
+        length, n = varint.decode(data[pos:])
+        pos += n
+        return FRAME_NEW_SESSION_TICKET, (lifetime, bytes(data[pos:pos + length])), pos + length
+
+    elif frame_type == FRAME_NEW_CONNECTION_ID:
+        sequence, retire_prior_to, connection_id, reset_token, consumed = decode_new_connection_id(data[pos:])
+        return FRAME_NEW_CONNECTION_ID, (sequence, retire_prior_to, connection_id, reset_token), pos + consumed
+
+    elif frame_type == FRAME_RETIRE_CONNECTION_ID:
+        sequence, n = varint.decode(data[pos:])
+        return FRAME_RETIRE_CONNECTION_ID, sequence, pos + n
+
+    elif frame_type in (FRAME_PATH_CHALLENGE, FRAME_PATH_RESPONSE):
+        return frame_type, bytes(data[pos:pos + PATH_DATA_LENGTH]), pos + PATH_DATA_LENGTH
+
     else:
         return frame_type, None, pos
@@ -0,0 +1,126 @@
+"""
+Handshake offload - key agreement runs in worker processes.
+
+The servers handle every packet in one loop. A MODP key agreement is a
+2048-bit pow() that holds the GIL for milliseconds, so a burst of INIT
+packets (say, every client reconnecting after a restart) would stall all
+established connections behind it. HandshakePool moves that work into a
+process pool:
+
+- start(): submit a client key share, remember per-conn_id state
+- buffer(): hold packets for a conn_id whose keys are still pending
+- completed(): finished handshakes, fed back through a queue
+
+fileno() becomes readable whenever a handshake finishes, so the packet
+loop can select() on it next to the tun device and never block on crypto.
+"""
+
+import os
+import queue
+from concurrent.futures import ProcessPoolExecutor
+
+import crypto
+
+MAX_EARLY_PACKETS = 32
+
+# Set in each worker by _init_worker: {group: private key}
+_server_keys = None
+
+
+def _init_worker(private_keys):
+    global _server_keys
+    _server_keys = {group: crypto.private_key_from_bytes(group, data)
+                    for group, data in private_keys.items()}
+
+
+def _key_agreement(group, their_public):
+    return crypto.key_agreement(group, _server_keys[group], their_public)
+
+
+class PendingHandshake:
+    """A connection waiting for its keys, plus packets that arrived meanwhile."""
+
+    def __init__(self, conn_id: bytes, group: int, state):
+        self.conn_id = conn_id
+        self.group = group
+        self.state = state
+        self.early_packets = []
+
+
+class HandshakePool:
+    """Server-side key agreement in a process pool."""
+
+    def __init__(self, server_keys, workers: int = None):
+        # Key objects don't pickle, raw bytes do
+        private_keys = {group: crypto.private_key_to_bytes(group, private)
+                        for group, private in server_keys.items()}
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                            initargs=(private_keys,))
+        self.pending = {}
+        self.done = queue.SimpleQueue()
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+
+    def fileno(self) -> int:
+        return self.wake_r
+
+    def start(self, conn_id: bytes, group: int, their_public: bytes, state=None) -> bool:
+        """Begin key agreement for conn_id. False if one is already pending."""
+        if conn_id in self.pending:
+            return False
+        handshake = PendingHandshake(conn_id, group, state)
+        self.pending[conn_id] = handshake
+        future = self.executor.submit(_key_agreement, group, their_public)
+        future.add_done_callback(lambda f: self._on_done(handshake, f))
+        return True
+
+    def _on_done(self, handshake: PendingHandshake, future):
+        # Runs on the executor's management thread: hand off, then wake the loop
+        self.done.put((handshake, future))
+        try:
+            os.write(self.wake_w, b'\0')
+        except OSError:
+            pass  # pool closed
+
+    def is_pending(self, conn_id: bytes) -> bool:
+        return conn_id in self.pending
+
+    def buffer(self, conn_id: bytes, packet) -> bool:
+        """Hold a packet until conn_id's keys are ready. False if not pending."""
+        handshake = self.pending.get(conn_id)
+        if handshake is None:
+            return False
+        if len(handshake.early_packets) < MAX_EARLY_PACKETS:
+            handshake.early_packets.append(packet)
+        return True
+
+    def completed(self):
+        """Finished handshakes as (PendingHandshake, shared secret or None)."""
+        # Drain wakeups first: a handshake finishing after this still wakes us
+        try:
+            while os.read(self.wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        results = []
+        while True:
+            try:
+                handshake, future = self.done.get_nowait()
+            except queue.Empty:
+                break
+            del self.pending[handshake.conn_id]
+            try:
+                shared_secret = future.result()
+            except Exception:
+                shared_secret = None
+            results.append((handshake, shared_secret))
+        return results
+
+    def close(self):
+        # Wait for the workers: a multiprocessing child (a server worker) that
+        # exits with them still running joins them before the executor has
+        # told them to stop, and hangs
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        os.close(self.wake_r)
+        os.close(self.wake_w)
@@ -0,0 +1,133 @@
+"""
+A UDP proxy that makes loopback behave like a real path.
+
+The client sends to the proxy and the proxy forwards to the server, and
+back. Each direction is a Link with its own impairments:
+
+- rate: a bottleneck in bytes/sec. Packets queue behind each other and
+  leave one serialization time apart. Once the queue holds more than
+  `queue` seconds of data, new arrivals are tail-dropped.
+- delay and jitter: fixed propagation delay plus a uniform random extra
+  of up to `jitter`. Jitter alone reorders packets.
+- loss: each packet is dropped with this probability.
+- reorder: each packet is held back an extra reorder_delay with this
+  probability, so the ones behind it overtake it.
+
+Packets in flight wait in a heap keyed by delivery time, and the loop
+sleeps in select() until the next delivery or the next arrival.
+"""
+
+import heapq
+import random
+import select
+import socket
+import time
+
+MAX_DATAGRAM = 65535
+
+
+class Link:
+    """One direction of the emulated path."""
+
+    def __init__(self, delay: float = 0.0, jitter: float = 0.0, loss: float = 0.0,
+                 reorder: float = 0.0, reorder_delay: float = 0.005, rate: float = None,
+                 queue: float = 0.05, seed: int = None):
+        self.delay = delay
+        self.jitter = jitter
+        self.loss = loss
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.rate = rate
+        self.queue = queue
+        self.random = random.Random(seed)
+        self.busy_until = 0.0
+        self.stats = {'forwarded': 0, 'lost': 0, 'queue_drops': 0, 'reordered': 0, 'bytes': 0}
+
+    def departure(self, size: int, now: float):
+        """When a packet arriving now should be delivered, or None to drop it."""
+        if self.loss and self.random.random() < self.loss:
+            self.stats['lost'] += 1
+            return None
+
+        leave = now
+        if self.rate:
+            start = max(now, self.busy_until)
+            if start - now > self.queue:
+                self.stats['queue_drops'] += 1
+                return None
+            leave = self.busy_until = start + size / self.rate
+
+        leave += self.delay
+        if self.jitter:
+            leave += self.random.uniform(0, self.jitter)
+        if self.reorder and self.random.random() < self.reorder:
+            leave += self.reorder_delay
+            self.stats['reordered'] += 1
+
+        self.stats['forwarded'] += 1
+        self.stats['bytes'] += size
+        return leave
+
+
+class ImpairmentProxy:
+    """
+    Forwards between one client and one server through two Links.
+    `listen` is the socket the client sends to; replies go back to
+    whichever address last sent from the client side.
+    """
+
+    def __init__(self, listen, server_addr, upstream: Link = None, downstream: Link = None):
+        self.front = listen
+        self.back = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.back.bind(('127.0.0.1', 0))
+        self.front.setblocking(False)
+        self.back.setblocking(False)
+        self.server_addr = server_addr
+        self.client_addr = None
+        self.upstream = upstream or Link()
+        self.downstream = downstream or Link()
+        self.in_flight = []
+        self.count = 0
+
+    def _arrive(self, data, link, sock, addr, now):
+        leave = link.departure(len(data), now)
+        if leave is not None:
+            # The counter breaks ties between packets due at the same time
+            heapq.heappush(self.in_flight, (leave, self.count, sock, data, addr))
+            self.count += 1
+
+    def _deliver(self, now):
+        while self.in_flight and self.in_flight[0][0] <= now:
+            _, _, sock, data, addr = heapq.heappop(self.in_flight)
+            try:
+                sock.sendto(data, addr)
+            except OSError:
+                pass  # a full socket buffer is just more loss
+
+    def run(self, stop_event=None):
+        sockets = [self.front, self.back]
+        while stop_event is None or not stop_event.is_set():
+            timeout = 0.1
+            if self.in_flight:
+                timeout = max(0.0, min(timeout, self.in_flight[0][0] - time.monotonic()))
+            readable, _, _ = select.select(sockets, [], [], timeout)
+
+            now = time.monotonic()
+            if self.front in readable:
+                for data, addr in self._drain(self.front):
+                    self.client_addr = addr
+                    self._arrive(data, self.upstream, self.back, self.server_addr, now)
+            if self.back in readable and self.client_addr is not None:
+                for data, _ in self._drain(self.back):
+                    self._arrive(data, self.downstream, self.front, self.client_addr, now)
+            self._deliver(now)
+
+    @staticmethod
+    def _drain(sock):
+        """Every datagram waiting on sock."""
+        received = []
+        while True:
+            try:
+                received.append(sock.recvfrom(MAX_DATAGRAM))
+            except BlockingIOError:
+                return received
@@ -0,0 +1,34 @@
+"""
+A UDP socket standing in for the utun device.
+
+The servers read whole IPv4 packets from the tun device and write whole
+IPv4 packets back. LoopbackTun wraps each incoming datagram in the IP and
+UDP headers the tun would have delivered, and strips them off outgoing
+packets, so benchmarks run the same server code over plain loopback
+sockets, no root or tun device needed.
+"""
+
+import socket
+import struct
+
+
+class LoopbackTun:
+    """Stands in for the utun device: UDP datagrams in, IPv4 packets out."""
+
+    def __init__(self, sock, port: int):
+        self.sock = sock
+        self.port = port
+        self.local_ip = socket.inet_aton(sock.getsockname()[0])
+
+    def read(self):
+        payload, (ip, port) = self.sock.recvfrom(65535)
+        udp = struct.pack('!HHHH', port, self.port, 8 + len(payload), 0)
+        ip_header = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 28 + len(payload), 0, 0, 64,
+                                socket.IPPROTO_UDP, 0, socket.inet_aton(ip), self.local_ip)
+        return ip_header + udp + payload
+
+    def write(self, packet):
+        ihl = (packet[0] & 0x0F) * 4
+        dest_ip = socket.inet_ntoa(packet[16:20])
+        dest_port = int.from_bytes(packet[ihl + 2:ihl + 4], 'big')
+        self.sock.sendto(packet[ihl + 8:], (dest_ip, dest_port))
@@ -5,13 +5,15 @@ import random
 from stack import TunDevice
 from packet_headers import IPHeader, TCPHeader
 import protocols
+from reorder import ReorderBuffer
 
 STREAM_PORTS = {9001: 1, 9002: 2, 9003: 3}
+REORDER_CAPACITY = 64
 
 connections = {}
 next_global_seq = 1
-next_to_deliver = 1
-pending_messages = []
+# Messages waiting for an earlier one; full = receive window closed
+pending_messages = ReorderBuffer(REORDER_CAPACITY, start=1)
 delayed_messages = []
 
 
@@ -100,7 +102,17 @@ def main():
 
                         payload = tcp_header.payload
                         if payload and conn['state'] == 'ESTABLISHED':
-                            global next_global_seq, next_to_deliver
+                            global next_global_seq
+                            data = payload.decode('utf-8', errors='replace').strip()
+                            seq = next_global_seq
+
+                            # Backpressure: leave the segment unacknowledged and
+                            # the client's TCP sends it again later
+                            if data != "flush" and not pending_messages.accepts(seq):
+                                print(f"[Stream {stream_id}] Window full ({len(pending_messages)} "
+                                      f"messages waiting), not acknowledging: {data}")
+                                continue
+
                             conn['our_ack'] = tcp_header.seq_num + len(payload)
                             send_tcp(
                                 tun,
@@ -112,27 +124,23 @@ def main():
                                 ack=conn['our_ack'],
                                 flags=protocols.TCP_FLAG_ACK
                             )
-                            data = payload.decode('utf-8', errors='replace').strip()
-                            seq = next_global_seq
-                            next_global_seq += 1
 
                             if data == "flush":
                                 for msg in delayed_messages:
-                                    pending_messages.append(msg)
+                                    pending_messages.push(msg[0], msg)
                                     print(f"[Stream {msg[1]}] (seq {msg[0]}) RELEASED: {msg[2]}")
                                 delayed_messages.clear()
                             elif stream_id == 2:
+                                next_global_seq += 1
                                 delayed_messages.append((seq, stream_id, data))
                                 print(f"[Stream {stream_id}] (seq {seq}) DELAYED: {data}")
                             else:
-                                pending_messages.append((seq, stream_id, data))
+                                next_global_seq += 1
+                                pending_messages.push(seq, (seq, stream_id, data))
                                 print(f"[Stream {stream_id}] (seq {seq}) QUEUED: {data}")
 
-                            pending_messages.sort(key=lambda x: x[0])
-                            while pending_messages and pending_messages[0][0] == next_to_deliver:
-                                msg = pending_messages.pop(0)
+                            for msg in pending_messages.pop():
                                 print(f"[Stream {msg[1]}] (seq {msg[0]}) DELIVERED: {msg[2]}")
-                                next_to_deliver += 1
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,208 @@
+"""
+Pacing: send at the congestion controller's rate instead of in bursts.
+
+BBR hands out a pacing interval (seconds per packet). Comparing it with the
+time since the last send in a tight loop keeps a core at 100% and sends at
+most one packet per pass. Here:
+
+- TokenBucket turns the rate into a send budget. Tokens (bytes) accrue at
+  the pacing rate up to a small burst, so a sender that wakes late makes
+  up for it with a few packets at once and the average rate holds. At
+  high rates the burst grows to BBR's send quantum, SEND_QUANTUM_NS worth
+  of the rate: select() oversleeps by tens of microseconds, longer than
+  a few packets take at 50k packets/s, and tokens past the cap are lost.
+  A sender sleeps until half the burst has built up (wake_delay_ns()),
+  not until the next packet: each wakeup releases a small burst, and at
+  50k packets/s the loop wakes about 2,000 times a second, not 50,000.
+- TimerWheel keeps every connection's next release time: a hierarchical
+  wheel of TICK_NS slots. Scheduling is O(1) and each tick touches only
+  the due timers, so thousands of paced connections cost little more
+  than one.
+- wait() sleeps in select() until the next release or until the socket
+  becomes readable (an ACK), whichever comes first. All times are
+  perf_counter_ns.
+"""
+
+import select
+import time
+
+TICK_NS = 100_000
+WHEEL_SLOTS = 256
+WHEEL_LEVELS = 3
+MAX_BURST_PACKETS = 4
+MAX_DATAGRAM = 1200
+SEND_QUANTUM_NS = 1_000_000
+MAX_SEND_QUANTUM = 64 * 1024
+
+
+def now_ns() -> int:
+    return time.perf_counter_ns()
+
+
+class TokenBucket:
+    """
+    Send budget in bytes, refilled at `rate` bytes/sec up to `burst`, or
+    up to the send quantum if that is larger.
+    """
+
+    def __init__(self, rate: float = None, burst: int = MAX_BURST_PACKETS * MAX_DATAGRAM):
+        self.min_burst = burst
+        self.rate = None
+        self.burst = burst
+        self.tokens = burst
+        self.last_ns = now_ns()
+        self.set_rate(rate)
+
+    def set_rate(self, rate: float):
+        """New rate in bytes/sec, None or 0 for unpaced."""
+        self.refill(now_ns())
+        self.rate = rate or None
+        quantum = self.rate * SEND_QUANTUM_NS / 1e9 if self.rate else 0
+        self.burst = max(self.min_burst, min(quantum, MAX_SEND_QUANTUM))
+
+    def refill(self, now: int):
+        if self.rate is None:
+            self.tokens = self.burst
+        else:
+            self.tokens = min(self.burst, self.tokens + (now - self.last_ns) * self.rate / 1e9)
+        self.last_ns = now
+
+    def take(self, size: int, now: int = None) -> bool:
+        """Spend size bytes of budget. False (nothing spent) if there isn't enough yet."""
+        self.refill(now if now is not None else now_ns())
+        if self.tokens < size:
+            return False
+        self.tokens -= size
+        return True
+
+    def refund(self, size: int):
+        """Give back budget taken for a packet that was not sent after all."""
+        self.tokens = min(self.burst, self.tokens + size)
+
+    def delay_ns(self, size: int) -> int:
+        """How long until size bytes of budget are available."""
+        if self.rate is None or self.tokens >= size:
+            return 0
+        return int((size - self.tokens) * 1e9 / self.rate)
+
+    def wake_delay_ns(self, size: int) -> int:
+        """Sleep this long before sending again: until half the burst (at least size) is available."""
+        return self.delay_ns(max(size, self.burst // 2))
+
+
+class TimerWheel:
+    """
+    Hierarchical timer wheel: WHEEL_LEVELS wheels of WHEEL_SLOTS slots.
+
+    Level 0 slots are one tick wide, level 1 slots span a full turn of
+    level 0, and so on. A timer goes into the coarsest wheel that can hold
+    it and moves down a level each time the wheel below completes a turn.
+    With the defaults that covers 100 us resolution out to ~28 minutes.
+    Timers further out than that wait in the top wheel and are re-filed on
+    every turn. A bitmap of the non-empty level 0 slots lets advance() and
+    next_deadline_ns() jump straight to the next due slot instead of
+    stepping through the empty ones.
+    """
+
+    def __init__(self, tick_ns: int = TICK_NS, slots: int = WHEEL_SLOTS, levels: int = WHEEL_LEVELS):
+        self.tick_ns = tick_ns
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self.counts = [0] * levels
+        self.occupied = 0   # bit i set: level 0 slot i holds timers
+        self.mask = (1 << slots) - 1
+        self.tick = now_ns() // tick_ns
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def schedule(self, deadline_ns: int, item):
+        """Fire item at deadline_ns (on the next tick if that has passed)."""
+        # Round up, so nothing fires before its deadline
+        self._insert(max(-(-deadline_ns // self.tick_ns), self.tick + 1), item)
+
+    def _insert(self, tick: int, item):
+        delta = tick - self.tick
+        span = self.slots
+        for level in range(self.levels):
+            if delta < span or level == self.levels - 1:
+                slot = (tick * self.slots // span) % self.slots
+                self.wheels[level][slot].append((tick, item))
+                self.counts[level] += 1
+                if level == 0:
+                    self.occupied |= 1 << slot
+                return
+            span *= self.slots
+
+    def advance(self, now: int = None) -> list:
+        """Move the wheel to now, returning every item whose deadline has passed."""
+        target = (now if now is not None else now_ns()) // self.tick_ns
+        expired = []
+        while self.tick < target:
+            if not len(self):
+                self.tick = target
+                break
+            # Skip the empty ticks before the next due slot or the next
+            # turn, where higher levels cascade down
+            skip_to = (self.tick // self.slots + 1) * self.slots - 1
+            offset = self._next_occupied()
+            if offset is not None:
+                skip_to = min(skip_to, self.tick + offset - 1)
+            self.tick = min(target, skip_to)
+            if self.tick == target:
+                break
+            self.tick += 1
+            self._cascade()
+
+            slot = self.tick % self.slots
+            bucket = self.wheels[0][slot]
+            if bucket:
+                self.wheels[0][slot] = []
+                self.counts[0] -= len(bucket)
+                self.occupied &= ~(1 << slot)
+                expired.extend(item for _, item in bucket)
+        return expired
+
+    def _cascade(self):
+        span = self.slots
+        for level in range(1, self.levels):
+            if self.tick % span:
+                return
+            slot = (self.tick // span) % self.slots
+            bucket = self.wheels[level][slot]
+            if bucket:
+                self.wheels[level][slot] = []
+                self.counts[level] -= len(bucket)
+                for tick, item in bucket:
+                    self._insert(max(tick, self.tick), item)
+            span *= self.slots
+
+    def next_deadline_ns(self):
+        """Upper bound on the earliest deadline, or None if no timers are set."""
+        if not len(self):
+            return None
+        # Timers above level 0 can fire no earlier than the next cascade
+        tick = (self.tick // self.slots + 1) * self.slots
+        offset = self._next_occupied()
+        if offset is not None and (self.tick + offset < tick or self.counts[0] == len(self)):
+            tick = self.tick + offset
+        return tick * self.tick_ns
+
+    def _next_occupied(self):
+        """Ticks until the next non-empty level 0 slot (1 to slots), None if all are empty."""
+        if not self.occupied:
+            return None
+        start = (self.tick + 1) % self.slots
+        rotated = ((self.occupied >> start) | (self.occupied << (self.slots - start))) & self.mask
+        return (rotated & -rotated).bit_length()
+
+
+def wait(sock, deadline_ns):
+    """Sleep until deadline_ns (None: indefinitely) or until sock is readable."""
+    if deadline_ns is None:
+        timeout = None
+    else:
+        timeout = max(0, deadline_ns - now_ns()) / 1e9
+    readable, _, _ = select.select([sock], [], [], timeout)
+    return bool(readable)
@@ -4,26 +4,36 @@ QUIC Client - class-based wrapper for clean HTTP/3 integration.
 
 import os
 import socket
+import time
 
 import crypto
 import varint
 import frames
+import streams
+import udp_io
 
 # Packet types
 PACKET_DATA = 0x01
 PACKET_INIT = 0x03
 PACKET_ACCEPT = 0x04
 
+MAX_STREAM_PAYLOAD = 1200
+
 
 class QUICClient:
     """A QUIC client connection."""
 
-    def __init__(self, host: str, port: int):
+    def __init__(self, host: str, port: int, group: int = crypto.KEX_X25519):
         self.host = host
         self.port = port
+        self.group = group
         self.sock = None
-        self.aes_key = None
+        self.udp = None
+        self.send_keys = None
+        self.recv_keys = None
         self.conn_id = None
+        self.recv_streams = streams.ReceiveStreams()
+        self.send_streams = streams.SendStreams()
 
     def connect(self):
         """Open socket and perform QUIC handshake."""
@@ -31,47 +41,86 @@ class QUICClient:
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.conn_id = os.urandom(8)
 
-        # Do handshake (get encryption key)
-        self.aes_key = self._do_handshake()
+        # Do handshake (get packet protection keys)
+        self.send_keys, self.recv_keys = self._do_handshake()
 
-        # Set non-blocking for receive
+        # Set non-blocking for receive, batch datagrams from here on
         self.sock.setblocking(False)
+        self.udp = udp_io.BatchSocket(self.sock)
 
     def _do_handshake(self):
-        """Perform QUIC handshake, return AES key."""
-        private_key = crypto.generate_private_key()
-        public_key = crypto.compute_public_key(private_key)
+        """Perform QUIC handshake, return (send, receive) packet protection."""
+        private_key, public_key = crypto.generate_keypair(self.group)
 
-        init_packet = bytes([PACKET_INIT]) + self.conn_id + public_key.to_bytes(256, 'big')
+        init_packet = bytes([PACKET_INIT]) + self.conn_id + crypto.encode_key_share(self.group, public_key)
         self.sock.sendto(init_packet, (self.host, self.port))
 
         response, _ = self.sock.recvfrom(4096)
-        server_public = int.from_bytes(response[9:265], 'big')
+        group, server_public, server_random = crypto.decode_server_share(response[9:])
+
+        shared_secret = crypto.handshake_secret(crypto.key_agreement(group, private_key, server_public),
+                                                server_random)
+        return crypto.derive_packet_protection(shared_secret, is_client=True)
+
+    def send(self, stream_id: int, data: bytes, fin: bool = False):
+        """Send data on a stream, as far as the server's flow control allows."""
+        self.send_streams.write(stream_id, data, fin)
+        self.flush()
+        self.udp.flush()
+
+    def flush(self):
+        """Send queued data on every stream until empty or out of credit, by priority."""
+        while True:
+            chunks = self.send_streams.next_packet(MAX_STREAM_PAYLOAD)
+            if not chunks:
+                return
+            self._send_frames(b''.join(frames.encode_stream(stream_id, offset, data, fin)
+                                       for stream_id, offset, data, fin in chunks))
+
+    def _send_frames(self, payload: bytes):
+        packet = self.send_keys.seal(bytes([PACKET_DATA]) + self.conn_id, payload)
+        self.udp.queue(packet, (self.host, self.port))
+
+    def stream(self, stream_id: int) -> streams.RecvStream:
+        """Readable end of a stream (read(), readable, at_eof)."""
+        return self.recv_streams.get(stream_id)
+
+    def receive(self, stream_id: int = 0) -> bytes:
+        """Process every waiting packet from the server, return newly readable stream data."""
+        datagrams = self.udp.recv()
+        if not datagrams:
+            return None
 
-        shared_secret = crypto.compute_shared_secret(server_public, private_key)
-        return crypto.derive_aes_key(shared_secret)
+        for packet, _ in datagrams:
+            self._process_packet(packet)
 
-    def send(self, stream_id: int, data: bytes):
-        """Send data on a stream."""
-        frame = frames.encode_stream(stream_id, 0, data)
-        encrypted = crypto.encrypt(self.aes_key, frame)
-        packet = bytes([PACKET_DATA]) + self.conn_id + encrypted
-        self.sock.sendto(packet, (self.host, self.port))
+        data = self.recv_streams.read(stream_id)
 
-    def receive(self) -> bytes:
-        """Receive data from server."""
-        try:
-            packet, _ = self.sock.recvfrom(4096)
-        except BlockingIOError:
-            return None
+        updates = self.recv_streams.pending_updates(time.time())
+        if updates:
+            self._send_frames(updates)
+        self.udp.flush()
+
+        return data or None
 
-        encrypted = packet[9:]
-        decrypted = crypto.decrypt(self.aes_key, encrypted)
-        frame_type, frame_data, _ = frames.decode_frame(decrypted)
-        if frame_type == frames.FRAME_STREAM and frame_data:
-            stream_id, offset, data = frame_data
-            return data
-        return None
+    def _process_packet(self, packet: bytes):
+        try:
+            decrypted = self.recv_keys.open(packet, 9)
+        except Exception:
+            return   # forged, corrupted or from an older key: drop it
+
+        pos = 0
+        while pos < len(decrypted):
+            frame_type, frame_data, consumed = frames.decode_frame(decrypted[pos:])
+            if frame_type is None:
+                break
+            pos += consumed
+
+            if frame_type == frames.FRAME_STREAM:
+                sid, offset, data, fin = frame_data
+                self.recv_streams.on_stream_frame(sid, offset, data, fin)
+            elif self.send_streams.on_frame(frame_type, frame_data):
+                self.flush()
 
     def close(self):
         """Close the connection."""
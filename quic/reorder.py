@@ -0,0 +1,86 @@
+"""
+Ordered delivery of items that arrive out of order.
+
+Items wait in a min-heap keyed by position. Whenever the smallest one is
+at the next expected position, it is delivered and the expected position
+moves on by the item's size: 1 for numbered messages, len(data) for byte
+ranges of a stream. Each arrival costs O(log n), and each delivery pops
+the heap once, however deep the reordering is.
+
+Byte ranges may overlap or repeat (retransmissions). Whatever was already
+delivered is trimmed off on arrival, and repeats of a buffered range are
+dropped, so retransmissions don't use up capacity.
+
+Capacity bounds both how far ahead of the expected position an item may
+start and how much may be buffered. push() refuses anything beyond it,
+and the caller applies backpressure: it stops acknowledging, shrinks the
+window, or drops.
+"""
+
+import heapq
+
+
+def _one(item):
+    return 1
+
+
+class ReorderBuffer:
+    """Min-heap reorder buffer with bounded capacity."""
+
+    def __init__(self, capacity: int, start: int = 0, size=None):
+        self.capacity = capacity
+        self.next = start
+        self.size = size or _one
+        self.heap = []
+        self.buffered = 0
+        self.count = 0
+        self.ends = {}  # position -> furthest end buffered there
+
+    def __len__(self):
+        return len(self.heap)
+
+    def accepts(self, position: int, size: int = 1) -> bool:
+        """Whether an item of this size at this position fits right now."""
+        end = position + size
+        return end <= self.next or (end - self.next <= self.capacity and
+                                    self.buffered + size <= self.capacity)
+
+    def push(self, position: int, item) -> bool:
+        """Buffer an item. False if it is beyond capacity (not buffered)."""
+        size = self.size(item)
+        end = position + size
+        if end <= self.next or self.ends.get(position, -1) >= end:
+            return True  # already delivered or buffered
+        if position < self.next:
+            item = item[self.next - position:]
+            position, size = self.next, end - self.next
+        if not self.accepts(position, size):
+            return False
+        self.ends[position] = end
+        # The counter breaks ties, so items themselves are never compared
+        heapq.heappush(self.heap, (position, self.count, item))
+        self.count += 1
+        self.buffered += size
+        return True
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.heap) and self.heap[0][0] <= self.next
+
+    def pop(self) -> list:
+        """Remove and return every item that is now in order."""
+        delivered = []
+        heap = self.heap
+        while heap and heap[0][0] <= self.next:
+            position, _, item = heapq.heappop(heap)
+            size = self.size(item)
+            self.buffered -= size
+            self.ends.pop(position, None)
+            end = position + size
+            if end <= self.next:
+                continue
+            if position < self.next:
+                item = item[self.next - position:]
+            delivered.append(item)
+            self.next = end
+        return delivered
@@ -0,0 +1,145 @@
+"""
+Stream scheduling: which streams fill the next packet (RFC 9218 priorities).
+
+Every stream has an urgency, 0 (most urgent) to 7 (default 3), and an
+incremental flag:
+
+- Lower urgency always goes first. A bulk download at urgency 5 never
+  holds an interactive stream at urgency 1 back by more than one packet.
+- Within an urgency, non-incremental streams (only useful once complete,
+  like a script or a JSON reply) are sent one at a time in stream ID order.
+- Incremental streams (progressive images, media) then share what is left
+  by deficit round-robin: each turn a stream may send weight * quantum
+  bytes, so a weight 2 stream gets twice the bandwidth of a weight 1 one.
+
+Only streams with queued data are tracked. A stream that is out of
+flow-control credit is skipped and keeps its place, so it carries on as
+soon as MAX_STREAM_DATA arrives and never blocks the streams behind it.
+"""
+
+import bisect
+from collections import deque
+
+URGENCY_LEVELS = 8
+DEFAULT_URGENCY = 3
+QUANTUM = 1200
+MIN_ROOM = 32
+
+
+class Priority:
+    def __init__(self, urgency: int = DEFAULT_URGENCY, incremental: bool = False, weight: int = 1):
+        if not 0 <= urgency < URGENCY_LEVELS:
+            raise ValueError(f"urgency must be 0-{URGENCY_LEVELS - 1}, got {urgency}")
+        if weight < 1:
+            raise ValueError(f"weight must be at least 1, got {weight}")
+        self.urgency = urgency
+        self.incremental = incremental
+        self.weight = weight
+
+
+DEFAULT_PRIORITY = Priority()
+
+
+class StreamScheduler:
+    """Priority buckets of streams with data to send."""
+
+    def __init__(self, quantum: int = QUANTUM, min_room: int = MIN_ROOM):
+        self.quantum = quantum
+        self.min_room = min_room
+        self.priorities = {}
+        self.active = set()
+        # Per urgency: sorted IDs of non-incremental streams, and a rotation
+        # of incremental ones with their deficit counters
+        self.sequential = [[] for _ in range(URGENCY_LEVELS)]
+        self.rotation = [deque() for _ in range(URGENCY_LEVELS)]
+        self.deficit = {}
+
+    def priority(self, stream_id: int) -> Priority:
+        return self.priorities.get(stream_id, DEFAULT_PRIORITY)
+
+    def set_priority(self, stream_id: int, urgency: int = DEFAULT_URGENCY,
+                     incremental: bool = False, weight: int = 1):
+        priority = Priority(urgency, incremental, weight)
+        active = stream_id in self.active
+        if active:
+            self.remove(stream_id)
+        self.priorities[stream_id] = priority
+        if active:
+            self.push(stream_id)
+
+    def push(self, stream_id: int):
+        """Mark a stream as having data to send."""
+        if stream_id in self.active:
+            return
+        self.active.add(stream_id)
+        priority = self.priority(stream_id)
+        if priority.incremental:
+            self.rotation[priority.urgency].append(stream_id)
+            self.deficit[stream_id] = 0
+        else:
+            bisect.insort(self.sequential[priority.urgency], stream_id)
+
+    def remove(self, stream_id: int):
+        if stream_id not in self.active:
+            return
+        self.active.discard(stream_id)
+        priority = self.priority(stream_id)
+        if priority.incremental:
+            self.rotation[priority.urgency].remove(stream_id)
+            del self.deficit[stream_id]
+        else:
+            self.sequential[priority.urgency].remove(stream_id)
+
+    def forget(self, stream_id: int):
+        """Drop everything about a finished stream."""
+        self.remove(stream_id)
+        self.priorities.pop(stream_id, None)
+
+    def fill(self, room: int, send) -> int:
+        """
+        Hand out `room` bytes in priority order, return what is left.
+
+        send(stream_id, limit) puts at most `limit` bytes of the stream into
+        the packet and returns (bytes used, stream still has data). Using 0
+        bytes while still having data means the stream is blocked.
+        """
+        for urgency in range(URGENCY_LEVELS):
+            if room < self.min_room:
+                break
+
+            sequential = self.sequential[urgency]
+            i = 0
+            while i < len(sequential) and room >= self.min_room:
+                stream_id = sequential[i]
+                used, more = send(stream_id, room)
+                room -= used
+                if more:
+                    i += 1
+                else:
+                    sequential.pop(i)
+                    self.active.discard(stream_id)
+
+            rotation = self.rotation[urgency]
+            blocked = 0
+            while rotation and blocked < len(rotation) and room >= self.min_room:
+                stream_id = rotation[0]
+                if self.deficit[stream_id] < self.min_room:
+                    self.deficit[stream_id] += self.quantum * self.priority(stream_id).weight
+                used, more = send(stream_id, min(room, self.deficit[stream_id]))
+                room -= used
+                if not more:
+                    rotation.popleft()
+                    del self.deficit[stream_id]
+                    self.active.discard(stream_id)
+                    continue
+                if used == 0:
+                    blocked += 1
+                    rotation.rotate(-1)
+                    continue
+                blocked = 0
+                self.deficit[stream_id] -= used
+                # Turn used up: next stream. Otherwise the packet is full and
+                # this stream goes first in the next one
+                if self.deficit[stream_id] < self.min_room:
+                    rotation.rotate(-1)
+        return room
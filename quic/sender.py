@@ -8,161 +8,365 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import crypto
 import varint
 import frames
-from bbr import BBR
+import streams
+import udp_io
+import tickets
+import pacer
+import bulk
+import bbr
+from bbr import qlog
 
 DEST_IP = '192.168.100.100'
 UDP_PORT = 9000
-SERVER_CACHE_FILE = 'server_pubkey.bin'
+TICKET_CACHE_FILE = 'session_tickets.json'
+PATH_CACHE_FILE = 'path_metrics.json'
+SERVER = f'{DEST_IP}:{UDP_PORT}'
+KEY_EXCHANGE = crypto.KEX_X25519
+ACK_WAIT = 0.1
+INITIAL_RTO = 0.333
+MIN_RTO = 0.02
+RTO_FACTOR = 2
+STREAM_ID = 1
+MAX_DATAGRAM = 1200
+# Type byte, connection ID, packet number and AEAD tag around every frame
+PACKET_OVERHEAD = 1 + 8 + crypto.PN_LENGTH + crypto.TAG_LENGTH
 
 PACKET_DATA = 0x01
 PACKET_ACK = 0x02
 PACKET_INIT = 0x03
 PACKET_ACCEPT = 0x04
 PACKET_0RTT = 0x05
+PACKET_0RTT_REJECT = 0x06
+# Any name in bbr.registry: newreno, cubic, bbr, bbr2
+CONGESTION_CONTROL = 'bbr'
 
 pending_acks = {}
-aes_key = None
+send_keys = None
+recv_keys = None
+resumption_secret = None
+ticket_cache = tickets.TicketCache(TICKET_CACHE_FILE)
+path_cache = bbr.PathCache(PATH_CACHE_FILE)
 conn_id = os.urandom(8)
+dest_cid = conn_id
+peer_cids = {}
 packets_sent = 0
-last_send_time = 0
+packets_retransmitted = 0
+packets_acked = 0
+bytes_in_flight = 0
+transfer = None
+frame_buffer = bytearray(MAX_DATAGRAM)
 
-controller = BBR()
+controller = bbr.create(CONGESTION_CONTROL)
+tracer = None
+send_flow = streams.SendStreams()
 
 
 def do_handshake(sock):
-    my_private = crypto.generate_private_key()
-    my_public = crypto.compute_public_key(my_private)
+    global resumption_secret
 
-    init_packet = bytes([PACKET_INIT]) + conn_id + my_public.to_bytes(256, 'big')
+    my_private, my_public = crypto.generate_keypair(KEY_EXCHANGE)
+
+    init_packet = bytes([PACKET_INIT]) + conn_id + crypto.encode_key_share(KEY_EXCHANGE, my_public)
     sock.sendto(init_packet, (DEST_IP, UDP_PORT))
     print(f"[Handshake] INIT sent (conn_id={conn_id.hex()[:8]}...)")
 
     sock.setblocking(True)
-    response, addr = sock.recvfrom(1024)
+    while True:
+        response, addr = sock.recvfrom(4096)
+        if response[0] == PACKET_ACCEPT:
+            break
     sock.setblocking(False)
 
-    if response[0] != PACKET_ACCEPT:
-        raise Exception("Expected ACCEPT packet")
-
     recv_conn_id = response[1:9]
-    their_public = int.from_bytes(response[9:265], 'big')
+    group, their_public, server_random = crypto.decode_server_share(response[9:])
     print(f"[{recv_conn_id.hex()[:8]}] ACCEPT received")
 
-    with open(SERVER_CACHE_FILE, 'wb') as f:
-        f.write(their_public.to_bytes(256, 'big'))
-
-    shared_secret = crypto.compute_shared_secret(their_public, my_private)
-    key = crypto.derive_aes_key(shared_secret)
+    shared_secret = crypto.handshake_secret(crypto.key_agreement(group, my_private, their_public), server_random)
+    keys = crypto.derive_packet_protection(shared_secret, is_client=True)
+    resumption_secret = crypto.derive_resumption_secret(shared_secret)
     print("[Handshake] Complete\n")
 
-    return key
+    return keys
 
 
-def do_0rtt(sock):
-    with open(SERVER_CACHE_FILE, 'rb') as f:
-        server_public = int.from_bytes(f.read(), 'big')
+def do_0rtt(ticket):
+    """Keys from a session ticket - no key agreement, just HKDF."""
+    global resumption_secret
 
-    my_private = crypto.generate_private_key()
-    my_public = crypto.compute_public_key(my_private)
+    client_random = os.urandom(tickets.CLIENT_RANDOM_LENGTH)
+    shared_secret = ticket.resumption_secret + client_random
+    keys = crypto.derive_packet_protection(shared_secret, is_client=True)
+    resumption_secret = crypto.derive_resumption_secret(shared_secret)
+    print("[0-RTT] Resuming with session ticket\n")
 
-    shared_secret = crypto.compute_shared_secret(server_public, my_private)
-    key = crypto.derive_aes_key(shared_secret)
-    print("[0-RTT] Using cached key\n")
+    return keys, tickets.encode_resumption(client_random, ticket.age_ms, ticket.ticket)
 
-    return key, my_public
 
-
-def send_0rtt_data(sock, my_public, stream_id, offset, data):
-    global packets_sent
-    frame = frames.encode_stream(stream_id, offset, data.encode('utf-8'))
-    encrypted = crypto.encrypt(aes_key, frame)
-    payload = (bytes([PACKET_0RTT]) + conn_id + my_public.to_bytes(256, 'big') + encrypted)
-    sock.sendto(payload, (DEST_IP, UDP_PORT))
-    pending_acks[(stream_id, offset)] = (time.time(), data)
-    packets_sent += 1
+def seal_stream(prefix, stream_id, offset, data, fin):
+    """
+    One packet carrying one STREAM frame. data (a memoryview into the
+    source) is copied once, into frame_buffer, and encrypted from there.
+    """
+    n = frames.encode_stream_into(frame_buffer, stream_id, offset, data, fin)
+    packet = bytearray(len(prefix) + crypto.PN_LENGTH + n + crypto.TAG_LENGTH)
+    send_keys.seal_into(packet, prefix, memoryview(frame_buffer)[:n])
+    return packet
 
 
-def send_data(sock, stream_id, offset, data):
-    global packets_sent
-    frame = frames.encode_stream(stream_id, offset, data.encode('utf-8'))
-    encrypted = crypto.encrypt(aes_key, frame)
-    payload = bytes([PACKET_DATA]) + conn_id + encrypted
-    sock.sendto(payload, (DEST_IP, UDP_PORT))
-    pending_acks[(stream_id, offset)] = (time.time(), data)
-    packets_sent += 1
+def stream_room(stream_id, offset):
+    """Most STREAM frame data that fits in one datagram at this offset."""
+    header = 1 + len(varint.encode(stream_id)) + len(varint.encode(offset)) + 2
+    return MAX_DATAGRAM - PACKET_OVERHEAD - header
 
 
-def process_acks(sock):
-    try:
-        while True:
-            payload, addr = sock.recvfrom(1024)
-            if len(payload) >= 10 and payload[0] == PACKET_DATA:
-                encrypted = payload[9:]
-                decrypted = crypto.decrypt(aes_key, encrypted)
-
-                pos = 0
-                while pos < len(decrypted):
-                    frame_type, frame_data, consumed = frames.decode_frame(decrypted[pos:])
-                    if frame_type is None:
-                        break
-                    pos += consumed
-
-                    if frame_type == frames.FRAME_ACK:
-                        stream_id, largest_acked = frame_data
-                        key = (stream_id, largest_acked)
-                        if key in pending_acks:
-                            send_time, data = pending_acks[key]
-                            rtt = time.time() - send_time
-                            controller.on_ack(rtt)
-                            del pending_acks[key]
-    except BlockingIOError:
-        pass
+def track(key, size, data, fin, retransmission=False, packet_type='1RTT'):
+    """Tell the controller about a sent packet and keep it until it is acknowledged."""
+    global bytes_in_flight, packets_sent
+    now = time.time()
+    pn = send_keys.next_pn - 1
+    earlier = pending_acks.pop(key, None)
+    if earlier:
+        # Resent: the earlier copy is given up for lost
+        bytes_in_flight -= earlier[0].size
+    # Re-inserting moves the entry to the back, so pending_acks stays in send order
+    pending_acks[key] = (controller.on_packet_sent(size, now, bytes_in_flight, retransmission), data, fin, pn)
+    bytes_in_flight += size
+    packets_sent += 1
+    if tracer:
+        stream_id, offset = key
+        tracer.packet_sent(now, packet_type, pn, size, [qlog.stream_frame(stream_id, offset, len(data), fin)])
+
+
+def send_0rtt_data(udp, resumption, stream_id, offset, data, fin=False):
+    packet = seal_stream(bytes([PACKET_0RTT]) + conn_id + resumption, stream_id, offset, data, fin)
+    udp.queue(packet, (DEST_IP, UDP_PORT))
+    track((stream_id, offset), len(packet), data, fin, packet_type='0RTT')
+
+
+def on_0rtt_rejected(udp):
+    """Server refused the ticket: do a full handshake, resend what 0-RTT carried."""
+    global send_keys, recv_keys
+    print("[0-RTT] Rejected, falling back to full handshake")
+    send_keys, recv_keys = do_handshake(udp.sock)
+    for (stream_id, offset), (_, data, fin, _) in list(pending_acks.items()):
+        send_data(udp, stream_id, offset, data, fin)
+
+
+def send_data(udp, stream_id, offset, data, fin=False, retransmission=False):
+    packet = seal_stream(bytes([PACKET_DATA]) + dest_cid, stream_id, offset, data, fin)
+    udp.queue(packet, (DEST_IP, UDP_PORT))
+    track((stream_id, offset), len(packet), data, fin, retransmission)
+
+
+def remember_path():
+    """Leave what this connection measured for the next one to SERVER."""
+    metrics = controller.path_metrics(time.time())
+    if metrics:
+        path_cache.put(SERVER, metrics)
+        path_cache.save()
+
+
+def retransmission_timeout(decision):
+    if not decision.avg_rtt:
+        return INITIAL_RTO
+    return max(MIN_RTO, RTO_FACTOR * decision.avg_rtt)
+
+
+def retransmit_lost(udp, rto):
+    """Resend every packet that has gone unacknowledged for longer than rto."""
+    global packets_retransmitted
+    now = time.time()
+    lost = []
+    for key, (sent, data, fin, pn) in pending_acks.items():
+        if now - sent.sent_time < rto:
+            break
+        lost.append((key, sent, data, fin, pn))
+    for (stream_id, offset), sent, data, fin, pn in lost:
+        controller.on_loss(sent, now)
+        if tracer:
+            tracer.packet_lost(now, '1RTT', pn, 'retransmission_timer')
+        send_data(udp, stream_id, offset, data, fin, retransmission=True)
+        packets_retransmitted += 1
+
+
+def send_frames(udp, payload):
+    udp.queue(send_keys.seal(bytes([PACKET_DATA]) + dest_cid, payload), (DEST_IP, UDP_PORT))
+
+
+def on_new_connection_id(udp, sequence, cid, reset_token):
+    """Store a CID the server issued, and move off our own (sequence 0) onto the first."""
+    global dest_cid
+    peer_cids[sequence] = (cid, reset_token)
+    if dest_cid == conn_id:
+        # Only server-issued CIDs come with a reset token we can check
+        dest_cid = cid
+        send_frames(udp, frames.encode_retire_connection_id(0))
+        print(f"[{conn_id.hex()[:8]}] Switched to server CID {cid.hex()[:8]} (seq {sequence})")
+
+
+def is_stateless_reset(payload):
+    token = payload[-frames.RESET_TOKEN_LENGTH:]
+    return any(token == reset_token for _, reset_token in peer_cids.values())
+
+
+def process_acks(udp):
+    global packets_acked, bytes_in_flight
+    for payload, addr in udp.recv():
+        if payload[:9] == bytes([PACKET_0RTT_REJECT]) + conn_id:
+            on_0rtt_rejected(udp)
+            return
+
+        if len(payload) >= 9 + crypto.PN_LENGTH + crypto.TAG_LENGTH and payload[0] == PACKET_DATA:
+            try:
+                decrypted = recv_keys.open(payload, 9)
+            except Exception:
+                # Undecryptable but ending in a token we hold: the server forgot us
+                if is_stateless_reset(payload):
+                    raise ConnectionResetError("stateless reset from server")
+                continue
+
+            pos = 0
+            while pos < len(decrypted):
+                frame_type, frame_data, consumed = frames.decode_frame(decrypted[pos:])
+                if frame_type is None:
+                    break
+                pos += consumed
+
+                if frame_type == frames.FRAME_ACK:
+                    stream_id, largest_acked = frame_data
+                    key = (stream_id, largest_acked)
+                    if key in pending_acks:
+                        sent, data, _, pn = pending_acks.pop(key)
+                        bytes_in_flight -= sent.size
+                        now = time.time()
+                        controller.on_ack(sent, now)
+                        if tracer:
+                            tracer.packet_acked(now, pn)
+                        transfer.on_acked(len(data))
+                        packets_acked += 1
+
+                elif frame_type == frames.FRAME_NEW_SESSION_TICKET:
+                    lifetime, ticket = frame_data
+                    ticket_cache.put(SERVER, ticket, resumption_secret, lifetime)
+                    ticket_cache.save()
+
+                elif frame_type == frames.FRAME_NEW_CONNECTION_ID:
+                    sequence, _, cid, reset_token = frame_data
+                    on_new_connection_id(udp, sequence, cid, reset_token)
+
+                elif frame_type == frames.FRAME_PATH_CHALLENGE:
+                    send_frames(udp, frames.encode_path_response(frame_data))
+
+                else:
+                    send_flow.on_frame(frame_type, frame_data)
 
 
 def print_stats():
     print(f"\n{'='*40}")
-    print(f"Packets sent: {packets_sent}")
-    print(f"Packets acked: {len(controller.rtt_samples)}")
-    print(f"Final cwnd: {controller.cwnd}")
+    print(f"Packets sent: {packets_sent} ({packets_retransmitted} retransmitted)")
+    print(f"Packets acked: {packets_acked}")
+    if transfer:
+        print(f"Bytes acked: {transfer.acked:,} ({transfer.average_throughput() * 8 / 1e6:.1f} Mbit/s)")
+    print(f"Final cwnd: {int(controller.cwnd)}")
     if controller.rtprop:
         print(f"RTprop: {controller.rtprop*1000:.1f}ms")
     print(f"{'='*40}")
 
 
-def main():
-    global aes_key, last_send_time
+def print_progress(acked, total):
+    if total:
+        print(f"[Progress] {acked / 1e6:.1f} / {total / 1e6:.1f} MB ({acked / total:.0%})")
+    else:
+        print(f"[Progress] {acked / 1e6:.1f} MB")
 
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
-    print(f"\nSending to {DEST_IP}:{UDP_PORT}")
-    print("Press Ctrl+C to stop\n")
+def print_throughput(rate):
+    print(f"[Throughput] {rate * 8 / 1e6:.1f} Mbit/s")
+
 
-    MSG_SIZE = 1000
-    message = "X" * MSG_SIZE
-    offset = 0
+def send(source, on_progress=None, on_throughput=None):
+    """
+    Send source on STREAM_ID: a path, file object, file-like object or
+    buffer (see bulk.open_source). Returns the Transfer once every byte is
+    acknowledged; a source with no end runs until interrupted.
+    """
+    global send_keys, recv_keys, transfer
 
-    if os.path.exists(SERVER_CACHE_FILE):
-        aes_key, my_public = do_0rtt(sock)
+    transfer = bulk.Transfer(bulk.open_source(source), on_progress, on_throughput)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    # Start from the last connection's rate, before 0-RTT data goes out
+    metrics = path_cache.get(SERVER)
+    if metrics:
+        controller.warm_start(metrics, time.time())
+        print(f"[Path] Warm start: RTprop {metrics.rtprop*1000:.1f}ms, "
+              f"BtlBw {metrics.btlbw*8/1e6:.1f} Mbit/s, cwnd {metrics.cwnd}")
+
+    ticket = ticket_cache.take(SERVER)
+    ticket_cache.save()
+    if ticket:
+        (send_keys, recv_keys), resumption = do_0rtt(ticket)
         sock.setblocking(False)
-        send_0rtt_data(sock, my_public, stream_id=1, offset=0, data="init")
-        offset = 4
+        udp = udp_io.BatchSocket(sock)
+        offset, data, fin = transfer.next_chunk(stream_room(STREAM_ID, 0))
+        send_0rtt_data(udp, resumption, STREAM_ID, offset, data, fin)
+        send_flow.consume(STREAM_ID, len(data))
     else:
-        aes_key = do_handshake(sock)
+        send_keys, recv_keys = do_handshake(sock)
         sock.setblocking(False)
+        udp = udp_io.BatchSocket(sock)
 
     last_decision = None
+    last_blocked = 0.0
+    bucket = pacer.TokenBucket(burst=pacer.MAX_BURST_PACKETS * MAX_DATAGRAM)
 
-    while True:
-        now = time.time()
-        decision = controller.update(now)
-
-        if len(pending_acks) < decision.cwnd:
-            if now - last_send_time >= decision.pacing_interval:
-                send_data(sock, stream_id=1, offset=offset, data=message)
-                offset += len(message)
-                last_send_time = now
+    def window_open():
+        return (not transfer.exhausted and len(pending_acks) < decision.cwnd and
+                send_flow.credit(STREAM_ID) > 0)
 
-        process_acks(sock)
+    while True:
+        decision = controller.update(time.time())
+        bucket.set_rate(decision.pacing_rate or None)
+        rto = retransmission_timeout(decision)
+        retransmit_lost(udp, rto)
+
+        # Release whatever the window and the pacing budget allow, one small burst
+        starved = False
+        while window_open() and bucket.take(MAX_DATAGRAM):
+            room = min(stream_room(STREAM_ID, transfer.offset), send_flow.credit(STREAM_ID))
+            offset, data, fin = transfer.next_chunk(room)
+            if not data and not fin:
+                starved = True  # reader has nothing for us yet
+                bucket.refund(MAX_DATAGRAM)
+                break
+            send_data(udp, STREAM_ID, offset, data, fin)
+            send_flow.consume(STREAM_ID, len(data))
+
+        # Out of credit: the server's window update may have been lost, so
+        # tell it where we're stuck, once per RTO
+        if not transfer.exhausted and send_flow.credit(STREAM_ID) == 0 and \
+           time.time() - last_blocked >= rto:
+            send_frames(udp, send_flow.blocked_frames([STREAM_ID]))
+            last_blocked = time.time()
+
+        # Room in the window but nothing to fill it with: delivery rates from
+        # here on measure us, not the path
+        if starved or (len(pending_acks) < decision.cwnd and not window_open()):
+            controller.on_app_limited(bytes_in_flight)
+
+        udp.flush()
+        if transfer.exhausted and not pending_acks:
+            remember_path()
+            return transfer
+
+        # Sleep until the next burst is due, or until an ACK arrives
+        if window_open():
+            deadline = pacer.now_ns() + bucket.wake_delay_ns(MAX_DATAGRAM)
+        else:
+            deadline = pacer.now_ns() + int(min(ACK_WAIT, rto) * 1e9)
+        pacer.wait(sock, deadline)
+        process_acks(udp)
+        transfer.poll()
 
         if decision.rtprop_reset:
             print(f"  → RTprop reset to {decision.rtprop*1000:.1f}ms")
@@ -174,8 +378,40 @@ def main():
             last_decision = decision
 
 
+def main():
+    global controller, tracer
+    args = sys.argv[1:]
+    while args[:1] in (['--cc'], ['--qlog']):
+        if args[0] == '--cc':
+            controller = bbr.create(args[1])
+        else:
+            tracer = qlog.QlogWriter(args[1], title=f'sender.py {SERVER}')
+        args = args[2:]
+    # Controller events too: window, pacing, RTT and state changes
+    controller.tracer = tracer
+
+    # A path, "-" for stdin, or nothing for an endless stream of "X"
+    if args:
+        source = sys.stdin.buffer if args[0] == '-' else args[0]
+    else:
+        source = bulk.RepeatSource(b'X')
+
+    print(f"\nSending to {DEST_IP}:{UDP_PORT} ({type(controller).__name__})")
+    print("Press Ctrl+C to stop\n")
+
+    send(source, print_progress, print_throughput)
+    print_stats()
+
+
 if __name__ == '__main__':
     try:
         main()
     except KeyboardInterrupt:
+        remember_path()
+        print_stats()
+    except ConnectionResetError as e:
+        print(f"\nConnection closed: {e}")
         print_stats()
+    finally:
+        if tracer:
+            tracer.close()
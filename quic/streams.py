@@ -0,0 +1,438 @@
+"""
+QUIC stream buffers and flow control (RFC 9000, Sections 2.2 and 4).
+
+Receive side: STREAM frames can arrive out of order, duplicated or
+overlapping. Each RecvStream holds frames past a gap in a ReorderBuffer
+(reorder.py) and moves them to its read buffer once the gap fills, so
+the application only ever reads contiguous data.
+
+Flow control: the receiver tells the peer how far it may send (MAX_DATA
+for the whole connection, MAX_STREAM_DATA per stream). The limit slides
+forward as the application reads, so buffered data is bounded by the
+window. If the window is used up in under two round trips, it doubles
+(up to a cap) so a fast, far-away sender is never starved. Window
+updates are not acknowledged, so a lost one would leave the sender
+waiting for good: a sender out of credit says so with DATA_BLOCKED /
+STREAM_DATA_BLOCKED, repeated on its retransmission timer, and the
+receiver answers with its current limits.
+
+Send side: SendStreams queues outgoing bytes and never hands out more
+than the peer's limits allow. next_packet() fills a packet from many
+streams at once, in the order the StreamScheduler picks (scheduler.py).
+A sender without loss recovery of its own passes next_packet() the send
+time; each range then stays buffered until on_ack(), and ranges
+declared lost (an ACK for a later one 9/8 RTT on, or detect_lost() on a
+probe timeout) go out again ahead of new data.
+"""
+
+from collections import deque
+
+import frames
+import varint
+from reorder import ReorderBuffer
+from scheduler import StreamScheduler
+
+INITIAL_MAX_STREAM_DATA = 256 * 1024
+INITIAL_MAX_DATA = 1024 * 1024
+MAX_STREAM_WINDOW = 16 * 1024 * 1024
+MAX_CONNECTION_WINDOW = 24 * 1024 * 1024
+INITIAL_RTT = 0.333
+TIME_THRESHOLD = 9 / 8
+
+
+class FlowControlError(Exception):
+    """Peer sent data beyond an advertised limit or final size."""
+
+
+class FlowWindow:
+    """Receive credit for a stream or a whole connection."""
+
+    def __init__(self, window: int, max_window: int):
+        self.window = window
+        self.max_window = max_window
+        self.limit = window
+        self.consumed = 0
+        self.last_update_time = None
+
+    def check(self, offset: int):
+        if offset > self.limit:
+            raise FlowControlError(f"offset {offset} exceeds limit {self.limit}")
+
+    def update(self, now: float, rtt: float):
+        """Return a new limit once half the window is consumed, else None."""
+        if self.limit - self.consumed > self.window // 2:
+            return None
+
+        # Window drained within 2 RTTs: it is what limits the sender, grow it
+        if self.last_update_time is not None and now - self.last_update_time < 2 * rtt:
+            self.window = min(self.window * 2, self.max_window)
+
+        self.last_update_time = now
+        self.limit = self.consumed + self.window
+        return self.limit
+
+
+class RecvStream:
+    """Reassembles one stream's data by offset."""
+
+    def __init__(self, stream_id: int, window: int = INITIAL_MAX_STREAM_DATA, connection: FlowWindow = None):
+        self.stream_id = stream_id
+        self.flow = FlowWindow(window, MAX_STREAM_WINDOW)
+        self.connection = connection
+        # Frames past a gap wait in the reorder heap; contiguous bytes not
+        # yet read by the application sit in buffer
+        self.reorder = ReorderBuffer(MAX_STREAM_WINDOW, size=len)
+        self.buffer = bytearray()
+        self.read_offset = 0
+        self.highest = 0
+        self.final_size = None
+
+    def on_data(self, offset: int, data: bytes, fin: bool = False) -> bool:
+        """Take a frame's data. False if the reorder buffer can't hold it: don't acknowledge it."""
+        end = offset + len(data)
+
+        if self.final_size is not None and end > self.final_size:
+            raise FlowControlError(f"stream {self.stream_id}: data beyond final size {self.final_size}")
+        if fin:
+            if end < self.highest or (self.final_size is not None and end != self.final_size):
+                raise FlowControlError(f"stream {self.stream_id}: final size changed")
+        self.flow.check(end)
+
+        # Beyond capacity only with piles of overlapping retransmissions:
+        # refused and left unacknowledged, so the peer sends it again
+        if not self.reorder.push(offset, data):
+            return False
+        if fin:
+            self.final_size = end
+        self.highest = max(self.highest, end)
+
+        for chunk in self.reorder.pop():
+            self.buffer += chunk
+        return True
+
+    @property
+    def readable(self) -> int:
+        """Number of contiguous bytes ready to read."""
+        return len(self.buffer)
+
+    @property
+    def complete(self) -> bool:
+        """Every byte up to the final size has arrived."""
+        return self.final_size is not None and self.read_offset + self.readable == self.final_size
+
+    @property
+    def at_eof(self) -> bool:
+        """Every byte up to the final size has been read."""
+        return self.final_size is not None and self.read_offset == self.final_size
+
+    def read(self, n: int = -1) -> bytes:
+        available = self.readable
+        if n < 0 or n > available:
+            n = available
+        if n == 0:
+            return b''
+
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        self.read_offset += n
+
+        self.flow.consumed += n
+        if self.connection:
+            self.connection.consumed += n
+        return data
+
+
+class ReceiveStreams:
+    """All receive streams of one connection, plus connection-level credit."""
+
+    def __init__(self, stream_window: int = INITIAL_MAX_STREAM_DATA, connection_window: int = INITIAL_MAX_DATA):
+        self.stream_window = stream_window
+        self.flow = FlowWindow(connection_window, MAX_CONNECTION_WINDOW)
+        self.streams = {}
+        self.received = 0
+        self.rtt = INITIAL_RTT
+        self.rtt_measured = False
+        self.read_streams = set()
+
+    def get(self, stream_id: int) -> RecvStream:
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            stream = RecvStream(stream_id, self.stream_window, self.flow)
+            self.streams[stream_id] = stream
+        return stream
+
+    def on_stream_frame(self, stream_id: int, offset: int, data: bytes, fin: bool = False) -> RecvStream:
+        """The frame's stream, or None if it was refused and must not be acknowledged."""
+        stream = self.get(stream_id)
+
+        grown = max(0, offset + len(data) - stream.highest)
+        self.flow.check(self.received + grown)
+        if not stream.on_data(offset, data, fin):
+            return None
+        self.received += grown
+
+        return stream
+
+    def read(self, stream_id: int, n: int = -1) -> bytes:
+        data = self.get(stream_id).read(n)
+        if data:
+            self.read_streams.add(stream_id)
+        return data
+
+    def on_rtt(self, rtt: float, reset: bool = False):
+        """
+        An RTT sample, for endpoints that keep no smoothed RTT of their own.
+        reset: the sample is from a new path, forget the old estimate.
+        """
+        if reset or not self.rtt_measured:
+            self.rtt = rtt
+        else:
+            self.rtt = 0.875 * self.rtt + 0.125 * rtt
+        self.rtt_measured = True
+
+    def on_blocked(self, frame_type: int, frame_data) -> bytes:
+        """
+        Answer a DATA_BLOCKED / STREAM_DATA_BLOCKED frame with the current
+        limit, if it is past the one the peer is stuck at. Returns the
+        frames to send, b'' for any other frame type.
+        """
+        if frame_type == frames.FRAME_DATA_BLOCKED:
+            if self.flow.limit > frame_data:
+                return frames.encode_max_data(self.flow.limit)
+        elif frame_type == frames.FRAME_STREAM_DATA_BLOCKED:
+            stream_id, limit = frame_data
+            stream = self.streams.get(stream_id)
+            if stream is not None and stream.flow.limit > limit:
+                return frames.encode_max_stream_data(stream_id, stream.flow.limit)
+        return b''
+
+    def pending_updates(self, now: float) -> bytes:
+        """MAX_STREAM_DATA / MAX_DATA frames for windows that need to slide."""
+        updates = b''
+        for stream_id in self.read_streams:
+            stream = self.streams[stream_id]
+            if stream.final_size is not None:
+                continue
+            limit = stream.flow.update(now, self.rtt)
+            if limit is not None:
+                updates += frames.encode_max_stream_data(stream_id, limit)
+        self.read_streams.clear()
+
+        limit = self.flow.update(now, self.rtt)
+        if limit is not None:
+            updates += frames.encode_max_data(limit)
+        return updates
+
+
+class SendStream:
+    """Queued outgoing bytes for one stream and the peer's limit on it."""
+
+    def __init__(self, stream_id: int, max_stream_data: int = INITIAL_MAX_STREAM_DATA):
+        self.stream_id = stream_id
+        self.max_stream_data = max_stream_data
+        self.offset = 0
+        self.pending = bytearray()
+        self.fin_pending = False
+        self.fin_sent = False
+        self.unacked = {}     # offset -> (data, fin, send time) in send order, if tracked
+        self.lost = deque()   # (offset, data, fin) to send again, before new data
+
+    def write(self, data: bytes, fin: bool = False):
+        self.pending += data
+        self.fin_pending = self.fin_pending or fin
+
+    @property
+    def credit(self) -> int:
+        return self.max_stream_data - self.offset
+
+    @property
+    def has_data(self) -> bool:
+        return bool(self.pending) or bool(self.lost) or (self.fin_pending and not self.fin_sent)
+
+    @property
+    def done(self) -> bool:
+        """FIN sent and every byte acknowledged (or never tracked)."""
+        return self.fin_sent and not self.pending and not self.lost and not self.unacked
+
+
+class SendStreams:
+    """All send streams of one connection, plus the peer's MAX_DATA."""
+
+    def __init__(self, max_data: int = INITIAL_MAX_DATA, max_stream_data: int = INITIAL_MAX_STREAM_DATA):
+        self.max_data = max_data
+        self.initial_max_stream_data = max_stream_data
+        self.sent = 0
+        self.in_flight = 0   # bytes of tracked ranges not yet acknowledged or lost
+        self.streams = {}
+        self.scheduler = StreamScheduler()
+
+    def get(self, stream_id: int) -> SendStream:
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            stream = SendStream(stream_id, self.initial_max_stream_data)
+            self.streams[stream_id] = stream
+        return stream
+
+    def write(self, stream_id: int, data: bytes, fin: bool = False):
+        stream = self.get(stream_id)
+        stream.write(data, fin)
+        if stream.has_data:
+            self.scheduler.push(stream_id)
+
+    def set_priority(self, stream_id: int, urgency: int, incremental: bool = False, weight: int = 1):
+        """RFC 9218 urgency (0 = most urgent) and incremental flag, see scheduler.py."""
+        self.scheduler.set_priority(stream_id, urgency, incremental, weight)
+
+    def credit(self, stream_id: int) -> int:
+        """Bytes that may be sent on stream_id right now."""
+        return max(0, min(self.get(stream_id).credit, self.max_data - self.sent))
+
+    def consume(self, stream_id: int, n: int) -> int:
+        """Account for n bytes sent on stream_id, returning their offset."""
+        stream = self.get(stream_id)
+        offset = stream.offset
+        stream.offset += n
+        self.sent += n
+        return offset
+
+    def blocked_frames(self, stream_ids=None) -> bytes:
+        """
+        DATA_BLOCKED / STREAM_DATA_BLOCKED for the streams in stream_ids
+        (default: every stream with queued bytes) that a peer limit holds
+        back. b'' if none is blocked.
+        """
+        if stream_ids is None:
+            stream_ids = [stream_id for stream_id, stream in self.streams.items() if stream.pending]
+        payload = b''
+        for stream_id in stream_ids:
+            stream = self.get(stream_id)
+            if stream.credit <= 0:
+                payload += frames.encode_stream_data_blocked(stream_id, stream.max_stream_data)
+        if stream_ids and self.sent >= self.max_data:
+            payload += frames.encode_data_blocked(self.max_data)
+        return payload
+
+    def on_ack(self, stream_id: int, offset: int, now: float, rtt: float):
+        """
+        Release an acknowledged range. Ranges of the stream sent before it
+        and still unacknowledged TIME_THRESHOLD RTTs on are lost (RFC 9002,
+        Section 6.1.2) and requeued. Returns the range's send time, None if
+        it wasn't outstanding.
+        """
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            return None
+        entry = stream.unacked.pop(offset, None)
+        if entry is None:
+            if stream.lost:
+                # Declared lost too early: no need to send it again
+                stream.lost = deque(item for item in stream.lost if item[0] != offset)
+            return None
+        self.in_flight -= len(entry[0])
+        sent_time = entry[2]
+        cutoff = min(sent_time, now - TIME_THRESHOLD * rtt)
+        self._requeue(stream_id, [lost_offset for lost_offset, (_, _, sent) in stream.unacked.items()
+                                  if lost_offset < offset and sent <= cutoff])
+        if stream.done:
+            self.scheduler.forget(stream_id)
+        return sent_time
+
+    def detect_lost(self, now: float, timeout: float) -> int:
+        """Requeue every range unacknowledged for timeout seconds, return how many."""
+        count = 0
+        for stream_id, stream in self.streams.items():
+            lost = []
+            for offset, (_, _, sent) in stream.unacked.items():
+                if now - sent < timeout:
+                    break   # the rest were sent later
+                lost.append(offset)
+            self._requeue(stream_id, lost)
+            count += len(lost)
+        return count
+
+    def oldest_unacked(self):
+        """Send time of the oldest unacknowledged range, None if there is none."""
+        return min((next(iter(stream.unacked.values()))[2] for stream in self.streams.values()
+                    if stream.unacked), default=None)
+
+    def _requeue(self, stream_id: int, offsets):
+        if not offsets:
+            return
+        stream = self.streams[stream_id]
+        for offset in sorted(offsets):
+            data, fin, _ = stream.unacked.pop(offset)
+            self.in_flight -= len(data)
+            stream.lost.append((offset, data, fin))
+        self.scheduler.push(stream_id)
+
+    def next_frame(self, stream_id: int, max_len: int):
+        """Take up to max_len queued bytes, return (offset, data, fin) or None."""
+        stream = self.get(stream_id)
+        if not stream.has_data:
+            return None
+
+        # Lost ranges first: their credit is already spent
+        if stream.lost:
+            offset, data, fin = stream.lost.popleft()
+            if len(data) > max_len:
+                stream.lost.appendleft((offset + max_len, data[max_len:], fin))
+                data, fin = data[:max_len], False
+            return offset, data, fin
+
+        n = min(max_len, len(stream.pending), self.credit(stream_id))
+        if n == 0 and stream.pending:
+            return None
+
+        data = bytes(stream.pending[:n])
+        del stream.pending[:n]
+        offset = self.consume(stream_id, n)
+
+        fin = stream.fin_pending and not stream.pending
+        stream.fin_sent = stream.fin_sent or fin
+        return offset, data, fin
+
+    def next_packet(self, room: int, now: float = None):
+        """
+        STREAM frame contents filling up to `room` bytes of one packet,
+        highest priority first: a list of (stream_id, offset, data, fin).
+        With now, the ranges are kept until on_ack() (see module docstring).
+        """
+        chunks = []
+        finished = []
+
+        def send(stream_id, limit):
+            stream = self.streams.get(stream_id)
+            if stream is None or not stream.has_data:
+                return 0, False
+            header = (1 + len(varint.encode(stream_id)) + len(varint.encode(stream.offset)) +
+                      len(varint.encode(limit)))
+            if limit <= header:
+                return 0, True
+            chunk = self.next_frame(stream_id, limit - header)
+            if chunk is None:
+                return 0, True
+            chunks.append((stream_id, *chunk))
+            if now is not None:
+                offset, data, fin = chunk
+                stream.unacked[offset] = (data, fin, now)
+                self.in_flight += len(data)
+            if stream.done:
+                finished.append(stream_id)
+            return header + len(chunk[1]), stream.has_data
+
+        self.scheduler.fill(room, send)
+        for stream_id in finished:
+            self.scheduler.forget(stream_id)
+        return chunks
+
+    def on_frame(self, frame_type: int, frame_data) -> bool:
+        """Apply a MAX_DATA / MAX_STREAM_DATA frame. Returns True if handled."""
+        if frame_type == frames.FRAME_MAX_DATA:
+            self.max_data = max(self.max_data, frame_data)
+            return True
+        if frame_type == frames.FRAME_MAX_STREAM_DATA:
+            stream_id, maximum = frame_data
+            stream = self.get(stream_id)
+            stream.max_stream_data = max(stream.max_stream_data, maximum)
+            return True
+        return False
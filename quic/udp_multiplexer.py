@@ -1,5 +1,7 @@
 import os
+import select
 import sys
+import time
 sys.path.insert(0, '../tcp_ip_stack')
 
 from stack import TunDevice
@@ -8,35 +10,60 @@ import protocols
 import crypto
 import varint
 import frames
+import streams
+import tickets
+import connection_ids
+from handshake_pool import HandshakePool
+from workers import Dispatcher, peek_connection_id
 
 UDP_PORT = 9000
-SERVER_KEY_FILE = 'server_key.bin'
-
-
-def load_or_generate_server_key():
-    """Load server's long-term DH private key, or generate if first run."""
-    if os.path.exists(SERVER_KEY_FILE):
-        with open(SERVER_KEY_FILE, 'rb') as f:
-            private = int.from_bytes(f.read(), 'big')
-            print(f"[Server] Loaded existing keypair from {SERVER_KEY_FILE}")
+SERVER_KEY_FILES = {
+    crypto.KEX_MODP2048: 'server_key.bin',
+    crypto.KEX_X25519: 'server_x25519_key.bin',
+}
+TICKET_KEY_FILE = 'server_ticket_key.bin'
+RESET_KEY_FILE = 'server_reset_key.bin'
+
+
+def load_or_generate_server_key(group):
+    """Load server's long-term private key for a group, or generate if first run."""
+    path = SERVER_KEY_FILES[group]
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            private = crypto.private_key_from_bytes(group, f.read())
+            print(f"[Server] Loaded existing keypair from {path}")
             return private
     else:
-        private = crypto.generate_private_key()
-        with open(SERVER_KEY_FILE, 'wb') as f:
-            f.write(private.to_bytes(32, 'big'))
-        print(f"[Server] Generated new keypair, saved to {SERVER_KEY_FILE}")
+        private, _ = crypto.generate_keypair(group)
+        with open(path, 'wb') as f:
+            f.write(crypto.private_key_to_bytes(group, private))
+        print(f"[Server] Generated new keypair, saved to {path}")
         return private
 
+def load_or_generate_secret(path):
+    """
+    Symmetric server key (ticket sealing, stateless reset tokens). Persisted
+    so tickets and reset tokens stay valid across a restart.
+    """
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    key = os.urandom(32)
+    with open(path, 'wb') as f:
+        f.write(key)
+    return key
+
+
 PACKET_DATA = 0x01
 PACKET_ACK = 0x02
 PACKET_INIT = 0x03
 PACKET_ACCEPT = 0x04
 PACKET_0RTT = 0x05
+PACKET_0RTT_REJECT = 0x06
 
-stream_next_deliver = {1: 1, 2: 1, 3: 1}
-stream_pending = {1: [], 2: [], 3: []}
-delayed_messages = []
-connections = {}
+connections = None
+ticket_issuer = None
+replay_filter = tickets.ReplayFilter()
 
 
 def send_udp(tun, src_ip, src_port, dest_ip, dest_port, payload):
@@ -66,125 +93,310 @@ def send_udp(tun, src_ip, src_port, dest_ip, dest_port, payload):
     tun.write(ip_bytes + udp_bytes)
 
 
+def send_frames(tun, server_ip, conn, payload, addr=None):
+    packet = conn['send_keys'].seal(bytes([PACKET_DATA]) + conn['conn_id'], payload)
+    send_udp(tun, server_ip, UDP_PORT, *(addr or conn['last_addr']), packet)
+
+
+def sample_rtt(conn, key, reset=False):
+    """Feed the time since conn[key] was stamped to flow control's RTT, once."""
+    sent_time = conn.pop(key, None)
+    if sent_time is not None:
+        conn['streams'].on_rtt(time.time() - sent_time, reset)
+
+
+def process_frames(tun, server_ip, conn, decrypted, client_addr, tag=''):
+    conn_id = conn['conn_id']
+    pos = 0
+    while pos < len(decrypted):
+        frame_type, frame_data, consumed = frames.decode_frame(decrypted[pos:])
+        if frame_type is None:
+            break
+        pos += consumed
+
+        if frame_type == frames.FRAME_STREAM:
+            stream_id, offset, data_bytes, fin = frame_data
+            try:
+                stream = conn['streams'].on_stream_frame(stream_id, offset, data_bytes, fin)
+            except streams.FlowControlError as e:
+                print(f"[{conn_id.hex()[:8]}] {tag}Flow control error: {e}")
+                continue
+            if stream is None:
+                continue  # no room to buffer it, unacknowledged the sender resends
+            data = conn['streams'].read(stream_id).decode('utf-8', errors='replace')
+            if data:
+                print(f"[{conn_id.hex()[:8]}] {tag}[Stream {stream_id}] (offset {offset}) DATA: {data}")
+
+            ack_frame = frames.encode_ack(stream_id, offset) + conn['streams'].pending_updates(time.time())
+            send_frames(tun, server_ip, conn, ack_frame)
+            print(f"[{conn_id.hex()[:8]}] {tag}[Stream {stream_id}] (offset {offset}) ACK sent")
+
+        elif frame_type in (frames.FRAME_DATA_BLOCKED, frames.FRAME_STREAM_DATA_BLOCKED):
+            # A window update of ours was lost: repeat the current limits
+            limits = conn['streams'].on_blocked(frame_type, frame_data)
+            if limits:
+                send_frames(tun, server_ip, conn, limits)
+
+        elif frame_type == frames.FRAME_RETIRE_CONNECTION_ID:
+            # Clients retire their own CID as soon as ours arrive
+            sample_rtt(conn, 'cids_sent')
+            replacement = connections.retire(conn, frame_data)
+            if replacement:
+                send_frames(tun, server_ip, conn, replacement)
+            print(f"[{conn_id.hex()[:8]}] CID {frame_data} retired")
+
+        elif frame_type == frames.FRAME_PATH_CHALLENGE:
+            send_frames(tun, server_ip, conn, frames.encode_path_response(frame_data), client_addr)
+
+        elif frame_type == frames.FRAME_PATH_RESPONSE:
+            if connections.on_path_response(conn, frame_data, client_addr):
+                sample_rtt(conn, 'challenge_sent', reset=True)
+                print(f"[{conn_id.hex()[:8]}] Path validated, migrated to {client_addr}")
+
+
+def handle_packet(tun, pool, server_ip, client_addr, payload):
+    if len(payload) < 1:
+        return
+
+    packet_type = payload[0]
+
+    if packet_type == PACKET_INIT:
+        conn_id = payload[1:9]
+        try:
+            group, their_public, _ = crypto.decode_key_share(payload[9:])
+        except ValueError:
+            return
+        print(f"[{conn_id.hex()[:8]}] INIT received")
+
+        conn = connections.lookup(conn_id)
+        if conn is not None:
+            # Our ACCEPT was lost: repeat it, keys and packet numbers stay
+            send_udp(tun, server_ip, UDP_PORT, *client_addr, conn['accept'])
+            print(f"[{conn_id.hex()[:8]}] Duplicate INIT, ACCEPT resent")
+            return
+
+        state = {'client_addr': client_addr, 'server_ip': server_ip}
+        if pool.start(conn_id, group, their_public, state):
+            print(f"[{conn_id.hex()[:8]}] Key agreement queued")
+
+    elif packet_type == PACKET_DATA:
+        if len(payload) < 9 + crypto.PN_LENGTH + crypto.TAG_LENGTH:
+            return
+        conn_id = payload[1:9]
+
+        conn = connections.lookup(conn_id)
+        if conn is None:
+            if pool.buffer(conn_id, (server_ip, client_addr, payload)):
+                print(f"[{conn_id.hex()[:8]}] Keys pending, buffering")
+                return
+            reset = connections.stateless_reset(conn_id, len(payload))
+            if reset:
+                send_udp(tun, server_ip, UDP_PORT, *client_addr, reset)
+                print(f"[{conn_id.hex()[:8]}] Unknown connection, stateless reset sent")
+            else:
+                print(f"[{conn_id.hex()[:8]}] Unknown connection, dropping")
+            return
+
+        try:
+            decrypted = conn['recv_keys'].open(payload, 9)
+        except Exception:
+            return
+        connections.touch(conn)
+
+        # A new address only becomes the connection's path once it answers
+        challenge = connections.challenge_path(conn, client_addr)
+        if challenge:
+            send_frames(tun, server_ip, conn, challenge, client_addr)
+            conn['challenge_sent'] = time.time()
+            print(f"[{conn['conn_id'].hex()[:8]}] Packet from new address {client_addr}, challenging")
+
+        process_frames(tun, server_ip, conn, decrypted, client_addr)
+
+    elif packet_type == PACKET_ACK:
+        stream_id = payload[1]
+        seq = int.from_bytes(payload[2:4], 'big')
+        print(f"[Stream {stream_id}] (seq {seq}) ACK received")
+
+    elif packet_type == PACKET_0RTT:
+        conn_id = payload[1:9]
+        try:
+            client_random, ticket_age, ticket, consumed = tickets.decode_resumption(payload[9:])
+        except ValueError:
+            return
+        prefix_length = 9 + consumed
+        if len(payload) < prefix_length + crypto.PN_LENGTH + crypto.TAG_LENGTH:
+            return
+
+        conn = connections.lookup(conn_id)
+        if conn is None:
+            # Resumption: only symmetric crypto, so no need for the pool
+            resumption_secret = ticket_issuer.redeem(ticket, ticket_age)
+            if resumption_secret is None:
+                reject_0rtt(tun, server_ip, client_addr, conn_id, "ticket invalid or stale")
+                return
+
+            shared_secret = resumption_secret + client_random
+            send_keys, recv_keys = crypto.derive_packet_protection(shared_secret, is_client=False)
+            try:
+                decrypted = recv_keys.open(payload, prefix_length)
+            except Exception:
+                return
+            # Only authentic packets reach the filter, so garbage can't fill it
+            if not replay_filter.add(client_random):
+                reject_0rtt(tun, server_ip, client_addr, conn_id, "replayed")
+                return
+
+            conn = new_connection(tun, server_ip, conn_id, client_addr, send_keys, recv_keys, shared_secret)
+            print(f"[{conn_id.hex()[:8]}] [0-RTT] Connection resumed from ticket")
+        else:
+            try:
+                decrypted = conn['recv_keys'].open(payload, prefix_length)
+            except Exception:
+                return
+            connections.touch(conn)
+        process_frames(tun, server_ip, conn, decrypted, client_addr, '[0-RTT] ')
+
+
+def reject_0rtt(tun, server_ip, client_addr, conn_id, reason):
+    """Tell the client to fall back to a full handshake."""
+    print(f"[{conn_id.hex()[:8]}] [0-RTT] Rejected: {reason}")
+    send_udp(tun, server_ip, UDP_PORT, *client_addr, bytes([PACKET_0RTT_REJECT]) + conn_id)
+
+
+def new_connection(tun, server_ip, conn_id, client_addr, send_keys, recv_keys, shared_secret):
+    conn = {
+        'send_keys': send_keys,
+        'recv_keys': recv_keys,
+        'last_addr': client_addr,
+        'streams': streams.ReceiveStreams()
+    }
+    connections.add(conn_id, conn)
+
+    # Spare connection IDs for migration, and a ticket for the next connection
+    ticket = ticket_issuer.issue(crypto.derive_resumption_secret(shared_secret))
+    payload = connections.issue(conn) + frames.encode_new_session_ticket(ticket_issuer.lifetime, ticket)
+    send_frames(tun, server_ip, conn, payload)
+    conn['cids_sent'] = time.time()
+    return conn
+
+
+def on_handshake_complete(tun, pool, server_keys, handshake, shared_secret):
+    conn_id = handshake.conn_id
+    state = handshake.state
+    if shared_secret is None:
+        print(f"[{conn_id.hex()[:8]}] Key agreement failed, dropping")
+        return
+
+    _, server_public = server_keys[handshake.group]
+    server_random = os.urandom(crypto.SERVER_RANDOM_LENGTH)
+    accept_payload = bytes([PACKET_ACCEPT]) + conn_id + \
+        crypto.encode_server_share(handshake.group, server_public, server_random)
+    send_udp(tun, state['server_ip'], UDP_PORT, *state['client_addr'], accept_payload)
+    print(f"[{conn_id.hex()[:8]}] ACCEPT sent\n")
+
+    shared_secret = crypto.handshake_secret(shared_secret, server_random)
+    send_keys, recv_keys = crypto.derive_packet_protection(shared_secret, is_client=False)
+    conn = new_connection(tun, state['server_ip'], conn_id, state['client_addr'], send_keys, recv_keys,
+                          shared_secret)
+    conn['accept'] = accept_payload
+    print(f"[{conn_id.hex()[:8]}] Connection stored (key derived)")
+
+    for server_ip, client_addr, payload in handshake.early_packets:
+        handle_packet(tun, pool, server_ip, client_addr, payload)
+
+
+def handle_ip_packet(tun, pool, packet_bytes):
+    ip_header = IPHeader.from_bytes(packet_bytes)
+    if ip_header.protocol != protocols.PROTO_UDP:
+        return
+
+    udp_bytes = packet_bytes[ip_header.ihl * 4:]
+    udp_header = UDPHeader.from_bytes(udp_bytes)
+
+    if udp_header.dest_port == UDP_PORT:
+        client_addr = (ip_header.src_ip, udp_header.src_port)
+        handle_packet(tun, pool, ip_header.dest_ip, client_addr, udp_header.payload)
+
+
+def serve(tun, server_keys, reset_key, inbox=None):
+    """Packet loop. Reads the tun device, or a worker's inbox in multi-worker mode."""
+    global connections
+
+    # Key agreement runs in worker processes, never in the packet loop
+    pool = HandshakePool({group: private for group, (private, _) in server_keys.items()})
+    if inbox is None:
+        connections = connection_ids.ConnectionIDManager(reset_key)
+        source = tun.sock
+    else:
+        # Issue CIDs that route back to this worker
+        connections = connection_ids.ConnectionIDManager(reset_key, worker_index=inbox.index,
+                                                         workers=inbox.workers)
+        source = inbox
+
+    try:
+        while True:
+            readable, _, _ = select.select([source, pool], [], [], 1.0)
+
+            for conn in connections.evict_idle():
+                print(f"[{conn['conn_id'].hex()[:8]}] Idle, evicted ({len(connections)} connections left)")
+
+            for handshake, shared_secret in pool.completed():
+                on_handshake_complete(tun, pool, server_keys, handshake, shared_secret)
+
+            if source not in readable:
+                continue
+
+            packets = inbox.get() if inbox is not None else [tun.read()]
+            for packet_bytes in packets:
+                if packet_bytes:
+                    handle_ip_packet(tun, pool, packet_bytes)
+    finally:
+        pool.close()
+
+
+def run(tun, server_keys, reset_key, workers=1):
+    if workers <= 1:
+        serve(tun, server_keys, reset_key)
+        return
+
+    # Front-end: route each packet to the worker that owns its connection ID
+    dispatcher = Dispatcher(workers, serve, (tun, server_keys, reset_key))
+    try:
+        while True:
+            packet_bytes = tun.read()
+            if not packet_bytes:
+                continue
+            cid = peek_connection_id(packet_bytes, UDP_PORT)
+            if cid is not None:
+                dispatcher.dispatch(cid, packet_bytes)
+    finally:
+        dispatcher.close()
+
+
 def main():
-    server_private = load_or_generate_server_key()
-    server_public = crypto.compute_public_key(server_private)
+    global ticket_issuer
+
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+
+    server_keys = {}
+    for group in SERVER_KEY_FILES:
+        private = load_or_generate_server_key(group)
+        server_keys[group] = (private, crypto.public_key_bytes(group, private))
+
+    # Loaded before the workers fork, so every worker can open every ticket
+    # and sends the same stateless reset tokens
+    ticket_issuer = tickets.TicketIssuer(load_or_generate_secret(TICKET_KEY_FILE))
+    reset_key = load_or_generate_secret(RESET_KEY_FILE)
 
     tun = TunDevice()
 
-    print("\nListening for UDP on port 9000...")
+    print(f"\nListening for UDP on port 9000 ({workers} worker{'s' if workers > 1 else ''})...")
     print("Configure: sudo ifconfig utun<X> 192.168.100.1 192.168.100.2 netmask 255.255.255.0 up")
     print("Packet format: [type 1B][stream 1B][seq 2B][data...]")
     print("  DATA=0x01, ACK=0x02")
     input("\nPress Enter after configuring interface...")
 
-    while True:
-        packet_bytes = tun.read()
-        if packet_bytes:
-            ip_header = IPHeader.from_bytes(packet_bytes)
-            if ip_header.protocol == protocols.PROTO_UDP:
-                udp_bytes = packet_bytes[ip_header.ihl * 4:]
-                udp_header = UDPHeader.from_bytes(udp_bytes)
-
-                if udp_header.dest_port == UDP_PORT:
-                    payload = udp_header.payload
-                    if len(payload) < 1:
-                        continue
-
-                    packet_type = payload[0]
-
-                    if packet_type == PACKET_INIT:
-                        conn_id = payload[1:9]
-                        their_public = int.from_bytes(payload[9:265], 'big')
-                        print(f"[{conn_id.hex()[:8]}] INIT received")
-
-                        shared_secret = crypto.compute_shared_secret(their_public, server_private)
-                        aes_key = crypto.derive_aes_key(shared_secret)
-
-                        connections[conn_id] = {
-                            'aes_key': aes_key,
-                            'last_addr': (ip_header.src_ip, udp_header.src_port)
-                        }
-                        print(f"[{conn_id.hex()[:8]}] Connection stored (key derived)")
-
-                        accept_payload = bytes([PACKET_ACCEPT]) + conn_id + server_public.to_bytes(256, 'big')
-                        send_udp(tun, ip_header.dest_ip, UDP_PORT, ip_header.src_ip, udp_header.src_port, accept_payload)
-                        print(f"[{conn_id.hex()[:8]}] ACCEPT sent\n")
-
-                    elif packet_type == PACKET_DATA:
-                        if len(payload) < 10:
-                            continue
-                        conn_id = payload[1:9]
-
-                        if conn_id not in connections:
-                            print(f"[{conn_id.hex()[:8]}] Unknown connection, dropping")
-                            continue
-
-                        conn = connections[conn_id]
-                        conn['last_addr'] = (ip_header.src_ip, udp_header.src_port)
-
-                        encrypted = payload[9:]
-                        decrypted = crypto.decrypt(conn['aes_key'], encrypted)
-
-                        pos = 0
-                        while pos < len(decrypted):
-                            frame_type, frame_data, consumed = frames.decode_frame(decrypted[pos:])
-                            if frame_type is None:
-                                break
-                            pos += consumed
-
-                            if frame_type == frames.FRAME_STREAM:
-                                stream_id, offset, data_bytes = frame_data
-                                data = data_bytes.decode('utf-8')
-                                print(f"[{conn_id.hex()[:8]}] [Stream {stream_id}] (offset {offset}) DATA: {data}")
-
-                                ack_frame = frames.encode_ack(stream_id, offset)
-                                ack_encrypted = crypto.encrypt(conn['aes_key'], ack_frame)
-                                ack_payload = bytes([PACKET_DATA]) + conn_id + ack_encrypted
-                                send_udp(tun, ip_header.dest_ip, UDP_PORT, ip_header.src_ip, udp_header.src_port, ack_payload)
-                                print(f"[{conn_id.hex()[:8]}] [Stream {stream_id}] (offset {offset}) ACK sent")
-
-                    elif packet_type == PACKET_ACK:
-                        stream_id = payload[1]
-                        seq = int.from_bytes(payload[2:4], 'big')
-                        print(f"[Stream {stream_id}] (seq {seq}) ACK received")
-
-                    elif packet_type == PACKET_0RTT:
-                        if len(payload) < 266:
-                            continue
-                        conn_id = payload[1:9]
-                        their_public = int.from_bytes(payload[9:265], 'big')
-                        encrypted = payload[265:]
-
-                        if conn_id not in connections:
-                            shared_secret = crypto.compute_shared_secret(their_public, server_private)
-                            aes_key = crypto.derive_aes_key(shared_secret)
-                            connections[conn_id] = {
-                                'aes_key': aes_key,
-                                'last_addr': (ip_header.src_ip, udp_header.src_port)
-                            }
-                            print(f"[{conn_id.hex()[:8]}] [0-RTT] Connection created (key derived)")
-
-                        conn = connections[conn_id]
-                        decrypted = crypto.decrypt(conn['aes_key'], encrypted)
-
-                        pos = 0
-                        while pos < len(decrypted):
-                            frame_type, frame_data, consumed = frames.decode_frame(decrypted[pos:])
-                            if frame_type is None:
-                                break
-                            pos += consumed
-
-                            if frame_type == frames.FRAME_STREAM:
-                                stream_id, offset, data_bytes = frame_data
-                                data = data_bytes.decode('utf-8')
-                                print(f"[{conn_id.hex()[:8]}] [0-RTT] [Stream {stream_id}] (offset {offset}) DATA: {data}")
-
-                                ack_frame = frames.encode_ack(stream_id, offset)
-                                ack_encrypted = crypto.encrypt(conn['aes_key'], ack_frame)
-                                ack_payload = bytes([PACKET_DATA]) + conn_id + ack_encrypted
-                                send_udp(tun, ip_header.dest_ip, UDP_PORT, ip_header.src_ip, udp_header.src_port, ack_payload)
-                                print(f"[{conn_id.hex()[:8]}] [0-RTT] [Stream {stream_id}] (offset {offset}) ACK sent")
+    run(tun, server_keys, reset_key, workers)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,185 @@
+"""
+Multi-process server: a thin front-end dispatching to N workers.
+
+One Python process is one core, and AEAD plus key agreement keep that
+core busy. Here the front-end only reads packets from the tun device,
+peeks at the connection ID and hands the raw packet to a worker:
+
+    worker = cid[0] % workers
+
+A client-chosen CID goes wherever its first byte says, and keeps going
+there for the rest of the connection. CIDs the server issues are picked
+so their first byte maps back to the issuing worker (see
+ConnectionIDManager), so the connection stays put when the client switches
+CIDs. Each worker owns its connections, keys and handshake pool. Workers
+write replies straight to the tun device they inherited across fork().
+
+The queues are single-producer/single-consumer rings in shared memory:
+the front-end copies a packet in, and the worker copies it out. There is
+no pickling and no feeder thread. A one-byte write to a pipe wakes the
+worker, so the worker can select() on its inbox next to its handshake pool.
+"""
+
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import sys
+from multiprocessing.shared_memory import SharedMemory
+
+RING_SIZE = 4 * 1024 * 1024
+RING_HEADER = 16
+LENGTH_SIZE = 4
+WRAP = 0xFFFFFFFF   # never a record length: records are at most RING_SIZE
+
+
+def worker_for(cid: bytes, workers: int) -> int:
+    return cid[0] % workers
+
+
+def peek_connection_id(ip_packet: bytes, port: int):
+    """CID of a QUIC packet inside a raw IPv4/UDP packet, or None."""
+    if len(ip_packet) < 20 or ip_packet[9] != socket.IPPROTO_UDP:
+        return None
+    ihl = (ip_packet[0] & 0x0F) * 4
+    if int.from_bytes(ip_packet[ihl + 2:ihl + 4], 'big') != port:
+        return None
+    start = ihl + 8 + 1
+    cid = ip_packet[start:start + 8]
+    return cid if len(cid) == 8 else None
+
+
+class ShmRing:
+    """
+    Byte ring in shared memory for one producer and one consumer process.
+
+    Layout: [head 8B][tail 8B][data]. Only the consumer writes head, only
+    the producer writes tail, and each publishes its counter after it has
+    finished touching the data, so no lock is needed. Records are
+    [length 4B][bytes]; one that doesn't fit before the end of the buffer
+    is preceded by a WRAP marker and starts again at offset 0. Four bytes,
+    not two: an IP packet may be 65535 bytes long.
+    """
+
+    def __init__(self, size: int = RING_SIZE):
+        self.shm = SharedMemory(create=True, size=RING_HEADER + size)
+        self.buf = self.shm.buf
+        self.size = size
+        struct.pack_into('QQ', self.buf, 0, 0, 0)
+
+    def put(self, record: bytes) -> bool:
+        """Append a record. False if the ring is full (the packet is dropped)."""
+        head, tail = struct.unpack_from('QQ', self.buf, 0)
+        needed = LENGTH_SIZE + len(record)
+        pos = tail % self.size
+        skip = self.size - pos if pos + needed > self.size else 0
+        if tail + skip + needed - head > self.size:
+            return False
+
+        if skip:
+            if skip >= LENGTH_SIZE:
+                struct.pack_into('I', self.buf, RING_HEADER + pos, WRAP)
+            tail += skip
+            pos = 0
+        start = RING_HEADER + pos
+        struct.pack_into('I', self.buf, start, len(record))
+        self.buf[start + LENGTH_SIZE:start + needed] = record
+        struct.pack_into('Q', self.buf, 8, tail + needed)
+        return True
+
+    def get(self):
+        """Remove and return every record currently in the ring."""
+        head, tail = struct.unpack_from('QQ', self.buf, 0)
+        records = []
+        while head < tail:
+            pos = head % self.size
+            if self.size - pos < LENGTH_SIZE:
+                head += self.size - pos
+                continue
+            length, = struct.unpack_from('I', self.buf, RING_HEADER + pos)
+            if length == WRAP:
+                head += self.size - pos
+                continue
+            start = RING_HEADER + pos + LENGTH_SIZE
+            records.append(bytes(self.buf[start:start + length]))
+            head += LENGTH_SIZE + length
+        struct.pack_into('Q', self.buf, 0, head)
+        return records
+
+    def close(self, unlink: bool = False):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class Inbox:
+    """A worker's queue: a ShmRing plus a doorbell pipe the worker can select() on."""
+
+    def __init__(self, index: int, workers: int, size: int = RING_SIZE):
+        self.index = index
+        self.workers = workers
+        self.ring = ShmRing(size)
+        self.bell_r, self.bell_w = os.pipe()
+        os.set_blocking(self.bell_r, False)
+        os.set_blocking(self.bell_w, False)
+
+    def fileno(self) -> int:
+        return self.bell_r
+
+    def put(self, packet: bytes) -> bool:
+        if not self.ring.put(packet):
+            return False
+        try:
+            os.write(self.bell_w, b'\0')
+        except BlockingIOError:
+            pass  # pipe full: the worker has wakeups pending anyway
+        return True
+
+    def get(self):
+        # Doorbell first, so a packet put after the ring drain still wakes us
+        try:
+            while os.read(self.bell_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        return self.ring.get()
+
+
+def _worker_main(target, args):
+    # Exit through finally blocks (e.g. the handshake pool's shutdown) on terminate()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    target(*args)
+
+
+class Dispatcher:
+    """
+    Forks `count` workers running target(*args, inbox) and routes packets
+    to them by CID. Create it before any threads exist (fork only copies
+    the calling thread). Workers aren't daemonic, as they start handshake
+    pools of their own; close() stops them.
+    """
+
+    def __init__(self, count: int, target, args=()):
+        context = multiprocessing.get_context('fork')
+        self.inboxes = [Inbox(index, count) for index in range(count)]
+        self.dropped = 0
+        self.processes = []
+        for index, inbox in enumerate(self.inboxes):
+            process = context.Process(target=_worker_main, args=(target, (*args, inbox)),
+                                      name=f"quic-worker-{index}")
+            process.start()
+            self.processes.append(process)
+
+    def dispatch(self, cid: bytes, packet: bytes):
+        if not self.inboxes[worker_for(cid, len(self.inboxes))].put(packet):
+            self.dropped += 1
+
+    def close(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        for inbox in self.inboxes:
+            inbox.ring.close(unlink=True)
@@ -1,11 +1,12 @@
 import sys
+import select
 import socket
 import struct
 from fcntl import ioctl
 from packet_headers import IPHeader
 from icmp_handler import handle_icmp_packet
 from udp_handler import handle_udp_packet
-from tcp_handler import handle_tcp_packet
+from tcp_handler import handle_tcp_packet, run_tcp_timers
 import protocols
 
 PF_SYSTEM = 32
@@ -88,6 +89,9 @@ class TunDevice:
         except OSError as e:
             print(f"TunDevice: Error writing packet: {e}", file=sys.stderr)
 
+    def fileno(self):
+        return self.sock.fileno()
+
     def close(self):
         print("TunDevice: close() called.")
         pass
@@ -107,6 +111,11 @@ class TCP_IP_Stack:
         print("------------------------------------------------------------------\n")
 
         while True:
+            # Wake for the next paced send or retransmission even without traffic
+            timeout = run_tcp_timers(self.tun)
+            readable, _, _ = select.select([self.tun], [], [], timeout)
+            if not readable:
+                continue
             packet_bytes = self.tun.read()
             if packet_bytes:
                 self._handle_packet(packet_bytes)
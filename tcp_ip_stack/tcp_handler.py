@@ -1,21 +1,168 @@
+import os
 import sys
+import time
 import random
 import socket
+from collections import deque
 from packet_headers import IPHeader, TCPHeader
 import protocols
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bbr
+
+# Any name in bbr.registry: newreno, cubic, bbr, bbr2
+CONGESTION_CONTROL = 'bbr'
+MSS = bbr.MSS
+DUP_ACK_THRESHOLD = 3
+INITIAL_RTO = 1.0
+MIN_RTO = 0.2
+RTO_FACTOR = 2
+
 class TCPConnection:
-    def __init__(self, key, isn, ack):
+    """
+    Data we send is queued, not written straight to the TUN device: flush()
+    releases segments while the congestion window has room and the pacing
+    interval has passed. The controller sees every data segment leave and
+    every ACK for it; three duplicate ACKs or a retransmission timeout
+    declare a segment lost and queue it again, ahead of new data. Our FIN
+    is tracked the same way, but never counted against the window.
+    """
+
+    def __init__(self, key, isn, ack, ip_header, tcp_header):
         self.key = key
         self.state = 'SYN_RECEIVED'
         self.my_seq_num = isn
         self.my_ack_num = ack
+        # Headers of the SYN: replies swap their addresses and ports
+        self.ip_header = ip_header
+        self.tcp_header = tcp_header
+
+        self.controller = bbr.create(CONGESTION_CONTROL)
+        # Start from what the last connection from this host measured
+        metrics = path_cache.get(ip_header.src_ip)
+        if metrics:
+            self.controller.warm_start(metrics, time.time())
+        self.decision = self.controller.update(time.time())
+        self.send_queue = deque()  # (seq, flags, payload, retransmission)
+        self.unacked = {}          # seq -> (sent time, SentPacket or None for the FIN, flags, payload)
+        self.snd_una = isn
+        self.bytes_in_flight = 0
+        self.dup_acks = 0
+        self.next_send_time = 0.0
 
     def establish(self):
         self.state = 'ESTABLISHED'
         self.my_seq_num += 1
+        self.snd_una = self.my_seq_num
+
+    def send(self, tun, payload, flags=protocols.TCP_FLAG_PSH | protocols.TCP_FLAG_ACK):
+        data_flags = flags & ~protocols.TCP_FLAG_FIN
+        for start in range(0, len(payload), MSS):
+            self.send_queue.append((self.my_seq_num, data_flags, payload[start:start + MSS], False))
+            self.my_seq_num += len(payload[start:start + MSS])
+        if flags & protocols.TCP_FLAG_FIN:
+            # FIN consumes 1 sequence number, and goes out alone after the data
+            self.send_queue.append((self.my_seq_num, flags, b'', False))
+            self.my_seq_num += 1
+        self.flush(tun, time.time())
+
+    def flush(self, tun, now):
+        """Send queued segments while the window has room and pacing allows."""
+        self.decision = self.controller.update(now)
+        while self.send_queue and now >= self.next_send_time:
+            seq, flags, payload, retransmission = self.send_queue[0]
+            if payload:
+                if self.bytes_in_flight + len(payload) > self.decision.cwnd * MSS:
+                    break  # window full: wait for an ACK
+                sent = self.controller.on_packet_sent(len(payload), now, self.bytes_in_flight, retransmission)
+                self.unacked[seq] = (now, sent, flags, payload)
+                self.bytes_in_flight += len(payload)
+                self.next_send_time = now + self.decision.pacing_interval
+            elif flags & protocols.TCP_FLAG_FIN:
+                self.unacked[seq] = (now, None, flags, payload)
+            self.send_queue.popleft()
+            send_tcp_packet(tun, self.ip_header, self.tcp_header, seq, self.my_ack_num, flags, payload)
+
+        # Room in the window but nothing to fill it with: delivery rates from
+        # here on measure us, not the path
+        if not self.send_queue and self.bytes_in_flight < self.decision.cwnd * MSS:
+            self.controller.on_app_limited(self.bytes_in_flight)
+
+    def on_ack(self, tun, ack_num, duplicate_candidate, now):
+        """duplicate_candidate: the segment carried no data, SYN or FIN."""
+        acked = [seq for seq, (_, _, flags, payload) in self.unacked.items()
+                 if seq + segment_length(flags, payload) <= ack_num]
+        if acked:
+            for seq in acked:
+                _, sent, _, _ = self.unacked.pop(seq)
+                if sent is not None:
+                    self.bytes_in_flight -= sent.size
+                    self.controller.on_ack(sent, now)
+            self.dup_acks = 0
+        elif duplicate_candidate and ack_num == self.snd_una and ack_num in self.unacked:
+            self.dup_acks += 1
+            if self.dup_acks == DUP_ACK_THRESHOLD:
+                print(f"   >>> {DUP_ACK_THRESHOLD} duplicate ACKs. Retransmitting seq {ack_num}...")
+                self.retransmit(ack_num, now)
+        self.snd_una = max(self.snd_una, ack_num)
+        self.flush(tun, now)
+
+    def on_timer(self, tun, now):
+        rto = self.retransmission_timeout()
+        lost = [seq for seq, (sent_time, _, _, _) in self.unacked.items() if now - sent_time >= rto]
+        for seq in lost:
+            print(f"   >>> Retransmission timeout. Retransmitting seq {seq}...")
+            self.retransmit(seq, now)
+        self.flush(tun, now)
+
+    def close(self):
+        metrics = self.controller.path_metrics(time.time())
+        if metrics:
+            path_cache.put(self.ip_header.src_ip, metrics)
+
+    def retransmit(self, seq, now):
+        _, sent, flags, payload = self.unacked.pop(seq)
+        if sent is not None:
+            self.bytes_in_flight -= sent.size
+            self.controller.on_loss(sent, now)
+        self.send_queue.appendleft((seq, flags, payload, True))
+
+    def retransmission_timeout(self):
+        if not self.decision.avg_rtt:
+            return INITIAL_RTO
+        return max(MIN_RTO, RTO_FACTOR * self.decision.avg_rtt)
+
+    def next_deadline(self):
+        """When on_timer() next has something to do, or None."""
+        deadlines = []
+        if self.send_queue:
+            _, _, payload, _ = self.send_queue[0]
+            if self.bytes_in_flight + len(payload) <= self.decision.cwnd * MSS:
+                deadlines.append(self.next_send_time)
+        if self.unacked:
+            oldest = min(sent_time for sent_time, _, _, _ in self.unacked.values())
+            deadlines.append(oldest + self.retransmission_timeout())
+        return min(deadlines, default=None)
+
+def segment_length(flags, payload):
+    """Sequence space a segment takes: its data, plus one for a FIN."""
+    return len(payload) + (1 if flags & protocols.TCP_FLAG_FIN else 0)
 
 tcp_connections = {}
+path_cache = bbr.PathCache()
+
+def run_tcp_timers(tun):
+    """Fire due pacing and retransmission timers. Returns seconds until the next one, or None."""
+    now = time.time()
+    deadlines = []
+    for conn in list(tcp_connections.values()):
+        conn.on_timer(tun, now)
+        deadline = conn.next_deadline()
+        if deadline is not None:
+            deadlines.append(deadline)
+    if not deadlines:
+        return None
+    return max(0.0, min(deadlines) - time.time())
 
 def handle_tcp_packet(tun, ip_header, tcp_bytes):
     try:
@@ -36,7 +183,7 @@ def handle_tcp_packet(tun, ip_header, tcp_bytes):
             their_ack_num = tcp_header.seq_num + 1
 
             # Create new connection object
-            conn = TCPConnection(conn_key, my_isn, their_ack_num)
+            conn = TCPConnection(conn_key, my_isn, their_ack_num, ip_header, tcp_header)
             tcp_connections[conn_key] = conn
 
             send_tcp_packet(tun, ip_header, tcp_header, conn.my_seq_num, conn.my_ack_num, protocols.TCP_FLAG_SYN | protocols.TCP_FLAG_ACK)
@@ -47,6 +194,10 @@ def handle_tcp_packet(tun, ip_header, tcp_bytes):
             if (tcp_header.flags & protocols.TCP_FLAG_ACK) and conn.state == 'SYN_RECEIVED':
                 print("   >>> Received ACK. Connection ESTABLISHED.")
                 conn.establish()
+            elif tcp_header.flags & protocols.TCP_FLAG_ACK:
+                # Only segments without data, SYN or FIN count as duplicate ACKs
+                duplicate_candidate = payload_len == 0 and not (tcp_header.flags & protocols.TCP_FLAG_FIN)
+                conn.on_ack(tun, tcp_header.ack_num, duplicate_candidate, time.time())
 
             if payload_len > 0:
                 expected_seq = conn.my_ack_num
@@ -67,8 +218,7 @@ def handle_tcp_packet(tun, ip_header, tcp_bytes):
                     if reply:
                         reply_payload = (reply + "\n").encode('utf-8')
                         print(f"   >>> Sending: {reply}")
-                        send_tcp_packet(tun, ip_header, tcp_header, conn.my_seq_num, conn.my_ack_num, protocols.TCP_FLAG_PSH | protocols.TCP_FLAG_ACK, reply_payload)
-                        conn.my_seq_num += len(reply_payload)
+                        conn.send(tun, reply_payload)
 
             # --- Teardown: FIN ---
             if (tcp_header.flags & protocols.TCP_FLAG_FIN):
@@ -78,17 +228,16 @@ def handle_tcp_packet(tun, ip_header, tcp_bytes):
                 conn.my_ack_num = tcp_header.seq_num + payload_len + 1
                 
                 # Send ACK to confirm their FIN
-                # AND send our own FIN to close our side
+                # AND send our own FIN to close our side, after any queued data
                 # Flags: FIN | ACK
-                send_tcp_packet(tun, ip_header, tcp_header, conn.my_seq_num, conn.my_ack_num, protocols.TCP_FLAG_FIN | protocols.TCP_FLAG_ACK)
-                
-                # Our FIN consumes 1 sequence number
-                conn.my_seq_num += 1
+                conn.send(tun, b'', protocols.TCP_FLAG_FIN | protocols.TCP_FLAG_ACK)
                 conn.state = 'LAST_ACK'
 
             # --- Teardown: Final ACK ---
-            elif (tcp_header.flags & protocols.TCP_FLAG_ACK) and conn.state == 'LAST_ACK':
+            elif (tcp_header.flags & protocols.TCP_FLAG_ACK) and conn.state == 'LAST_ACK' and \
+                 tcp_header.ack_num >= conn.my_seq_num:
                 print("   >>> Received Final ACK. Connection CLOSED.")
+                conn.close()
                 del tcp_connections[conn_key]
 
         # 3. Unknown Connection (Closed/Listen State) - RFC 793